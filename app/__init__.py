@@ -3,6 +3,7 @@ from flask_cors import CORS
 import logging
 import os
 from dotenv import load_dotenv
+from app.logging_config import configure_logging
 
 # Load environment variables
 load_dotenv()
@@ -10,20 +11,10 @@ load_dotenv()
 def create_app():
     """Create and configure the Flask application"""
     
-    # Configure logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler("data/logs/app.log"),
-            logging.StreamHandler()
-        ]
-    )
+    # Configure logging (handlers run on a background queue listener)
+    configure_logging("data/logs/app.log")
     logger = logging.getLogger(__name__)
     
-    # Create log directory if not exists
-    os.makedirs('data/logs', exist_ok=True)
-    
     # Initialize Flask app
     app = Flask(__name__, static_folder='static')
     CORS(app)
@@ -78,6 +78,7 @@ def get_database_stats():
         return jsonify({
             'status': 'success',
             'stats': stats,
+            'ipReputationCache': ip_reputation_checker.get_cache_stats(),
             'userList': user_list
         })
     except Exception as e:
@@ -1,17 +1,237 @@
 import os
+import sys
 import json
 import logging
 from datetime import datetime
+from functools import lru_cache
 import time
+import threading
+import orjson
 import pymongo
 import redis
 from dotenv import load_dotenv
+from app.utils.sliding_window import SlidingWindowStore, ATTACK_TIMESTAMP_LIMIT
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Unfiltered recent failed logins, shared by all Database instances:
+# {minutes: (expiry, records)}. Cleared whenever a failed login is recorded.
+_FAILED_LOGINS_CACHE = {}
+_FAILED_LOGINS_CACHE_LOCK = threading.Lock()
+_FAILED_LOGINS_CACHE_TTL = 2.0
+_failed_logins_generation = 0
+
+# Number of users / IPs reported as examples in password attack stats
+_ATTACK_SAMPLE_SIZE = 10
+
+# Incremental failed login windows for file storage, shared by all Database instances:
+# {window key: (resync time, SlidingWindowStore)}. Failures recorded by this process are
+# added as they happen; stores are rebuilt from storage periodically to pick up the rest.
+_FAILURE_WINDOW_STORES = {}
+_FAILURE_WINDOW_STORES_LOCK = threading.Lock()
+_FAILURE_WINDOW_RESYNC = 60.0
+
+def _user_facets(user_id, ip_address, windows, now, suffix=''):
+    """Facets of the password attack stats that depend on the user"""
+    return {
+        'user' + suffix: [
+            {'$match': {'username': user_id}},
+            {'$count': 'count'}
+        ],
+        'bruteforce' + suffix: [
+            {'$match': {
+                'username': user_id,
+                'ip_address': ip_address,
+                'timestamp': {'$gte': now - windows['bruteforce']}
+            }},
+            {'$count': 'count'}
+        ]
+    }
+
+def _distinct_facets(name, match, field):
+    """
+    Facets counting distinct values of a field and sampling a few of them
+    
+    Values are grouped and counted as a stream, so no facet output grows with
+    the number of failures.
+    """
+    return {
+        name + '_count': [
+            {'$match': match},
+            {'$group': {'_id': field}},
+            {'$count': 'count'}
+        ],
+        name: [
+            {'$match': match},
+            {'$group': {'_id': field}},
+            {'$limit': _ATTACK_SAMPLE_SIZE}
+        ]
+    }
+
+def _ip_facets(ip_address, windows, now, suffix=''):
+    """Facets of the password attack stats that depend only on the IP"""
+    return {
+        'ip' + suffix + '_count': [
+            {'$match': {'ip_address': ip_address}},
+            {'$count': 'count'}
+        ],
+        # Only the most recent failures are needed for velocity and acceleration
+        'ip' + suffix: [
+            {'$match': {'ip_address': ip_address}},
+            {'$sort': {'timestamp': -1}},
+            {'$limit': ATTACK_TIMESTAMP_LIMIT},
+            {'$sort': {'timestamp': 1}},
+            {'$group': {'_id': None, 'timestamps': {'$push': '$timestamp'}}}
+        ],
+        **_distinct_facets(
+            'stuffing_users' + suffix,
+            {'ip_address': ip_address, 'timestamp': {'$gte': now - windows['credential_stuffing']}},
+            '$username'
+        )
+    }
+
+def _spraying_facets(windows, now):
+    """Facets of the password attack stats shared by every user and IP"""
+    match = {'timestamp': {'$gte': now - windows['password_spraying']}}
+    return {
+        **_distinct_facets('spraying_users', match, '$username'),
+        **_distinct_facets('spraying_ips', match, '$ip_address')
+    }
+
+def password_attack_stats_pipeline(user_id, ip_address, windows, now):
+    """
+    MongoDB aggregation computing password attack stats over failed_logins in one query
+    
+    Args:
+        user_id (str): User identifier
+        ip_address (str): IP address
+        windows (dict): Window lengths in seconds for 'generic', 'bruteforce',
+            'credential_stuffing' and 'password_spraying'
+        now (float): Reference time for all windows
+        
+    Returns:
+        list: Aggregation pipeline producing a single facet document
+    """
+    return [
+        {'$match': {'timestamp': {'$gt': int(now) - windows['generic']}}},
+        {'$facet': {
+            **_user_facets(user_id, ip_address, windows, now),
+            **_ip_facets(ip_address, windows, now),
+            **_spraying_facets(windows, now)
+        }}
+    ]
+
+def password_attack_stats_batch_pipeline(pairs, ip_addresses, windows, now):
+    """
+    MongoDB aggregation computing password attack stats for several checks in one query
+    
+    Args:
+        pairs (list): (user_id, ip_address) tuples needing user stats
+        ip_addresses (list): IP addresses needing IP stats
+        windows (dict): Window lengths in seconds, as for password_attack_stats_pipeline
+        now (float): Reference time for all windows
+        
+    Returns:
+        list: Aggregation pipeline producing a single facet document
+              (see password_attack_stats_from_batch_facets)
+    """
+    facets = {}
+    for i, (user_id, ip_address) in enumerate(pairs):
+        facets.update(_user_facets(user_id, ip_address, windows, now, f'_u{i}'))
+    for i, ip_address in enumerate(ip_addresses):
+        facets.update(_ip_facets(ip_address, windows, now, f'_ip{i}'))
+    if ip_addresses:
+        facets.update(_spraying_facets(windows, now))
+    
+    return [
+        {'$match': {'timestamp': {'$gt': int(now) - windows['generic']}}},
+        {'$facet': facets}
+    ]
+
+def _first_facet(facets, name):
+    """First document of a facet, or an empty dict if it matched nothing"""
+    return facets[name][0] if facets.get(name) else {}
+
+def _user_stats_from_facets(facets, suffix=''):
+    return {
+        'user_failures_count': _first_facet(facets, 'user' + suffix).get('count', 0),
+        'bruteforce_attempts': _first_facet(facets, 'bruteforce' + suffix).get('count', 0)
+    }
+
+def _ip_stats_from_facets(facets, suffix=''):
+    def count(name):
+        return _first_facet(facets, name + '_count').get('count', 0)
+    
+    def sample(name):
+        return [doc['_id'] for doc in facets.get(name, [])]
+    
+    return {
+        'ip_failures_count': count('ip' + suffix),
+        'ip_failure_timestamps': _first_facet(facets, 'ip' + suffix).get('timestamps', []),
+        'stuffing_user_count': count('stuffing_users' + suffix),
+        'stuffing_users': sample('stuffing_users' + suffix),
+        'spraying_user_count': count('spraying_users'),
+        'spraying_ip_count': count('spraying_ips'),
+        'spraying_users': sample('spraying_users'),
+        'spraying_ips': sample('spraying_ips')
+    }
+
+def password_attack_stats_from_facets(facets):
+    """
+    Flatten the facet document produced by password_attack_stats_pipeline
+    
+    Args:
+        facets (dict): Aggregation result document
+        
+    Returns:
+        dict: Password attack stats, see Database.get_password_attack_stats
+    """
+    return {**_user_stats_from_facets(facets), **_ip_stats_from_facets(facets)}
+
+def password_attack_stats_from_batch_facets(facets, pairs, ip_addresses):
+    """
+    Flatten the facet document produced by password_attack_stats_batch_pipeline
+    
+    Args:
+        facets (dict): Aggregation result document
+        pairs (list): (user_id, ip_address) tuples the pipeline was built for
+        ip_addresses (list): IP addresses the pipeline was built for
+        
+    Returns:
+        tuple: (user stats for each pair, {ip_address: IP stats})
+    """
+    user_stats = [_user_stats_from_facets(facets, f'_u{i}') for i in range(len(pairs))]
+    ip_stats = {ip_address: _ip_stats_from_facets(facets, f'_ip{i}') for i, ip_address in enumerate(ip_addresses)}
+    return user_stats, ip_stats
+
+def _empty_user_stats():
+    """User password attack stats reported when failed logins cannot be read"""
+    return {
+        'user_failures_count': 0,
+        'bruteforce_attempts': 0
+    }
+
+def _empty_ip_stats():
+    """IP password attack stats reported when failed logins cannot be read"""
+    return {
+        'ip_failures_count': 0,
+        'ip_failure_timestamps': [],
+        'stuffing_user_count': 0,
+        'stuffing_users': [],
+        'spraying_user_count': 0,
+        'spraying_ip_count': 0,
+        'spraying_users': [],
+        'spraying_ips': []
+    }
+
+@lru_cache(maxsize=None)
+def _mongo_client(mongo_uri):
+    """Shared MongoClient per URI, so every Database instance uses one connection pool"""
+    return pymongo.MongoClient(mongo_uri, maxPoolSize=50, minPoolSize=5, waitQueueTimeoutMS=2000)
+
 class Database:
     """
     Database handling class for storing and retrieving fraud detection data.
@@ -25,7 +245,7 @@ class Database:
         if self.db_type == 'mongodb':
             # MongoDB connection
             mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-            self.mongo_client = pymongo.MongoClient(mongo_uri)
+            self.mongo_client = _mongo_client(mongo_uri)
             self.mongo_db = self.mongo_client[os.getenv('MONGO_DB', 'fraud_detection')]
             
             # Redis connection for caching and rate limiting
@@ -174,6 +394,46 @@ class Database:
             logger.error(f"Error getting login history for user {user_id}: {str(e)}")
             return []
     
+    def get_login_histories(self, user_ids, limit=10):
+        """
+        Get login history for many users at once
+        
+        Args:
+            user_ids (list): User identifiers
+            limit (int): Maximum number of logins to return per user
+            
+        Returns:
+            dict: Mapping of user_id to list of login records (newest first)
+        """
+        histories = {user_id: [] for user_id in user_ids}
+        
+        try:
+            if self.db_type == 'mongodb':
+                # One query for all users; $topN keeps only the newest logins per user
+                # while grouping, so no group ever holds a user's full history
+                grouped = self.mongo_db.logins.aggregate([
+                    {'$match': {'user_id': {'$in': list(histories)}}},
+                    {'$group': {
+                        '_id': '$user_id',
+                        'logins': {'$topN': {'n': limit, 'sortBy': {'timestamp': -1}, 'output': '$$ROOT'}}
+                    }}
+                ])
+                
+                for group in grouped:
+                    for login in group['logins']:
+                        if isinstance(login.get('timestamp'), datetime):
+                            login['timestamp'] = int(login['timestamp'].timestamp())
+                    histories[group['_id']] = group['logins']
+            else:
+                for user_id in histories:
+                    histories[user_id] = self.get_login_history(user_id, limit)
+            
+            return histories
+            
+        except Exception as e:
+            logger.error(f"Error getting login histories for {len(histories)} users: {str(e)}")
+            return histories
+    
     def store_ip_data(self, ip_address, data):
         """
         Store data about an IP address
@@ -195,28 +455,32 @@ class Database:
                 )
             else:
                 # Store in file system
-                ip_file = f"{self.data_dir}/ip_data/{ip_address.replace(':', '_')}.json"
-                
-                # Read existing data
-                if os.path.exists(ip_file):
-                    with open(ip_file, 'r') as f:
-                        existing_data = json.load(f)
-                else:
-                    existing_data = {}
-                
-                # Update data
-                existing_data.update(data)
-                existing_data['updated_at'] = int(time.time())
-                
-                # Write back to file
-                with open(ip_file, 'w') as f:
-                    json.dump(existing_data, f)
+                self._store_ip_file(ip_address, data)
                 
             logger.debug(f"Stored data for IP {ip_address}")
             
         except Exception as e:
             logger.error(f"Error storing IP data: {str(e)}")
     
+    def _store_ip_file(self, ip_address, data):
+        """Merge data into an IP's file, raising on I/O errors"""
+        ip_file = f"{self.data_dir}/ip_data/{ip_address.replace(':', '_')}.json"
+        
+        # Read existing data
+        if os.path.exists(ip_file):
+            with open(ip_file, 'r') as f:
+                existing_data = json.load(f)
+        else:
+            existing_data = {}
+        
+        # Update data
+        existing_data.update(data)
+        existing_data['updated_at'] = int(time.time())
+        
+        # Write back to file
+        with open(ip_file, 'w') as f:
+            json.dump(existing_data, f)
+    
     def get_ip_data(self, ip_address):
         """
         Get data about an IP address
@@ -268,6 +532,8 @@ class Database:
             username (str): Username
             ip_address (str): IP address
         """
+        global _failed_logins_generation
+        
         timestamp = int(time.time())
         
         try:
@@ -310,6 +576,16 @@ class Database:
                 # Write back to file
                 with open(failed_file, 'w') as f:
                     json.dump(failed_logins, f)
+            
+            # Cached windows no longer include every failure
+            with _FAILED_LOGINS_CACHE_LOCK:
+                _FAILED_LOGINS_CACHE.clear()
+                _failed_logins_generation += 1
+            
+            with _FAILURE_WINDOW_STORES_LOCK:
+                stores = [store for _, store in _FAILURE_WINDOW_STORES.values()]
+            for store in stores:
+                store.add(timestamp, username, ip_address)
                 
             logger.info(f"Recorded failed login for {username} from {ip_address}")
             
@@ -320,6 +596,9 @@ class Database:
         """
         Get recent failed login attempts
         
+        Unfiltered queries are served from a cache for up to a couple of seconds,
+        since every password attack check asks for the same window.
+        
         Args:
             username (str): Optional username filter
             ip_address (str): Optional IP address filter
@@ -328,6 +607,28 @@ class Database:
         Returns:
             list: List of failed login records
         """
+        if username or ip_address:
+            return self._fetch_recent_failed_logins(username, ip_address, minutes)
+        
+        now = time.time()
+        with _FAILED_LOGINS_CACHE_LOCK:
+            entry = _FAILED_LOGINS_CACHE.get(minutes)
+            generation = _failed_logins_generation
+        
+        if entry and entry[0] > now:
+            return list(entry[1])
+        
+        failed = self._fetch_recent_failed_logins(None, None, minutes)
+        
+        with _FAILED_LOGINS_CACHE_LOCK:
+            # Skip storing if a failed login was recorded while this query ran
+            if generation == _failed_logins_generation:
+                _FAILED_LOGINS_CACHE[minutes] = (now + _FAILED_LOGINS_CACHE_TTL, failed)
+        
+        return list(failed)
+    
+    def _fetch_recent_failed_logins(self, username, ip_address, minutes):
+        """Query failed login attempts from storage, bypassing the cache"""
         cutoff_time = int(time.time()) - (minutes * 60)
         
         try:
@@ -364,9 +665,12 @@ class Database:
                                 file_path = os.path.join(failed_dir, filename)
                                 with open(file_path, 'r') as f:
                                     user_failed = json.load(f)
-                                    # Add username to each record
+                                    # Add username to each record, one shared string per file;
+                                    # IPs are interned so repeats share one string too
+                                    username = sys.intern(filename[:-5])
                                     for record in user_failed:
-                                        record['username'] = filename[:-5]
+                                        record['username'] = username
+                                        record['ip_address'] = sys.intern(record['ip_address'])
                                     all_failed.extend(user_failed)
                 
                 # Filter by timestamp and IP if needed
@@ -382,6 +686,104 @@ class Database:
             logger.error(f"Error getting recent failed logins: {str(e)}")
             return []
     
+    def get_password_attack_stats(self, user_id, ip_address, windows, now=None):
+        """
+        Get the failed login counts password attack detection compares against its thresholds
+        
+        Args:
+            user_id (str): User identifier
+            ip_address (str): IP address
+            windows (dict): Window lengths in seconds for 'generic', 'bruteforce',
+                'credential_stuffing' and 'password_spraying'
+            now (float): Reference time for all windows (defaults to current time)
+            
+        Returns:
+            dict: Failure counts for the user and IP, the IP's most recent failure
+                  timestamps (ascending, at most ATTACK_TIMESTAMP_LIMIT), and distinct
+                  user/IP counts with up to 10 examples for the credential stuffing
+                  and password spraying windows
+        """
+        if now is None:
+            now = time.time()
+        
+        try:
+            if self.db_type == 'mongodb':
+                # All counts in a single aggregation round trip
+                facets = next(self.mongo_db.failed_logins.aggregate(
+                    password_attack_stats_pipeline(user_id, ip_address, windows, now)
+                ))
+                return password_attack_stats_from_facets(facets)
+            else:
+                return self._failure_window_store(windows).stats(user_id, ip_address, now)
+                
+        except Exception as e:
+            logger.error(f"Error getting password attack stats: {str(e)}")
+            return {**_empty_user_stats(), **_empty_ip_stats()}
+    
+    def get_password_attack_stats_batch(self, pairs, ip_addresses, windows, now=None):
+        """
+        Get password attack stats for several checks in one query
+        
+        User stats and IP stats are returned separately so callers can reuse
+        IP stats they already hold and only ask for the IPs they are missing.
+        
+        Args:
+            pairs (list): (user_id, ip_address) tuples needing user stats
+            ip_addresses (list): IP addresses needing IP stats
+            windows (dict): Window lengths in seconds, as for get_password_attack_stats
+            now (float): Reference time for all windows (defaults to current time)
+            
+        Returns:
+            tuple: (list of user stats for each pair, in order, with user_failures_count
+                   and bruteforce_attempts; {ip_address: remaining stats})
+        """
+        if now is None:
+            now = time.time()
+        
+        try:
+            if self.db_type == 'mongodb':
+                facets = next(self.mongo_db.failed_logins.aggregate(
+                    password_attack_stats_batch_pipeline(pairs, ip_addresses, windows, now)
+                ))
+                return password_attack_stats_from_batch_facets(facets, pairs, ip_addresses)
+            else:
+                store = self._failure_window_store(windows)
+                user_stats = [store.user_stats(user_id, ip_address, now) for user_id, ip_address in pairs]
+                ip_stats = {ip_address: store.ip_stats(ip_address, now) for ip_address in ip_addresses}
+                return user_stats, ip_stats
+                
+        except Exception as e:
+            logger.error(f"Error getting password attack stats: {str(e)}")
+            return [_empty_user_stats() for _ in pairs], {ip_address: _empty_ip_stats() for ip_address in ip_addresses}
+    
+    def _failure_window_store(self, windows):
+        """
+        Get the sliding window store for a set of windows, building it from storage
+        when missing or due for a resync
+        
+        Args:
+            windows (dict): Window lengths in seconds, as for get_password_attack_stats
+            
+        Returns:
+            SlidingWindowStore: Store holding the failed logins within the windows
+        """
+        key = tuple(sorted(windows.items()))
+        now = time.time()
+        
+        with _FAILURE_WINDOW_STORES_LOCK:
+            entry = _FAILURE_WINDOW_STORES.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        
+        store = SlidingWindowStore(windows)
+        failures = self._fetch_recent_failed_logins(None, None, max(windows.values()) // 60)
+        for failure in sorted(failures, key=lambda f: f['timestamp']):
+            store.add(failure['timestamp'], failure['username'], failure['ip_address'])
+        
+        with _FAILURE_WINDOW_STORES_LOCK:
+            _FAILURE_WINDOW_STORES[key] = (now + _FAILURE_WINDOW_RESYNC, store)
+        return store
+    
     def get_ip_reputation(self, ip_address):
         """
         Get reputation data for an IP
@@ -397,7 +799,10 @@ class Database:
         if ip_data and 'reputation' in ip_data:
             return ip_data['reputation']
         
-        # Default reputation for new IPs
+        return self._default_ip_reputation()
+    
+    def _default_ip_reputation(self):
+        """Default reputation for new IPs"""
         return {
             'score': 50,  # Neutral score
             'is_proxy': False,
@@ -407,6 +812,68 @@ class Database:
             'countries_count': 0
         }
     
+    def get_ip_bundle(self, ip_address, failed_window_minutes=1440):
+        """
+        Get reputation, location and recent failed login count for an IP in one lookup
+        
+        Args:
+            ip_address (str): IP address
+            failed_window_minutes (int): Time window for counting failed logins
+            
+        Returns:
+            dict: {'reputation': dict, 'location': dict or None, 'failed_logins_24h': int or None}
+                failed_logins_24h is None when the backend cannot count it in the same
+                lookup; callers count it themselves only if they need it
+        """
+        cutoff_time = int(time.time()) - (failed_window_minutes * 60)
+        
+        try:
+            if self.db_type == 'mongodb':
+                # Fetch the IP document and count its failed logins in a single round trip
+                docs = list(self.mongo_db.ip_data.aggregate([
+                    {'$match': {'ip_address': ip_address}},
+                    {'$limit': 1},
+                    {'$lookup': {
+                        'from': 'failed_logins',
+                        'pipeline': [
+                            {'$match': {'ip_address': ip_address, 'timestamp': {'$gt': cutoff_time}}},
+                            {'$count': 'count'}
+                        ],
+                        'as': 'failed_logins_window'
+                    }}
+                ]))
+                
+                if docs:
+                    ip_data = docs[0]
+                    counts = ip_data.pop('failed_logins_window')
+                    failed_count = counts[0]['count'] if counts else 0
+                else:
+                    # Unknown IP, nothing to join against
+                    ip_data = None
+                    failed_count = self.mongo_db.failed_logins.count_documents({
+                        'ip_address': ip_address,
+                        'timestamp': {'$gt': cutoff_time}
+                    })
+            else:
+                # Counting means reading every failed-login file, so leave it to the caller
+                ip_data = self.get_ip_data(ip_address)
+                failed_count = None
+            
+            return {
+                'reputation': ip_data['reputation'] if ip_data and 'reputation' in ip_data
+                              else self._default_ip_reputation(),
+                'location': ip_data.get('location') if ip_data else None,
+                'failed_logins_24h': failed_count
+            }
+            
+        except Exception as e:
+            logger.error(f"Error getting IP bundle for {ip_address}: {str(e)}")
+            return {
+                'reputation': self._default_ip_reputation(),
+                'location': None,
+                'failed_logins_24h': 0
+            }
+    
     def update_ip_reputation(self, ip_address, reputation_data):
         """
         Update reputation data for an IP
@@ -416,6 +883,38 @@ class Database:
             reputation_data (dict): Reputation data to update
         """
         self.store_ip_data(ip_address, {'reputation': reputation_data})
+    
+    def update_ip_reputations(self, updates):
+        """
+        Update reputation data for many IPs at once
+        
+        Args:
+            updates (list): List of (ip_address, reputation_data) tuples
+            
+        Returns:
+            bool: True if every update was written
+        """
+        try:
+            if self.db_type == 'mongodb':
+                now = int(time.time())
+                self.mongo_db.ip_data.bulk_write([
+                    pymongo.UpdateOne(
+                        {'ip_address': ip_address},
+                        {'$set': {'reputation': reputation_data, 'updated_at': now}},
+                        upsert=True
+                    )
+                    for ip_address, reputation_data in updates
+                ], ordered=False)
+            else:
+                for ip_address, reputation_data in updates:
+                    self._store_ip_file(ip_address, {'reputation': reputation_data})
+                    
+            logger.debug(f"Updated reputation for {len(updates)} IPs")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error updating IP reputations: {str(e)}")
+            return False
 
     # Add these methods to your Database class
 
@@ -452,8 +951,8 @@ class Database:
                     # Try to find by device ID
                     device_file = f"{devices_dir}/{device_id}.json"
                     if os.path.exists(device_file):
-                        with open(device_file, 'r') as f:
-                            return json.load(f)
+                        with open(device_file, 'rb') as f:
+                            return orjson.loads(f.read())
                     return None
                 
                 elif user_id:
@@ -463,8 +962,8 @@ class Database:
                         for filename in os.listdir(devices_dir):
                             if filename.endswith('.json'):
                                 file_path = os.path.join(devices_dir, filename)
-                                with open(file_path, 'r') as f:
-                                    device_data = json.load(f)
+                                with open(file_path, 'rb') as f:
+                                    device_data = orjson.loads(f.read())
                                     if device_data.get('user_id') == user_id:
                                         user_devices.append(device_data)
                     return user_devices
@@ -519,14 +1018,73 @@ class Database:
                 device_data['updated_at'] = int(time.time())
                 
                 # Write to file
-                with open(device_file, 'w') as f:
-                    json.dump(device_data, f)
+                with open(device_file, 'wb') as f:
+                    f.write(orjson.dumps(device_data))
                     
             logger.debug(f"Stored data for device {device_id}")
             
         except Exception as e:
             logger.error(f"Error storing device data: {str(e)}")
 
+    def record_visit(self, device_id, timestamp, fingerprint_data, issues):
+        """
+        Record a visit from a device in a single storage round trip
+        
+        Args:
+            device_id (str): Device identifier
+            timestamp (int): Visit timestamp
+            fingerprint_data (dict): Fingerprint collected on this visit
+            issues (list): Issues detected on this visit
+        """
+        try:
+            if self.db_type == 'mongodb':
+                # Upsert with server-side mutations, no read of the existing document
+                self.mongo_db.devices.update_one(
+                    {'device_id': device_id},
+                    {
+                        '$setOnInsert': {'first_seen': timestamp},
+                        '$set': {'last_seen': timestamp, 'updated_at': timestamp},
+                        '$inc': {'visit_count': 1},
+                        # Keep only the most recent 5 fingerprints
+                        '$push': {'fingerprints': {'$each': [fingerprint_data], '$slice': -5}},
+                        '$addToSet': {'issues_history': {'$each': issues}}
+                    },
+                    upsert=True
+                )
+            else:
+                # Store in file system
+                devices_dir = f"{self.data_dir}/devices"
+                os.makedirs(devices_dir, exist_ok=True)
+                
+                device_file = f"{devices_dir}/{device_id}.json"
+                
+                # Read existing data
+                if os.path.exists(device_file):
+                    with open(device_file, 'rb') as f:
+                        device_data = orjson.loads(f.read())
+                else:
+                    device_data = {'device_id': device_id, 'first_seen': timestamp}
+                
+                # Update visit data
+                device_data['last_seen'] = timestamp
+                device_data['updated_at'] = timestamp
+                device_data['visit_count'] = device_data.get('visit_count', 0) + 1
+                device_data['fingerprints'] = (device_data.get('fingerprints', []) + [fingerprint_data])[-5:]
+                
+                # Deduplicate issues with a set, serialized as a sorted list
+                issues_history = set(device_data.get('issues_history', ()))
+                issues_history.update(issues)
+                device_data['issues_history'] = sorted(issues_history)
+                
+                # Write back to file
+                with open(device_file, 'wb') as f:
+                    f.write(orjson.dumps(device_data))
+                
+            logger.debug(f"Recorded visit for device {device_id}")
+            
+        except Exception as e:
+            logger.error(f"Error recording device visit: {str(e)}")
+
     def get_registrations(self, start_time=None, end_time=None, ip_address=None):
         """
         Get account registrations within a time period
@@ -611,6 +1169,58 @@ class Database:
             logger.error(f"Error getting user model for {user_id}: {str(e)}")
             return None
 
+    def get_user_model_version(self, user_id):
+        """
+        Get the version of a user's stored behavior model without loading the model
+        
+        Args:
+            user_id (str): User identifier
+            
+        Returns:
+            int: Version that changes on every update_user_model, or None if no model is stored
+        """
+        try:
+            if self.db_type == 'mongodb':
+                model = self.mongo_db.user_models.find_one(
+                    {'user_id': user_id}, {'model_version': 1, '_id': 0}
+                )
+                return None if model is None else model.get('model_version', 0)
+            else:
+                # The file's modification time changes on every write
+                return os.stat(f"{self.data_dir}/user_models/{user_id}.json").st_mtime_ns
+                
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error getting user model version for {user_id}: {str(e)}")
+            return None
+
+    def get_user_models(self, user_ids):
+        """
+        Get behavior models for many users at once
+        
+        Args:
+            user_ids (list): User identifiers
+            
+        Returns:
+            dict: Mapping of user_id to behavior model, or None if not found
+        """
+        models = {user_id: None for user_id in user_ids}
+        
+        try:
+            if self.db_type == 'mongodb':
+                for model in self.mongo_db.user_models.find({'user_id': {'$in': list(models)}}):
+                    models[model['user_id']] = model
+            else:
+                for user_id in models:
+                    models[user_id] = self.get_user_model(user_id)
+            
+            return models
+            
+        except Exception as e:
+            logger.error(f"Error getting user models for {len(models)} users: {str(e)}")
+            return models
+
     def update_user_model(self, user_id, model_data):
         """
         Update behavior model for a user
@@ -618,18 +1228,26 @@ class Database:
         Args:
             user_id (str): User identifier
             model_data (dict): User behavior model data
+            
+        Returns:
+            int: The model's new version (see get_user_model_version), or None on error
         """
         try:
             if self.db_type == 'mongodb':
-                # Store in MongoDB
+                # Store in MongoDB, bumping the version other workers compare against
                 model_data['user_id'] = user_id
                 model_data['updated_at'] = int(time.time())
+                model_data.pop('model_version', None)
+                model_data.pop('_id', None)
                 
-                self.mongo_db.user_models.update_one(
+                model = self.mongo_db.user_models.find_one_and_update(
                     {'user_id': user_id},
-                    {'$set': model_data},
-                    upsert=True
+                    {'$set': model_data, '$inc': {'model_version': 1}},
+                    projection={'model_version': 1, '_id': 0},
+                    upsert=True,
+                    return_document=pymongo.ReturnDocument.AFTER
                 )
+                version = model['model_version']
             else:
                 # Store in file system
                 models_dir = f"{self.data_dir}/user_models"
@@ -644,11 +1262,14 @@ class Database:
                 # Write to file
                 with open(model_file, 'w') as f:
                     json.dump(model_data, f)
+                version = os.stat(model_file).st_mtime_ns
                     
             logger.debug(f"Updated model for user {user_id}")
+            return version
             
         except Exception as e:
             logger.error(f"Error updating user model: {str(e)}")
+            return None
 
     def get_auth_history(self, user_id, limit=50):
         """
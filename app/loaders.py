@@ -0,0 +1,98 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BatchLoader:
+    """
+    Per-request loader that coalesces individual key lookups into batch queries.
+    Keys are primed up front and fetched together on the first load; results
+    are memoized for the lifetime of the loader.
+    """
+    
+    def __init__(self, batch_load_fn):
+        """
+        Args:
+            batch_load_fn (callable): Takes a list of keys, returns a dict of key -> value
+        """
+        self._batch_load_fn = batch_load_fn
+        self._cache = {}
+        self._pending = {}
+    
+    def prime(self, keys):
+        """
+        Queue keys to be fetched in the next batch
+        
+        Args:
+            keys (iterable): Keys that will be loaded during this request
+        """
+        for key in keys:
+            if key not in self._cache:
+                self._pending[key] = None
+    
+    def load(self, key):
+        """
+        Load a single key, fetching it together with any primed keys
+        
+        Args:
+            key: Key to load
+        
+        Returns:
+            Value for the key, or None if the batch function returned nothing for it
+        """
+        if key not in self._cache:
+            self._pending[key] = None
+            self._dispatch()
+        return self._cache[key]
+    
+    def load_many(self, keys):
+        """
+        Load several keys with at most one batch query
+        
+        Args:
+            keys (list): Keys to load
+        
+        Returns:
+            list: Values in the same order as keys
+        """
+        self.prime(keys)
+        if self._pending:
+            self._dispatch()
+        return [self._cache[key] for key in keys]
+    
+    def _dispatch(self):
+        """Run the batch function over all pending keys"""
+        keys = list(self._pending)
+        self._pending.clear()
+        
+        results = self._batch_load_fn(keys)
+        for key in keys:
+            self._cache[key] = results.get(key)
+        
+        logger.debug(f"Batch loaded {len(keys)} keys")
+
+
+def login_history_loader(db, limit=10):
+    """
+    Create a loader for user login histories
+    
+    Args:
+        db: Database instance providing get_login_histories
+        limit (int): Maximum number of logins per user
+    
+    Returns:
+        BatchLoader: Loader keyed by user_id
+    """
+    return BatchLoader(lambda user_ids: db.get_login_histories(user_ids, limit))
+
+
+def user_model_loader(db):
+    """
+    Create a loader for user behavior models
+    
+    Args:
+        db: Database instance providing get_user_models
+    
+    Returns:
+        BatchLoader: Loader keyed by user_id
+    """
+    return BatchLoader(db.get_user_models)
@@ -0,0 +1,48 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+def configure_logging(log_file="data/logs/app.log", level=logging.INFO):
+    """
+    Route all logging through a queue so handler I/O runs on a background thread
+    
+    Request threads only enqueue records; a QueueListener formats them and
+    writes to the console and log file. Safe to call more than once.
+    
+    Args:
+        log_file (str): Path of the application log file
+        level (int): Root logger level
+    """
+    global _listener
+    
+    if _listener is not None:
+        return
+    
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    
+    formatter = logging.Formatter(LOG_FORMAT)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(formatter)
+    
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    
+    _listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, file_handler, respect_handler_level=True
+    )
+    _listener.start()
+    
+    # Flush anything still queued on interpreter shutdown
+    atexit.register(_listener.stop)
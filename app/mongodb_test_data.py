@@ -4,9 +4,11 @@ import time
 import uuid
 from datetime import datetime, timedelta
 import ipaddress
+import re
 from faker import Faker
 import logging
 import os
+import threading
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 
@@ -529,12 +531,15 @@ def generate_database():
         registrations.append({
             'timestamp': timestamp,
             'ip_address': ip_address,
+            'ip_int': int(ipaddress.IPv4Address(ip_address)),
             'email_domain': email_domain,
             'success': random.random() < 0.9  # 90% success rate
         })
     
     if registrations:
         db.registrations.insert_many(registrations)
+        # Subnet lookups are range scans over the numeric IP
+        db.registrations.create_index('ip_int')
     
     logger.info("Generating session events...")
     # Generate session events
@@ -626,130 +631,171 @@ def get_user_data(user_id):
         logger.error(f"Error retrieving user data: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-# API route to run full fraud analysis
-@app.route('/api/analyze/<user_id>', methods=['POST'])
-def analyze_user(user_id):
-    
-    """Run full fraud analysis for a user"""
+def _in_network(ip_address, network):
+    """Whether an address string belongs to an ip_network; False if it does not parse"""
     try:
-        # For real analysis, we would integrate with your fraud detection modules here
-        # This is a simplified placeholder response
-        data = request.json or {}
-        ip_address = data.get('ip_address', request.remote_addr)
-        
-        # Get user
-        user = db.users.find_one({'user_id': user_id})
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        # Get a few pieces of data to demonstrate the concept
-        devices = list(db.devices.find({'user_id': user_id}))
-        logins = list(db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(5))
-        
-        # Get IP reputation
-        ip_data = db.ip_data.find_one({'ip_address': ip_address})
-        ip_reputation = None
+        return ipaddress.ip_address(ip_address) in network
+    except ValueError:
+        return False
+
+# Create mock Database class to interface with the MongoDB directly
+# This adapts our MongoDB test data to work with the predictors
+class MockDatabase:
+    def __init__(self, db_instance):
+        self.db = db_instance
+    
+    def get_login_history(self, user_id, limit=10):
+        return list(self.db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(limit))
+    
+    def get_last_login(self, user_id):
+        logins = list(self.db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(1))
+        return logins[0] if logins else None
+    
+    def store_login(self, login_data):
+        # In test mode, we don't need to store anything
+        pass
+    
+    def get_ip_location(self, ip_address):
+        ip_data = self.db.ip_data.find_one({'ip_address': ip_address})
+        if ip_data and 'location' in ip_data:
+            return ip_data['location']
+        return None
+    
+    def get_ip_reputation(self, ip_address):
+        ip_data = self.db.ip_data.find_one({'ip_address': ip_address})
         if ip_data and 'reputation' in ip_data:
-            ip_reputation = ip_data['reputation']
-        
+            return ip_data['reputation']
+        return None
+    
+    def update_ip_reputation(self, ip_address, reputation_data):
+        # In test mode, we don't need to update anything
+        pass
+    
+    def get_ip_bundle(self, ip_address, failed_window_minutes=1440):
+        ip_data = self.db.ip_data.find_one({'ip_address': ip_address}) or {}
+        return {
+            'reputation': ip_data.get('reputation'),
+            'location': ip_data.get('location'),
+            'failed_logins_24h': None
+        }
+    
+    def update_ip_reputations(self, updates):
+        # In test mode, we don't need to update anything
+        return True
+    
+    def get_device_data(self, device_id=None, user_id=None):
+        if device_id:
+            return self.db.devices.find_one({'device_id': device_id})
+        elif user_id:
+            return list(self.db.devices.find({'user_id': user_id}))
+        return None
+    
+    def store_device_data(self, device_id, device_data):
+        # In test mode, we don't need to store anything
+        pass
+    
+    def record_visit(self, device_id, timestamp, fingerprint_data, issues):
+        # In test mode, we don't need to store anything
+        pass
+    
+    def get_recent_failed_logins(self, username=None, ip_address=None, minutes=30):
+        cutoff_time = int(time.time()) - (minutes * 60)
+        query = {'timestamp': {'$gt': cutoff_time}}
         
-        # Create mock Database class to interface with the MongoDB directly
-        # Create mock Database class to interface with the MongoDB directly
-        # This adapts our MongoDB test data to work with the predictors
-        class MockDatabase:
-            def __init__(self, db_instance):
-                self.db = db_instance
-            
-            def get_login_history(self, user_id, limit=10):
-                return list(self.db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(limit))
-            
-            def get_last_login(self, user_id):
-                logins = list(self.db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(1))
-                return logins[0] if logins else None
-            
-            def store_login(self, login_data):
-                # In test mode, we don't need to store anything
-                pass
-            
-            def get_ip_location(self, ip_address):
-                ip_data = self.db.ip_data.find_one({'ip_address': ip_address})
-                if ip_data and 'location' in ip_data:
-                    return ip_data['location']
-                return None
+        if username:
+            query['username'] = username
+        if ip_address:
+            query['ip_address'] = ip_address
             
-            def get_ip_reputation(self, ip_address):
-                ip_data = self.db.ip_data.find_one({'ip_address': ip_address})
-                if ip_data and 'reputation' in ip_data:
-                    return ip_data['reputation']
-                return None
-            
-            def update_ip_reputation(self, ip_address, reputation_data):
-                # In test mode, we don't need to update anything
-                pass
-            
-            def get_device_data(self, device_id=None, user_id=None):
-                if device_id:
-                    return self.db.devices.find_one({'device_id': device_id})
-                elif user_id:
-                    return list(self.db.devices.find({'user_id': user_id}))
-                return None
-            
-            def store_device_data(self, device_id, device_data):
-                # In test mode, we don't need to store anything
-                pass
-            
-            def get_recent_failed_logins(self, username=None, ip_address=None, minutes=30):
-                cutoff_time = int(time.time()) - (minutes * 60)
-                query = {'timestamp': {'$gt': cutoff_time}}
-                
-                if username:
-                    query['username'] = username
-                if ip_address:
-                    query['ip_address'] = ip_address
-                    
-                return list(self.db.failed_logins.find(query))
+        return list(self.db.failed_logins.find(query))
+    
+    def get_password_attack_stats_batch(self, pairs, ip_addresses, windows, now=None):
+        from app.database import password_attack_stats_batch_pipeline, password_attack_stats_from_batch_facets
+        pipeline = password_attack_stats_batch_pipeline(pairs, ip_addresses, windows, now or time.time())
+        facets = next(self.db.failed_logins.aggregate(pipeline))
+        return password_attack_stats_from_batch_facets(facets, pairs, ip_addresses)
+    
+    def get_user_model(self, user_id):
+        return self.db.user_models.find_one({'user_id': user_id})
+    
+    def get_user_model_version(self, user_id):
+        model = self.db.user_models.find_one({'user_id': user_id}, {'model_version': 1, '_id': 0})
+        return None if model is None else model.get('model_version', 0)
+    
+    def update_user_model(self, user_id, model_data):
+        # In test mode, we don't need to update anything
+        return None
+        
+    # Add the missing method for the AccountVelocityMonitor
+    def get_registrations(self, entity_type=None, entity_value=None):
+        """
+        Get registration timestamps for an entity (IP, subnet, domain)
+        
+        Args:
+            entity_type (str): Entity type ('ip', 'subnet', 'email_domain')
+            entity_value (str): Entity value
             
-            def get_user_model(self, user_id):
-                return self.db.user_models.find_one({'user_id': user_id})
+        Returns:
+            list: Registration timestamps
+        """
+        query = {}
+        
+        if entity_type == 'ip':
+            query['ip_address'] = entity_value
+        elif entity_type == 'subnet':
+            # Range scan over the indexed numeric IP
+            try:
+                network = ipaddress.ip_network(entity_value, strict=False)
+            except ValueError:
+                return []
+            # Registrations stored before ip_int existed lack the field; they fall
+            # back to a prefix match on the whole octets, narrowed exactly below
+            prefix = ''.join(
+                re.escape(octet + '.')
+                for octet in str(network.network_address).split('.')[:network.prefixlen // 8]
+            )
+            query['$or'] = [
+                {'ip_int': {
+                    '$gte': int(network.network_address),
+                    '$lte': int(network.broadcast_address)
+                }},
+                {'ip_int': {'$exists': False}, 'ip_address': {'$regex': f'^{prefix}'}}
+            ]
+        elif entity_type == 'email_domain':
+            query['email_domain'] = entity_value
             
-            def update_user_model(self, user_id, model_data):
-                # In test mode, we don't need to update anything
-                pass
-                
-            # Add the missing method for the AccountVelocityMonitor
-            def get_registrations(self, entity_type=None, entity_value=None):
-                """
-                Get registration timestamps for an entity (IP, subnet, domain)
-                
-                Args:
-                    entity_type (str): Entity type ('ip', 'subnet', 'email_domain')
-                    entity_value (str): Entity value
-                    
-                Returns:
-                    list: Registration timestamps
-                """
-                query = {}
-                
-                if entity_type == 'ip':
-                    query['ip_address'] = entity_value
-                elif entity_type == 'subnet':
-                    # For subnet, we need to match IPs that start with the subnet prefix
-                    subnet_prefix = entity_value.split('/')[0]  # Get the network part without mask
-                    subnet_prefix = subnet_prefix.rsplit('.', 1)[0]  # Remove the last octet
-                    query['ip_address'] = {'$regex': f'^{subnet_prefix}'}
-                elif entity_type == 'email_domain':
-                    query['email_domain'] = entity_value
-                    
-                # Get registrations matching query
-                registrations = list(self.db.registrations.find(query))
-                
-                # Extract timestamps
-                return [r['timestamp'] for r in registrations]
+        # Get registrations matching query
+        registrations = list(self.db.registrations.find(
+            query, {'timestamp': 1, 'ip_int': 1, 'ip_address': 1, '_id': 0}
+        ))
+        if entity_type == 'subnet':
+            registrations = [
+                r for r in registrations
+                if 'ip_int' in r or _in_network(r.get('ip_address'), network)
+            ]
+        
+        # Extract timestamps
+        return [r['timestamp'] for r in registrations]
 
-        try:
+_predictors = None
+_predictors_lock = threading.Lock()
+
+def _get_predictors():
+    """
+    Build the fraud detection predictors on first use, wired to the test data
+    
+    Several predictors start background threads, so they are created once per
+    process instead of per request.
+    
+    Returns:
+        tuple: The predictor instances, in the order unpacked by analyze_user
+    """
+    global _predictors
+    
+    with _predictors_lock:
+        if _predictors is None:
             # Import the necessary predictors with sys.path adjustment to make imports work
             import sys
-            import os
 
             # Need to go up one directory level to find the app directory
             sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -786,18 +832,54 @@ def analyze_user(user_id):
             app.predictors.password_attack.Database = lambda: mock_db
             app.predictors.account_velocity.Database = lambda: mock_db
             app.predictors.session_anomaly.Database = lambda: mock_db
-
+            
             # Initialize analyzers with our patches in place
-            ua_analyzer = UserAgentAnalyzer()
-            geo_detector = GeoVelocityDetector()
-            time_analyzer = AccessTimeAnalyzer()
-            device_analyzer = DeviceFingerprinter()
-            ip_checker = IPReputationChecker()
-            password_detector = PasswordAttackDetector()
-            velocity_monitor = AccountVelocityMonitor()
-            session_detector = SessionAnomalyDetector()
-
+            _predictors = (
+                UserAgentAnalyzer(),
+                GeoVelocityDetector(),
+                AccessTimeAnalyzer(),
+                DeviceFingerprinter(),
+                IPReputationChecker(),
+                PasswordAttackDetector(),
+                AccountVelocityMonitor(),
+                SessionAnomalyDetector()
+            )
+            
             logger.info("Successfully initialized fraud detection predictors")
+        
+        return _predictors
+
+# API route to run full fraud analysis
+@app.route('/api/analyze/<user_id>', methods=['POST'])
+def analyze_user(user_id):
+    
+    """Run full fraud analysis for a user"""
+    try:
+        # For real analysis, we would integrate with your fraud detection modules here
+        # This is a simplified placeholder response
+        data = request.json or {}
+        ip_address = data.get('ip_address', request.remote_addr)
+        
+        # Get user
+        user = db.users.find_one({'user_id': user_id})
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # Get a few pieces of data to demonstrate the concept
+        devices = list(db.devices.find({'user_id': user_id}))
+        logins = list(db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(5))
+        
+        # Get IP reputation
+        ip_data = db.ip_data.find_one({'ip_address': ip_address})
+        ip_reputation = None
+        if ip_data and 'reputation' in ip_data:
+            ip_reputation = ip_data['reputation']
+        
+        
+        try:
+            # Predictors are built once and shared by every request
+            (ua_analyzer, geo_detector, time_analyzer, device_analyzer, ip_checker,
+             password_detector, velocity_monitor, session_detector) = _get_predictors()
 
             # Get user agent from request
             user_agent_string = request.headers.get('User-Agent', '')
@@ -1,12 +1,70 @@
 import logging
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
 import numpy as np
 from sklearn.ensemble import IsolationForest
 from app.database import Database
+from ml.models.access_time_model import AccessTimeAnomalyDetector
+from ml.models.compiled_forest import CompiledIsolationForest
 
 logger = logging.getLogger(__name__)
 
+# Column order of the time feature matrix, matching _extract_time_features
+_TIME_FEATURE_NAMES = (
+    'hour', 'minute', 'day_of_week', 'is_weekend',
+    'is_business_hours', 'day_of_month', 'month', 'quarter_of_day'
+)
+_HOUR_COL = _TIME_FEATURE_NAMES.index('hour')
+_IS_WEEKEND_COL = _TIME_FEATURE_NAMES.index('is_weekend')
+
+def _build_hour_of_week_table():
+    """
+    Feature rows for each of the 168 (day_of_week, hour) slots
+    
+    Every feature except minute, day_of_month and month depends only on the
+    hour of the week, so those columns are precomputed and the rest are
+    filled in per timestamp.
+    """
+    table = np.zeros((7 * 24, len(_TIME_FEATURE_NAMES)), dtype=np.float64)
+    day_of_week, hour = np.divmod(np.arange(7 * 24), 24)
+    table[:, 0] = hour
+    table[:, 2] = day_of_week
+    table[:, 3] = day_of_week >= 5
+    table[:, 4] = (hour >= 9) & (hour < 17)
+    table[:, 7] = hour // 6
+    return table
+
+# Indexed by day_of_week * 24 + hour
+_HOUR_OF_WEEK_FEATURES = _build_hour_of_week_table()
+
+# Process-wide LRU of fitted per-user models: {user_id: (fitted_at, newest login, model)}
+_USER_MODELS = OrderedDict()
+_USER_MODELS_LOCK = threading.Lock()
+_USER_MODELS_MAXSIZE = 1024
+
+# A cached per-user model is refitted once this many logins newer than the ones it
+# was fitted on have been stored, or once it is this many seconds old
+_USER_MODEL_REFIT_LOGINS = 5
+_USER_MODEL_MAX_AGE = 3600
+
+def _risk_from_anomaly(anomaly_score):
+    """
+    Map a normalized anomaly score (0-1) to a risk score (0-100)
+    
+    Takes a plain float so the arithmetic stays on Python floats rather than
+    numpy scalars, which carry per-operation dispatch overhead.
+    """
+    # Simple linear scaling with threshold
+    if anomaly_score < 0.3:
+        # Low anomaly scores are considered normal
+        return 0
+    
+    # Scale from 0.3-1.0 to 0-100
+    scaled_score = (anomaly_score - 0.3) / 0.7 * 100
+    return min(100, max(0, int(scaled_score)))
+
 class AccessTimeAnalyzer:
     """
     Analyzes user access time patterns to detect anomalies.
@@ -20,6 +78,16 @@ class AccessTimeAnalyzer:
         self.min_history_points = 0  # Minimum number of logins needed for reliable analysis
         self.contamination = 0.1     # Expected proportion of anomalies
         
+        # One model shared by all users, trained offline on the full login history.
+        # Per-user models are only fitted when no trained global model is available.
+        self.global_model = AccessTimeAnomalyDetector()
+        self.global_forest = None
+        try:
+            self.global_model.load_model()
+            self.global_forest = self.global_model.compiled_model or self.global_model.model
+        except FileNotFoundError:
+            logger.info("No global access time model found, falling back to per-user models")
+        
         logger.info("AccessTimeAnalyzer initialized")
     
     def analyze(self, user_id, timestamp=None):
@@ -43,13 +111,14 @@ class AccessTimeAnalyzer:
             
             # Extract time features for current login
             current_features = self._extract_time_features(login_time)
+            time_features = dict(zip(_TIME_FEATURE_NAMES, current_features.tolist()))
             
             # Get user's login history
             login_history = self._get_login_history(user_id)
             
             # If not enough history, can't perform anomaly detection
             if len(login_history) < self.min_history_points:
-                logger.info(f"Not enough login history for user {user_id} ({len(login_history)} points)")
+                logger.info("Not enough login history for user %s (%s points)", user_id, len(login_history))
                 
                 # Store current login for future analysis
                 self._store_time_data(user_id, timestamp)
@@ -59,29 +128,24 @@ class AccessTimeAnalyzer:
                     'status': 'insufficient_history',
                     'anomaly_score': 0,
                     'message': f"Need at least {self.min_history_points} logins for pattern analysis",
-                    'time_features': current_features
+                    'time_features': time_features
                 }
             
-            # Extract features from historical logins
-            historical_features = []
-            for login in login_history:
-                login_dt = datetime.fromtimestamp(login)
-                features = self._extract_time_features(login_dt)
-                historical_features.append(list(features.values()))
-            
-            # Convert to numpy array
-            X = np.array(historical_features)
-            
-            # Train isolation forest model
-            model = IsolationForest(contamination=self.contamination, random_state=42)
-            model.fit(X)
+            # Extract features from historical logins in one vectorized pass
+            X = self._extract_time_feature_matrix(login_history)
             
-            # Predict anomaly for current login
-            current_features_array = np.array([list(current_features.values())])
-            anomaly_score = -model.score_samples(current_features_array)[0]  # Negated to make higher = more anomalous
-            
-            # Normalize score to 0-1 range
-            normalized_score = min(max(anomaly_score / 0.5, 0), 1)
+            if self.global_forest is not None:
+                # Score against the shared model using per-user history aggregates
+                normalized_score = self._score_with_global_model(timestamp, login_history)
+                top_factors = []
+            else:
+                # Train isolation forest model, or reuse it if the history is unchanged
+                model = self._get_user_model(user_id, login_history, X)
+                
+                # Score the current login and attribute it to the features on its isolation paths
+                normalized_score, top_factors = self._get_feature_importance(
+                    model, current_features.reshape(1, -1)
+                )
             
             # Calculate risk score based on anomaly score
             risk_score = self._calculate_risk_score(normalized_score)
@@ -101,7 +165,7 @@ class AccessTimeAnalyzer:
             self._store_time_data(user_id, timestamp)
             
             # Check against specific suspicious patterns
-            specific_patterns = self._check_specific_patterns(current_features, login_history)
+            specific_patterns = self._check_specific_patterns(current_features, login_history, X)
             
             # If specific patterns found, they override the anomaly detection
             if specific_patterns:
@@ -115,23 +179,137 @@ class AccessTimeAnalyzer:
                 'status': status,
                 'message': message,
                 'anomaly_score': round(normalized_score, 4),
-                'time_features': current_features
+                'time_features': time_features,
+                'top_factors': top_factors
             }
             
             # Log high-risk time anomalies
             if risk_score > 70:
-                logger.warning(f"High-risk time anomaly detected for user {user_id}")
+                logger.warning("High-risk time anomaly detected for user %s", user_id)
             
             return result
             
         except Exception as e:
-            logger.error(f"Error in access time analysis: {str(e)}")
+            logger.error("Error in access time analysis: %s", e)
             return {
                 'risk_score': 50,  # Medium risk due to error
                 'status': 'error',
                 'message': f"Error in access time analysis: {str(e)}"
             }
     
+    def predict_many(self, user_id, timestamps):
+        """
+        Score many login timestamps against a user's history in one model call
+        
+        Args:
+            user_id (str): User identifier
+            timestamps (list): Login timestamps to score
+            
+        Returns:
+            np.ndarray: Normalized anomaly scores (0-1), one per timestamp
+        """
+        login_history = self._get_login_history(user_id)
+        model = self._get_user_model(
+            user_id, login_history, self._extract_time_feature_matrix(login_history)
+        )
+        return self._normalize_anomaly_scores(
+            -model.score_samples(self._extract_time_feature_matrix(timestamps))
+        )
+    
+    def _score_with_global_model(self, timestamp, login_history):
+        """
+        Score a login with the shared model
+        
+        Args:
+            timestamp (int): Login timestamp
+            login_history (list): Historical login timestamps
+            
+        Returns:
+            float: Normalized anomaly score (0-1)
+        """
+        history_ts = np.sort(np.asarray(login_history, dtype=np.int64))
+        features = self.global_model.extract_timestamp_features(timestamp, history_ts)
+        return float(self._normalize_anomaly_scores(
+            -self.global_forest.score_samples(features.reshape(1, -1))
+        )[0])
+    
+    def _get_user_model(self, user_id, login_history, X):
+        """
+        Get the user's fitted model from the shared cache, fitting it on a miss
+        
+        Every login is stored before it is analyzed, so the history changes on each
+        request; a cached model is reused until _USER_MODEL_REFIT_LOGINS newer logins
+        have arrived or it is older than _USER_MODEL_MAX_AGE.
+        
+        Args:
+            user_id (str): User identifier
+            login_history (list): Historical login timestamps the model is fitted on
+            X (np.ndarray): Feature matrix of login_history
+            
+        Returns:
+            CompiledIsolationForest: Fitted model
+        """
+        now = time.monotonic()
+        
+        with _USER_MODELS_LOCK:
+            entry = _USER_MODELS.get(user_id)
+            if entry and now - entry[0] < _USER_MODEL_MAX_AGE:
+                newest = entry[1]
+                new_logins = sum(1 for ts in login_history if newest is None or ts > newest)
+                if new_logins < _USER_MODEL_REFIT_LOGINS:
+                    _USER_MODELS.move_to_end(user_id)
+                    return entry[2]
+        
+        model = self._fit_user_model(X)
+        
+        with _USER_MODELS_LOCK:
+            _USER_MODELS[user_id] = (now, max(login_history, default=None), model)
+            _USER_MODELS.move_to_end(user_id)
+            if len(_USER_MODELS) > _USER_MODELS_MAXSIZE:
+                _USER_MODELS.popitem(last=False)
+        
+        return model
+    
+    def _fit_user_model(self, X):
+        """
+        Fit an isolation forest on a user's historical time features
+        
+        Args:
+            X (np.ndarray): Historical feature matrix
+            
+        Returns:
+            CompiledIsolationForest: Fitted model, flattened for fast scoring
+        """
+        # Histories are small, so the default 'auto' sample size (min(256, n)) applies
+        model = IsolationForest(n_estimators=50, contamination=self.contamination, random_state=42)
+        model.fit(X)
+        return CompiledIsolationForest(model)
+    
+    def _normalize_anomaly_scores(self, anomaly_scores):
+        """Map raw (negated) isolation forest scores to the 0-1 range"""
+        return np.clip(anomaly_scores / 0.5, 0, 1)
+    
+    def _get_feature_importance(self, model, current_row, top_n=3):
+        """
+        Score a login and rank which time features make it look anomalous
+        
+        Importance comes from the features the trees split on along the login's
+        isolation paths, collected in the same pass that scores it.
+        
+        Args:
+            model (CompiledIsolationForest): Model fitted on the user's history
+            current_row (np.ndarray): Current features, shape (1, n_features)
+            top_n (int): Maximum number of contributing features to return
+            
+        Returns:
+            tuple: (normalized anomaly score, list of top contributing feature names)
+        """
+        scores, importance = model.score_samples_with_importance(current_row)
+        importance = importance[0]
+        
+        top = [i for i in np.argsort(importance)[::-1][:top_n] if importance[i] > 0]
+        return float(self._normalize_anomaly_scores(-scores)[0]), [_TIME_FEATURE_NAMES[i] for i in top]
+    
     def _extract_time_features(self, dt):
         """
         Extract time-based features from a datetime
@@ -140,18 +318,59 @@ class AccessTimeAnalyzer:
             dt (datetime): Datetime object
             
         Returns:
-            dict: Time features
-        """
-        return {
-            'hour': dt.hour,
-            'minute': dt.minute / 60.0,  # Normalize to 0-1
-            'day_of_week': dt.weekday(),
-            'is_weekend': 1 if dt.weekday() >= 5 else 0,
-            'is_business_hours': 1 if 9 <= dt.hour < 17 else 0,
-            'day_of_month': dt.day / 31.0,  # Normalize to 0-1
-            'month': dt.month / 12.0,  # Normalize to 0-1
-            'quarter_of_day': dt.hour // 6  # 0-3: night, morning, afternoon, evening
-        }
+            np.ndarray: Time features in _TIME_FEATURE_NAMES order
+        """
+        # hour, day_of_week, is_weekend, is_business_hours and quarter_of_day
+        features = _HOUR_OF_WEEK_FEATURES[dt.weekday() * 24 + dt.hour].copy()
+        features[1] = dt.minute / 60.0  # Normalize to 0-1
+        features[5] = dt.day / 31.0  # Normalize to 0-1
+        features[6] = dt.month / 12.0  # Normalize to 0-1
+        return features
+    
+    def _extract_time_feature_matrix(self, timestamps):
+        """
+        Extract time features for many timestamps at once
+        
+        Produces the same values as _extract_time_features, one row per timestamp,
+        using integer arithmetic on local epoch seconds instead of datetime objects.
+        
+        Args:
+            timestamps (list): Unix timestamps
+            
+        Returns:
+            np.ndarray: Matrix of shape (len(timestamps), len(_TIME_FEATURE_NAMES))
+        """
+        ts = np.asarray(timestamps, dtype=np.int64)
+        local_ts = ts + self._utc_offsets(ts)
+        
+        hour = (local_ts // 3600) % 24
+        day_of_week = (local_ts // 86400 + 3) % 7  # 1970-01-01 was a Thursday
+        days = (local_ts // 86400).astype('datetime64[D]')
+        months = days.astype('datetime64[M]')
+        
+        features = _HOUR_OF_WEEK_FEATURES[day_of_week * 24 + hour]
+        features[:, 1] = ((local_ts // 60) % 60) / 60.0
+        features[:, 5] = ((days - months).astype(np.int64) + 1) / 31.0
+        features[:, 6] = (months.astype(np.int64) % 12 + 1) / 12.0
+        return features
+    
+    def _utc_offsets(self, ts):
+        """
+        Local UTC offsets in seconds for an array of timestamps
+        
+        Args:
+            ts (np.ndarray): Unix timestamps
+            
+        Returns:
+            np.ndarray or int: Offsets to add to get local time
+        """
+        # Without DST the offset is the same for every timestamp
+        if not time.daylight:
+            return -time.timezone
+        
+        return np.fromiter(
+            (time.localtime(t).tm_gmtoff for t in ts.tolist()), dtype=np.int64, count=len(ts)
+        )
     
     def _get_login_history(self, user_id):
         """
@@ -187,34 +406,27 @@ class AccessTimeAnalyzer:
         Returns:
             int: Risk score (0-100)
         """
-        # Simple linear scaling with threshold
-        if anomaly_score < 0.3:
-            # Low anomaly scores are considered normal
-            return 0
-        
-        # Scale from 0.3-1.0 to 0-100
-        scaled_score = (anomaly_score - 0.3) / 0.7 * 100
-        return min(100, max(0, int(scaled_score)))
+        return _risk_from_anomaly(float(anomaly_score))
     
-    def _check_specific_patterns(self, current_features, login_history):
+    def _check_specific_patterns(self, current_features, login_history, history_features):
         """
         Check for specific suspicious patterns
         
         Args:
-            current_features (dict): Time features of current login
+            current_features (np.ndarray): Time features of current login
             login_history (list): Historical login timestamps
+            history_features (np.ndarray): Time feature matrix of the login history
             
         Returns:
             dict: Pattern details if found, None otherwise
         """
-        # Convert login history to datetime objects
-        history_dts = [datetime.fromtimestamp(ts) for ts in login_history]
+        history_hours = history_features[:, _HOUR_COL]
+        history_weekend = history_features[:, _IS_WEEKEND_COL]
         
         # Check for odd hours (2-5 AM local time) if this is not normal for the user
-        odd_hours_count = sum(1 for dt in history_dts if 2 <= dt.hour < 5)
-        odd_hours_ratio = odd_hours_count / len(history_dts)
+        odd_hours_ratio = np.mean((history_hours >= 2) & (history_hours < 5))
         
-        if 2 <= current_features['hour'] < 5 and odd_hours_ratio < 0.1:
+        if 2 <= current_features[_HOUR_COL] < 5 and odd_hours_ratio < 0.1:
             return {
                 'status': 'odd_hours',
                 'message': 'Login outside of user\'s normal hours (late night)',
@@ -222,10 +434,9 @@ class AccessTimeAnalyzer:
             }
         
         # Check for weekend login if user never logs in on weekends
-        weekend_count = sum(1 for dt in history_dts if dt.weekday() >= 5)
-        weekend_ratio = weekend_count / len(history_dts)
+        weekend_ratio = np.mean(history_weekend)
         
-        if current_features['is_weekend'] == 1 and weekend_ratio < 0.05:
+        if current_features[_IS_WEEKEND_COL] == 1 and weekend_ratio < 0.05:
             return {
                 'status': 'unusual_day',
                 'message': 'Login on weekend when user typically doesn\'t access',
@@ -1,9 +1,43 @@
 import logging
-import json
+import hashlib
+import itertools
+import time
+from collections import namedtuple
+from functools import reduce
+import orjson
 from app.database import Database
 
 logger = logging.getLogger(__name__)
 
+# Confidence deductions, in bit order of the _CONFIDENCE_TABLE key:
+# missing canvas hash, no WebGL support, no audio support, reported inconsistencies
+_CONFIDENCE_DEDUCTIONS = (0.2, 0.2, 0.1, 0.3)
+
+# Every possible confidence score (4 predicates -> 16 outcomes), computed once at import
+_CONFIDENCE_TABLE = tuple(
+    max(0.1, round(reduce(lambda score, d: score * (1 - d),
+                          [d for d, bit in zip(_CONFIDENCE_DEDUCTIONS, bits) if bit], 1.0), 2))
+    for bits in itertools.product((0, 1), repeat=4)
+)
+
+# Fingerprint properties expected from every genuine client
+_REQUIRED_PROPS = ('userAgent', 'language', 'screen', 'timezone')
+
+# GPU vendors that should never be reported by a mobile device
+_DESKTOP_GPUS = ('nvidia', 'amd', 'intel hd graphics')
+
+# Fingerprint fields shared by the heuristic checks, extracted once per analysis
+_FingerprintContext = namedtuple(
+    '_FingerprintContext',
+    'ua webgl incs features plugins screen webdriver canvas_blocked missing_props'
+)
+
+
+def _field_bytes(value):
+    """Encode a fingerprint field for hashing (missing values encode as empty)"""
+    return b'' if value is None else str(value).encode()
+
+
 class DeviceFingerprinter:
     """
     Server-side component for device fingerprinting analysis.
@@ -44,27 +78,30 @@ class DeviceFingerprinter:
             # Check if this is a known device
             is_known_device, device_history = self._check_known_device(device_id)
             
+            # Extract the fields used by the checks once
+            ctx = self._build_context(fingerprint_data)
+            
             # Detect issues
             issues = []
             
             # Look for reported inconsistencies
-            if 'inconsistencies' in fingerprint_data and fingerprint_data['inconsistencies']:
+            if fingerprint_data.get('inconsistencies'):
                 issues.extend(fingerprint_data['inconsistencies'])
             
             # Check for automation signs
-            if self._check_automation_signs(fingerprint_data):
+            if self._check_automation_signs(ctx):
                 issues.append('automation_detected')
             
             # Check for browser spoofing
-            if self._check_browser_spoofing(fingerprint_data):
+            if self._check_browser_spoofing(ctx):
                 issues.append('browser_spoofing')
             
             # Check for VPN/proxy usage
-            if self._check_proxy_signs(fingerprint_data):
+            if self._check_proxy_signs(ctx):
                 issues.append('proxy_detected')
             
             # Check for fingerprint tampering
-            if self._check_fingerprint_tampering(fingerprint_data):
+            if self._check_fingerprint_tampering(ctx):
                 issues.append('fingerprint_tampering')
             
             # Calculate confidence score (how reliable is this fingerprint)
@@ -96,12 +133,12 @@ class DeviceFingerprinter:
             
             # Log suspicious devices
             if risk_score > 70:
-                logger.warning(f"Suspicious device detected: {device_id} with issues: {issues}")
+                logger.warning("Suspicious device detected: %s with issues: %s", device_id, issues)
             
             return result
             
         except Exception as e:
-            logger.error(f"Error analyzing device fingerprint: {str(e)}")
+            logger.error("Error analyzing device fingerprint: %s", e)
             return {
                 'risk_score': 60,
                 'issues': ['analysis_error'],
@@ -112,34 +149,22 @@ class DeviceFingerprinter:
     
     def _generate_device_id(self, fingerprint_data):
         """Generate a device ID from fingerprint data"""
-        # Create a simplified version of the fingerprint with stable properties
-        stable_data = {}
-        
-        if 'userAgent' in fingerprint_data:
-            stable_data['userAgent'] = fingerprint_data['userAgent']
-        
-        if 'screen' in fingerprint_data:
-            stable_data['screen'] = fingerprint_data['screen']
-        
-        if 'language' in fingerprint_data:
-            stable_data['language'] = fingerprint_data['language']
-        
-        if 'timezone' in fingerprint_data:
-            stable_data['timezone'] = fingerprint_data['timezone'].get('offset')
-        
-        if 'webgl' in fingerprint_data and fingerprint_data['webgl'].get('supported'):
-            stable_data['webgl'] = {
-                'vendor': fingerprint_data['webgl'].get('vendor'),
-                'renderer': fingerprint_data['webgl'].get('renderer')
-            }
-        
-        if 'canvasHash' in fingerprint_data:
-            stable_data['canvasHash'] = fingerprint_data['canvasHash']
+        # Pack the stable properties into a fixed, separator-delimited byte layout
+        webgl = fingerprint_data.get('webgl') or {}
+        webgl_supported = webgl.get('supported')
+        
+        stable_bytes = b'\x1f'.join((
+            _field_bytes(fingerprint_data.get('userAgent')),
+            orjson.dumps(fingerprint_data.get('screen'), option=orjson.OPT_SORT_KEYS),
+            _field_bytes(fingerprint_data.get('language')),
+            _field_bytes((fingerprint_data.get('timezone') or {}).get('offset')),
+            _field_bytes(webgl.get('vendor')) if webgl_supported else b'',
+            _field_bytes(webgl.get('renderer')) if webgl_supported else b'',
+            _field_bytes(fingerprint_data.get('canvasHash'))
+        ))
         
         # Generate a hash from the stable data
-        import hashlib
-        data_str = json.dumps(stable_data, sort_keys=True)
-        return hashlib.sha256(data_str.encode()).hexdigest()
+        return hashlib.sha256(stable_bytes).hexdigest()
     
     def _check_known_device(self, device_id):
         """
@@ -156,66 +181,70 @@ class DeviceFingerprinter:
         
         return False, None
     
-    def _check_automation_signs(self, fingerprint_data):
+    def _build_context(self, fingerprint_data):
+        """
+        Extract the fingerprint fields shared by the heuristic checks
+        
+        Returns:
+            _FingerprintContext: Lowercased user agent, WebGL info, reported inconsistencies, etc.
+        """
+        return _FingerprintContext(
+            ua=(fingerprint_data.get('userAgent') or '').lower(),
+            webgl=fingerprint_data.get('webgl') or {},
+            incs=frozenset(fingerprint_data.get('inconsistencies') or ()),
+            features=fingerprint_data.get('features') or {},
+            plugins=fingerprint_data.get('plugins') or [],
+            screen=fingerprint_data.get('screen') or {},
+            webdriver=bool(fingerprint_data.get('webdriver')),
+            canvas_blocked='canvasSupported' in fingerprint_data and not fingerprint_data['canvasSupported'],
+            missing_props=any(prop not in fingerprint_data for prop in _REQUIRED_PROPS)
+        )
+    
+    def _check_automation_signs(self, ctx):
         """Check for signs of automation or headless browsers"""
         # Look for direct signs of automation
-        if 'inconsistencies' in fingerprint_data:
-            if 'automation_detected' in fingerprint_data['inconsistencies']:
-                return True
-            if 'missing_graphics_support' in fingerprint_data['inconsistencies']:
-                return True
-            if 'missing_audio_support' in fingerprint_data['inconsistencies']:
-                return True
+        incs = ctx.incs
+        if ('automation_detected' in incs or 'missing_graphics_support' in incs or
+                'missing_audio_support' in incs):
+            return True
         
         # Check for WebDriver property
-        if 'webdriver' in fingerprint_data and fingerprint_data['webdriver']:
+        if ctx.webdriver:
             return True
         
         # Check for suspicious features
-        features = fingerprint_data.get('features', {})
-        
-        if features.get('hardwareConcurrency') == 0:
+        if ctx.features.get('hardwareConcurrency') == 0:
             return True
         
         # Check for missing plugins (often the case in automation)
-        plugins = fingerprint_data.get('plugins', [])
-        if len(plugins) == 0 and 'chrome' in fingerprint_data.get('userAgent', '').lower():
+        if len(ctx.plugins) == 0 and 'chrome' in ctx.ua:
             return True
         
         return False
     
-    def _check_browser_spoofing(self, fingerprint_data):
+    def _check_browser_spoofing(self, ctx):
         """Check for signs of browser spoofing"""
         # Already reported inconsistencies
-        if 'inconsistencies' in fingerprint_data:
-            if 'ua_platform_mismatch' in fingerprint_data['inconsistencies']:
-                return True
-            if 'browser_plugin_mismatch' in fingerprint_data['inconsistencies']:
-                return True
-        
-        # Check for mismatched browser signs
-        ua = fingerprint_data.get('userAgent', '').lower()
+        if 'ua_platform_mismatch' in ctx.incs or 'browser_plugin_mismatch' in ctx.incs:
+            return True
         
         # Check for WebGL vendor/renderer inconsistencies
-        webgl = fingerprint_data.get('webgl', {})
-        if webgl.get('supported'):
-            vendor = webgl.get('vendor', '').lower()
-            renderer = webgl.get('renderer', '').lower()
+        if ctx.webgl.get('supported'):
+            ua = ctx.ua
             
             # IE claiming to have WebGL
             if 'trident' in ua or 'msie' in ua:
-                if webgl.get('supported'):
-                    return True
+                return True
             
             # Mobile claiming to have desktop GPU
             if 'mobile' in ua or 'android' in ua:
-                desktop_gpus = ['nvidia', 'amd', 'intel hd graphics']
-                if any(gpu in renderer for gpu in desktop_gpus):
+                renderer = (ctx.webgl.get('renderer') or '').lower()
+                if any(gpu in renderer for gpu in _DESKTOP_GPUS):
                     return True
         
         return False
     
-    def _check_proxy_signs(self, fingerprint_data):
+    def _check_proxy_signs(self, ctx):
         """Check for signs of VPN or proxy usage"""
         # This requires external data not available in the fingerprint itself
         # In a real implementation, you would check the IP against known proxy/VPN IPs
@@ -224,25 +253,20 @@ class DeviceFingerprinter:
         # For this example, we'll just return False
         return False
     
-    def _check_fingerprint_tampering(self, fingerprint_data):
+    def _check_fingerprint_tampering(self, ctx):
         """Check for signs of fingerprint tampering or evasion"""
         # Check for missing expected properties
-        required_props = ['userAgent', 'language', 'screen', 'timezone']
-        
-        for prop in required_props:
-            if prop not in fingerprint_data:
-                return True
+        if ctx.missing_props:
+            return True
         
         # Check for canvas/WebGL blocking (privacy tools)
-        if 'canvasSupported' in fingerprint_data and not fingerprint_data['canvasSupported']:
+        if ctx.canvas_blocked:
             # Check if it's due to an older browser or if it's likely blocking
-            ua = fingerprint_data.get('userAgent', '').lower()
-            if not ('msie' in ua and 'trident' in ua):  # Not old IE
+            if not ('msie' in ctx.ua and 'trident' in ctx.ua):  # Not old IE
                 return True
         
         # Look for blank/generic fingerprint data
-        screen = fingerprint_data.get('screen', {})
-        if screen.get('width') == 1024 and screen.get('height') == 768:
+        if ctx.screen.get('width') == 1024 and ctx.screen.get('height') == 768:
             # This is a very common spoofed resolution
             return True
         
@@ -255,27 +279,15 @@ class DeviceFingerprinter:
         Returns:
             float: Score from 0.0 to 1.0
         """
-        score = 1.0
-        deductions = []
-        
         # Check for missing sections that reduce confidence
-        if 'canvasHash' not in fingerprint_data:
-            deductions.append(0.2)
-        
-        if 'webgl' not in fingerprint_data or not fingerprint_data.get('webgl', {}).get('supported'):
-            deductions.append(0.2)
-        
-        if 'audio' not in fingerprint_data or not fingerprint_data.get('audio', {}).get('supported'):
-            deductions.append(0.1)
-        
-        if 'inconsistencies' in fingerprint_data and fingerprint_data['inconsistencies']:
-            deductions.append(0.3)
-        
-        # Apply deductions
-        for deduction in deductions:
-            score *= (1 - deduction)
-        
-        return max(0.1, round(score, 2))  # Ensure minimum confidence of 0.1
+        no_canvas = 'canvasHash' not in fingerprint_data
+        no_webgl = 'webgl' not in fingerprint_data or not fingerprint_data.get('webgl', {}).get('supported')
+        no_audio = 'audio' not in fingerprint_data or not fingerprint_data.get('audio', {}).get('supported')
+        has_inconsistencies = bool(fingerprint_data.get('inconsistencies'))
+        
+        # Look up the precomputed score (minimum confidence of 0.1 is baked in)
+        key = (no_canvas << 3) | (no_webgl << 2) | (no_audio << 1) | has_inconsistencies
+        return _CONFIDENCE_TABLE[key]
     
     def _calculate_risk_score(self, issues, is_known_device):
         """Calculate risk score based on detected issues"""
@@ -315,38 +327,5 @@ class DeviceFingerprinter:
     
     def _store_fingerprint(self, device_id, fingerprint_data, issues):
         """Store fingerprint for future reference"""
-        import time
-        
-        current_time = int(time.time())
-        
-        # In a real implementation, store in the database
-        device_data = self.db.get_device_data(device_id) or {}
-        
-        if not device_data:
-            # New device
-            device_data = {
-                'device_id': device_id,
-                'first_seen': current_time,
-                'last_seen': current_time,
-                'visit_count': 1,
-                'fingerprints': [fingerprint_data],
-                'issues_history': issues
-            }
-        else:
-            # Update existing device
-            device_data['last_seen'] = current_time
-            device_data['visit_count'] = device_data.get('visit_count', 0) + 1
-            
-            # Store most recent fingerprint
-            fingerprints = device_data.get('fingerprints', [])
-            fingerprints.append(fingerprint_data)
-            
-            # Keep only the most recent 5 fingerprints
-            device_data['fingerprints'] = fingerprints[-5:]
-            
-            # Update issues history
-            if issues:
-                device_data['issues_history'] = list(set(device_data.get('issues_history', []) + issues))
-        
-        # Store the updated data
-        self.db.store_device_data(device_id, device_data)
+        # Visit count, recent fingerprints and issues history are updated by the storage layer
+        self.db.record_visit(device_id, int(time.time()), fingerprint_data, issues)
@@ -1,14 +1,106 @@
 import logging
-import geoip2.database
-import geoip2.errors
+import httpx
+import maxminddb
 import math
+import threading
 import time
-from datetime import datetime
+from functools import lru_cache
 import os
 from app.database import Database
 
 logger = logging.getLogger(__name__)
 
+# GeoIP readers shared by every detector instance, keyed by database path
+_READERS = {}
+_READERS_LOCK = threading.Lock()
+
+
+def _get_reader(geoip_db_path):
+    """
+    Get the process-wide GeoIP reader for a database file, opening it on first use
+    
+    The database is memory-mapped through the maxminddb C extension when it is
+    available, so re-creating a detector does not re-parse the file.
+    """
+    reader = _READERS.get(geoip_db_path)
+    if reader is None:
+        with _READERS_LOCK:
+            reader = _READERS.get(geoip_db_path)
+            if reader is None:
+                try:
+                    reader = maxminddb.open_database(geoip_db_path, maxminddb.MODE_MMAP_EXT)
+                except ValueError:
+                    # C extension not available, use the pure Python mmap reader
+                    reader = maxminddb.open_database(geoip_db_path, maxminddb.MODE_MMAP)
+                _prefetch_database(geoip_db_path)
+                _READERS[geoip_db_path] = reader
+    return reader
+
+
+def _prefetch_database(geoip_db_path, chunk_size=1024 * 1024):
+    """
+    Pull the GeoIP database into the page cache with one sequential read
+    
+    The mmap'd reader otherwise faults pages in on first touch, spreading the
+    cost over the first requests served by each worker.
+    """
+    try:
+        with open(geoip_db_path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while f.read(chunk_size):
+                pass
+    except OSError as e:
+        logger.warning("Could not prefetch GeoIP database: %s", e)
+
+
+# Pooled HTTP client for the geolocation API fallback, reused across requests
+_HTTP_CLIENT = None
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+def _get_http_client():
+    """
+    Get the process-wide geolocation API client, creating it on first use
+    
+    HTTP/2 is used when the h2 package is installed, HTTP/1.1 otherwise.
+    """
+    global _HTTP_CLIENT
+    
+    if _HTTP_CLIENT is None:
+        with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None:
+                limits = httpx.Limits(max_connections=64)
+                try:
+                    _HTTP_CLIENT = httpx.Client(http2=True, timeout=1.5, limits=limits)
+                except ImportError:
+                    _HTTP_CLIENT = httpx.Client(timeout=1.5, limits=limits)
+    return _HTTP_CLIENT
+
+
+@lru_cache(maxsize=4096)
+def _lookup_ip_api(ip_address):
+    """
+    Look up an IP address with the free geolocation API
+    
+    Results are cached so the same IP never costs a second network round trip.
+    Network errors and non-200 responses (rate limits, server errors) raise,
+    so they are not cached and the next lookup retries.
+    """
+    response = _get_http_client().get(f"https://ipapi.co/{ip_address}/json/")
+    response.raise_for_status()
+    
+    data = response.json()
+    return {
+        'latitude': data.get('latitude'),
+        'longitude': data.get('longitude'),
+        'country': data.get('country_name'),
+        'city': data.get('city'),
+        'postal_code': data.get('postal'),
+        'timezone': data.get('timezone')
+    }
+
+
 class GeoVelocityDetector:
     """
     Detects impossible travel scenarios based on geographic distance and time.
@@ -22,11 +114,11 @@ class GeoVelocityDetector:
             geoip_db_path = os.getenv('GEOIP_DB_PATH', 'data/GeoLite2-City.mmdb')
         
         try:
-            self.geoip_reader = geoip2.database.Reader(geoip_db_path)
+            self.geoip_reader = _get_reader(geoip_db_path)
             logger.info("GeoVelocityDetector initialized with database")
         except Exception as e:
             self.geoip_reader = None
-            logger.error(f"Failed to initialize GeoIP database: {str(e)}")
+            logger.error("Failed to initialize GeoIP database: %s", e)
             logger.warning("GeoVelocityDetector will use a fallback mechanism")
     
     def detect(self, user_id, ip_address, current_timestamp=None):
@@ -114,10 +206,6 @@ class GeoVelocityDetector:
             # Store current login
             self._store_login(user_id, ip_address, current_location, current_timestamp)
             
-            # Format timestamps for readability
-            prev_time_str = datetime.fromtimestamp(previous_login['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
-            curr_time_str = datetime.fromtimestamp(current_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-            
             # Prepare result
             result = {
                 'risk_score': risk_score,
@@ -128,7 +216,7 @@ class GeoVelocityDetector:
                 'time_difference_hours': round(time_diff_hours, 2),
                 'previous_login': {
                     'ip': previous_login['ip'],
-                    'timestamp': prev_time_str,
+                    'timestamp': previous_login['timestamp'],
                     'location': {
                         'country': previous_login['location'].get('country', 'Unknown'),
                         'city': previous_login['location'].get('city', 'Unknown'),
@@ -138,7 +226,7 @@ class GeoVelocityDetector:
                 },
                 'current_login': {
                     'ip': ip_address,
-                    'timestamp': curr_time_str,
+                    'timestamp': current_timestamp,
                     'location': {
                         'country': current_location.get('country', 'Unknown'),
                         'city': current_location.get('city', 'Unknown'),
@@ -150,12 +238,12 @@ class GeoVelocityDetector:
             
             # Log high-risk velocity detections
             if risk_score > 70:
-                logger.warning(f"High-risk travel velocity detected for user {user_id}: {travel_speed} km/h")
+                logger.warning("High-risk travel velocity detected for user %s: %s km/h", user_id, travel_speed)
             
             return result
             
         except Exception as e:
-            logger.error(f"Error in geo-velocity detection: {str(e)}")
+            logger.error("Error in geo-velocity detection: %s", e)
             return {
                 'risk_score': 50,  # Medium risk due to error
                 'status': 'error',
@@ -167,14 +255,19 @@ class GeoVelocityDetector:
         try:
             # First check if we have the GeoIP reader
             if self.geoip_reader:
-                response = self.geoip_reader.city(ip_address)
+                record = self.geoip_reader.get(ip_address)
+                if record is None:
+                    logger.info("IP address not found in GeoIP database: %s", ip_address)
+                    return None
+                
+                location = record.get('location', {})
                 return {
-                    'latitude': response.location.latitude,
-                    'longitude': response.location.longitude,
-                    'country': response.country.name,
-                    'city': response.city.name,
-                    'postal_code': response.postal.code,
-                    'timezone': response.location.time_zone
+                    'latitude': location.get('latitude'),
+                    'longitude': location.get('longitude'),
+                    'country': record.get('country', {}).get('names', {}).get('en'),
+                    'city': record.get('city', {}).get('names', {}).get('en'),
+                    'postal_code': record.get('postal', {}).get('code'),
+                    'timezone': location.get('time_zone')
                 }
             else:
                 # Fallback to database lookup if available
@@ -184,27 +277,16 @@ class GeoVelocityDetector:
                 
                 # Last resort - use a free geolocation API
                 # Note: In a production system, you would use a reliable paid service
-                import requests
-                response = requests.get(f"https://ipapi.co/{ip_address}/json/")
-                if response.status_code == 200:
-                    data = response.json()
-                    return {
-                        'latitude': data.get('latitude'),
-                        'longitude': data.get('longitude'),
-                        'country': data.get('country_name'),
-                        'city': data.get('city'),
-                        'postal_code': data.get('postal'),
-                        'timezone': data.get('timezone')
-                    }
+                location = _lookup_ip_api(ip_address)
+                if location:
+                    # Copy so callers cannot mutate the cached entry
+                    return dict(location)
                 
-                logger.warning(f"Could not determine location for IP: {ip_address}")
+                logger.warning("Could not determine location for IP: %s", ip_address)
                 return None
                 
-        except geoip2.errors.AddressNotFoundError:
-            logger.info(f"IP address not found in GeoIP database: {ip_address}")
-            return None
         except Exception as e:
-            logger.error(f"Error getting location for IP {ip_address}: {str(e)}")
+            logger.error("Error getting location for IP %s: %s", ip_address, e)
             return None
     
     def _get_previous_login(self, user_id):
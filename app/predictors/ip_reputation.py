@@ -1,10 +1,244 @@
+import copy
+import glob
+import hashlib
+import ipaddress
 import logging
+import os
+import queue
+import threading
 import time
-import requests
+from collections import OrderedDict
+import numpy as np
+import orjson
 from app.database import Database
+from app.utils.bloom_filter import BloomFilter
 
 logger = logging.getLogger(__name__)
 
+# Reputation flags read together when scoring
+_FLAG_KEYS = ('is_known_abuser', 'is_tor', 'is_proxy', 'is_vpn', 'is_datacenter')
+
+# Score floors by bucket: index = number of bounds strictly below the value
+_FAILED_LOGIN_BOUNDS = np.array([5, 10, 20])
+_FAILED_LOGIN_SCORES = np.array([0, 60, 75, 90])
+_COUNTRIES_BOUNDS = np.array([2, 5])
+_COUNTRIES_SCORES = np.array([0, 60, 80])
+
+# Reputation status by risk score: each threshold starts the next label
+_STATUS_THRESHOLDS = np.array([30, 50, 70, 90])
+_STATUS_LABELS = ('trusted', 'low_risk', 'medium_risk', 'high_risk', 'critical')
+
+# Number of random draws fetched from the generator at a time
+_RNG_BUFFER_SIZE = 1024
+
+class RepState:
+    """
+    Mutable reputation record used while analyzing an IP.
+    """
+    
+    __slots__ = (
+        'score', 'is_proxy', 'is_vpn', 'is_tor', 'is_datacenter',
+        'is_known_abuser', 'failed_logins', 'countries_count', 'last_updated'
+    )
+    
+    def __init__(self, score=50, is_proxy=False, is_vpn=False, is_tor=False, is_datacenter=False,
+                 is_known_abuser=False, failed_logins=0, countries_count=0, last_updated=0):
+        self.score = score
+        self.is_proxy = is_proxy
+        self.is_vpn = is_vpn
+        self.is_tor = is_tor
+        self.is_datacenter = is_datacenter
+        self.is_known_abuser = is_known_abuser
+        self.failed_logins = failed_logins
+        self.countries_count = countries_count
+        self.last_updated = last_updated
+    
+    @classmethod
+    def from_row(cls, row):
+        """Build a state from a stored reputation dict, defaulting missing fields"""
+        if not row:
+            return cls()
+        return cls(**{name: row[name] for name in cls.__slots__ if name in row})
+    
+    def to_row(self):
+        """Convert back to the reputation dict that is stored and returned"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class _ReputationWriter:
+    """
+    Background writer for queued reputation updates, one per process
+    
+    Updates are appended to a WAL named by the process ID before they are
+    queued, and after each stored batch the WAL is compacted down to the
+    updates still waiting. Use _get_reputation_writer() so no two writers
+    share a WAL.
+    """
+    
+    def __init__(self, reputation_dir, db):
+        self.pid = os.getpid()
+        self.reputation_dir = reputation_dir
+        
+        # No writer in this process owns a WAL yet, so every WAL found here is
+        # orphaned, including one left by an earlier process with the same pid
+        self._replay_wals(db)
+        
+        self._wal_path = os.path.join(reputation_dir, f"updates-{self.pid}.wal")
+        self._wal_file = open(self._wal_path, 'ab')
+        # Bytes compacted away so far; queued updates carry their WAL end offset
+        # counted from the WAL's creation, which compaction does not change
+        self._wal_base = 0
+        self._lock = threading.Lock()
+        
+        self._queue = queue.Queue(maxsize=10000)
+        self._batch_size = 100
+        self._thread = threading.Thread(target=self._run, name='ip-reputation-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, db, ip_address, reputation):
+        """
+        Log an update to the WAL and queue it for writing
+        
+        Args:
+            db (Database): Database the update is written to
+            ip_address (str): IP address
+            reputation (dict): Reputation data to store
+            
+        Returns:
+            bool: False if the queue is full and nothing was logged
+        """
+        with self._lock:
+            # Only submitters add to the queue, and they hold the lock
+            if self._queue.full():
+                return False
+            self._wal_file.write(orjson.dumps([ip_address, reputation]) + b'\n')
+            self._wal_file.flush()
+            self._queue.put_nowait((db, ip_address, reputation, self._wal_base + self._wal_file.tell()))
+        return True
+    
+    def _run(self):
+        """Background loop writing queued updates in batches"""
+        while True:
+            batch = [self._queue.get()]
+            
+            # Drain whatever else is already waiting, up to the batch size
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # One bulk write per target database
+            pending = {}
+            for db, ip_address, reputation, _ in batch:
+                pending.setdefault(id(db), (db, []))[1].append((ip_address, reputation))
+            pending = list(pending.values())
+            
+            # Keep retrying failed writes so the WAL is never compacted past them
+            retry_delay = 1
+            while True:
+                pending = [(db, updates) for db, updates in pending
+                           if not db.update_ip_reputations(updates)]
+                if not pending:
+                    break
+                logger.warning("Reputation write failed, retrying in %ds", retry_delay)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+            
+            # The queue is FIFO, so everything logged up to the batch's last
+            # update has now been stored
+            self._compact_wal(batch[-1][3])
+    
+    def _compact_wal(self, offset):
+        """
+        Drop stored updates from the front of the WAL
+        
+        Args:
+            offset (int): WAL end offset of the last stored update
+        """
+        with self._lock:
+            start = offset - self._wal_base
+            if start == self._wal_file.tell():
+                # Nothing was logged after it
+                self._wal_file.seek(0)
+                self._wal_file.truncate()
+            else:
+                # Keep the updates still queued; the rewrite replaces the WAL
+                # atomically so a crash leaves either the old or the new one
+                with open(self._wal_path, 'rb') as f:
+                    f.seek(start)
+                    remaining = f.read()
+                tmp_path = self._wal_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(remaining)
+                os.replace(tmp_path, self._wal_path)
+                self._wal_file.close()
+                self._wal_file = open(self._wal_path, 'ab')
+            self._wal_base += start
+    
+    def _replay_wals(self, db):
+        """Write out updates from WALs whose owning process is no longer running"""
+        os.makedirs(self.reputation_dir, exist_ok=True)
+        
+        for wal_path in glob.glob(os.path.join(self.reputation_dir, 'updates-*.wal')):
+            try:
+                pid = int(os.path.basename(wal_path)[len('updates-'):-len('.wal')])
+                if pid != self.pid and _process_alive(pid):
+                    continue
+                
+                # Later entries for the same IP supersede earlier ones
+                updates = {}
+                with open(wal_path, 'rb') as f:
+                    for line in f:
+                        try:
+                            ip_address, reputation = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            # Torn final line from the crash
+                            continue
+                        updates[ip_address] = reputation
+                
+                if updates:
+                    # Leave the WAL for the next startup if the write fails
+                    if not db.update_ip_reputations(list(updates.items())):
+                        continue
+                    logger.info("Replayed %d reputation updates from %s", len(updates), wal_path)
+                
+                os.remove(wal_path)
+                
+            except Exception as e:
+                logger.error("Error replaying reputation WAL %s: %s", wal_path, e)
+
+def _process_alive(pid):
+    """Check whether a process with the given pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def _get_reputation_writer(reputation_dir, db):
+    """
+    Get this process's reputation writer, starting it on first use
+    
+    Args:
+        reputation_dir (str): Directory holding the WALs
+        db (Database): Database used to replay orphaned WALs
+        
+    Returns:
+        _ReputationWriter: The shared writer
+    """
+    global _writer
+    
+    with _writer_lock:
+        # A forked child inherits the writer but not its thread
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = _ReputationWriter(reputation_dir, db)
+        return _writer
+
 class IPReputationChecker:
     """
     Checks IP reputation based on historical data and external sources.
@@ -13,14 +247,43 @@ class IPReputationChecker:
     def __init__(self):
         self.db = Database()
         
-        # Initialize reputation database
-        self.known_malicious_ips = set()
-        self.known_proxy_ips = set()
-        self.known_tor_exits = set()
+        # Initialize reputation database as (bloom filter, sorted uint32 IPs) pairs
+        self.known_malicious_ips = (BloomFilter(1), np.empty(0, dtype=np.uint32))
+        self.known_proxy_ips = (BloomFilter(1), np.empty(0, dtype=np.uint32))
+        self.known_tor_exits = (BloomFilter(1), np.empty(0, dtype=np.uint32))
+        
+        # Built lists are memory-mapped from here so all workers share one copy
+        self.reputation_dir = os.path.join(os.getenv('DATA_DIR', 'data'), 'reputation')
+        
+        # Datacenter CIDR ranges as sorted start/end uint32 arrays
+        self.datacenter_starts = np.empty(0, dtype=np.uint32)
+        self.datacenter_ends = np.empty(0, dtype=np.uint32)
+        
+        # Simulated VPN provider ranges, same layout as the datacenter ranges
+        self.vpn_starts = np.empty(0, dtype=np.uint32)
+        self.vpn_ends = np.empty(0, dtype=np.uint32)
         
         # Load reputation data
         self._load_reputation_data()
         
+        # Reputation updates are written behind the request path by the
+        # process-wide writer, which logs them to a WAL until they are stored
+        self._writer = _get_reputation_writer(self.reputation_dir, self.db)
+        
+        # Buffered random draws for the simulated VPN lookup
+        self._rng = np.random.default_rng()
+        self._rng_buffer = self._rng.random(_RNG_BUFFER_SIZE)
+        self._rng_index = 0
+        self._rng_lock = threading.Lock()
+        
+        # Short-lived LRU of check() results keyed by IP: {ip: (expires_at, result)}
+        self._result_cache = OrderedDict()
+        self._result_cache_ttl = 60
+        self._result_cache_maxsize = 100000
+        self._result_cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        
         logger.info("IPReputationChecker initialized")
     
     def check(self, ip_address):
@@ -33,23 +296,83 @@ class IPReputationChecker:
         Returns:
             dict: Reputation analysis including risk score and flags
         """
+        now = time.monotonic()
+        with self._result_cache_lock:
+            entry = self._result_cache.get(ip_address)
+            if entry and entry[0] > now:
+                self._result_cache.move_to_end(ip_address)
+                self._cache_hits += 1
+                cached_result = entry[1]
+            else:
+                self._cache_misses += 1
+                cached_result = None
+        
+        if cached_result is not None:
+            # Copy so callers cannot mutate the cached entry
+            return copy.deepcopy(cached_result)
+        
+        result = self._check_uncached(ip_address)
+        
+        # Never cache errors so the next call retries the lookup
+        if result.get('status') != 'error':
+            with self._result_cache_lock:
+                self._result_cache[ip_address] = (now + self._result_cache_ttl, copy.deepcopy(result))
+                self._result_cache.move_to_end(ip_address)
+                if len(self._result_cache) > self._result_cache_maxsize:
+                    self._result_cache.popitem(last=False)
+        
+        return result
+    
+    def get_cache_stats(self):
+        """
+        Get result cache statistics
+        
+        Returns:
+            dict: Cache size, hits, misses and cache_hit_ratio
+        """
+        with self._result_cache_lock:
+            lookups = self._cache_hits + self._cache_misses
+            return {
+                'size': len(self._result_cache),
+                'hits': self._cache_hits,
+                'misses': self._cache_misses,
+                'cache_hit_ratio': self._cache_hits / lookups if lookups else 0.0
+            }
+    
+    def _check_uncached(self, ip_address):
+        """Run the full reputation check for an IP, bypassing the result cache"""
         try:
-            # Get existing reputation data from database
-            current_reputation = self.db.get_ip_reputation(ip_address)
-            
-            # Check if we need to refresh the data
-            if self._should_refresh_reputation(current_reputation):
-                current_reputation = self._analyze_ip(ip_address, current_reputation)
-                self.db.update_ip_reputation(ip_address, current_reputation)
+            # Parse the address once for every range and list check
+            ip_int = self._ip_to_int(ip_address)
             
-            # Get location data
-            location = self.db.get_ip_location(ip_address)
+            # Get reputation, location and failed logins in a single lookup
+            ip_bundle = self.db.get_ip_bundle(ip_address)
+            current_reputation = ip_bundle['reputation']
+            location = ip_bundle['location']
             
-            # Calculate risk score
-            risk_score = self._calculate_risk_score(current_reputation)
+            # Check if we need to refresh the data
+            current_time = int(time.time())
+            if self._should_refresh_reputation(current_reputation, current_time):
+                # Only count failed logins separately when the bundle could not
+                failed_logins = ip_bundle['failed_logins_24h']
+                if failed_logins is None:
+                    failed_logins = len(self.db.get_recent_failed_logins(
+                        ip_address=ip_address,
+                        minutes=1440
+                    ))
+                
+                current_reputation = self._analyze_ip(
+                    ip_address, ip_int, current_reputation, failed_logins,
+                    self._check_vpn_ip(ip_int), current_time
+                )
+                self._queue_reputation_update(ip_address, current_reputation)
             
-            # Determine reputation status
-            status = self._get_reputation_status(risk_score)
+            # Use the score stored with the reputation when it was last analyzed
+            risk_score = current_reputation.get('cached_risk_score')
+            status = current_reputation.get('cached_status')
+            if risk_score is None or status is None:
+                risk_score = self._calculate_risk_score(current_reputation)
+                status = self._get_reputation_status(risk_score)
             
             # Prepare result
             result = {
@@ -76,12 +399,12 @@ class IPReputationChecker:
             
             # Log high-risk IPs
             if risk_score > 70:
-                logger.warning(f"High-risk IP detected: {ip_address} (Score: {risk_score})")
+                logger.warning("High-risk IP detected: %s (Score: %s)", ip_address, risk_score)
             
             return result
             
         except Exception as e:
-            logger.error(f"Error checking IP reputation: {str(e)}")
+            logger.error("Error checking IP reputation: %s", e)
             return {
                 'risk_score': 50,  # Medium risk due to error
                 'status': 'error',
@@ -95,35 +418,140 @@ class IPReputationChecker:
             # For this example, we'll use a small sample
             
             # Sample malicious IPs (for demonstration only)
-            self.known_malicious_ips = {
+            self.known_malicious_ips = self._build_ip_list('malicious', (
                 '192.0.2.1', '192.0.2.2', '192.0.2.3', 
                 '198.51.100.1', '198.51.100.2', '198.51.100.3'
-            }
+            ))
             
             # Sample proxy IPs (for demonstration only)
-            self.known_proxy_ips = {
+            self.known_proxy_ips = self._build_ip_list('proxy', (
                 '192.0.2.10', '192.0.2.11', '192.0.2.12',
                 '198.51.100.10', '198.51.100.11', '198.51.100.12'
-            }
+            ))
             
             # Sample Tor exit nodes (for demonstration only)
-            self.known_tor_exits = {
+            self.known_tor_exits = self._build_ip_list('tor', (
                 '192.0.2.20', '192.0.2.21', '192.0.2.22',
                 '198.51.100.20', '198.51.100.21', '198.51.100.22'
-            }
+            ))
             
-            logger.info(f"Loaded IP reputation data: {len(self.known_malicious_ips)} malicious, "
-                      f"{len(self.known_proxy_ips)} proxies, {len(self.known_tor_exits)} Tor exits")
+            # Sample datacenter ranges (for demonstration only)
+            self.datacenter_starts, self.datacenter_ends = self._build_ip_ranges((
+                '192.0.2.0/24', '198.51.100.0/24'
+            ))
+            
+            # Sample VPN ranges (for demonstration only)
+            self.vpn_starts, self.vpn_ends = self._build_ip_ranges((
+                '10.8.0.0/16',
+            ))
+            
+            logger.info("Loaded IP reputation data: %d malicious, %d proxies, %d Tor exits",
+                        len(self.known_malicious_ips[1]), len(self.known_proxy_ips[1]),
+                        len(self.known_tor_exits[1]))
             
         except Exception as e:
-            logger.error(f"Error loading reputation data: {str(e)}")
+            logger.error("Error loading reputation data: %s", e)
+    
+    def _build_ip_list(self, name, ips):
+        """
+        Build a membership structure for an IP list
+        
+        The Bloom filter and IP array are written to the reputation directory
+        once per distinct list and memory-mapped read-only afterwards.
+        
+        Args:
+            name (str): List name used in the file names
+            ips (iterable): IP addresses in the list
+            
+        Returns:
+            tuple: (BloomFilter, sorted np.uint32 array of IPv4 addresses)
+        """
+        ips = sorted(set(ips))
+        
+        # Key the files on the list contents so a changed list is rebuilt
+        digest = hashlib.blake2b('\n'.join(ips).encode(), digest_size=8).hexdigest()
+        bloom_path = os.path.join(self.reputation_dir, f"{name}-{digest}.bloom")
+        array_path = os.path.join(self.reputation_dir, f"{name}-{digest}.npy")
+        
+        if not (os.path.exists(bloom_path) and os.path.exists(array_path)):
+            os.makedirs(self.reputation_dir, exist_ok=True)
+            
+            bloom = BloomFilter(capacity=len(ips), error_rate=0.001)
+            for ip in ips:
+                bloom.add(ip)
+            bloom.save(bloom_path)
+            
+            ip_ints = np.fromiter(
+                (int(ipaddress.IPv4Address(ip)) for ip in ips), dtype=np.uint32, count=len(ips)
+            )
+            tmp_path = f"{array_path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, np.sort(ip_ints))
+            os.replace(tmp_path, array_path)
+        
+        return BloomFilter.load(bloom_path), np.load(array_path, mmap_mode='r')
     
-    def _should_refresh_reputation(self, reputation_data):
+    def _build_ip_ranges(self, cidrs):
+        """
+        Build sorted range arrays from CIDR blocks
+        
+        Args:
+            cidrs (iterable): IPv4 CIDR blocks, assumed not to overlap
+            
+        Returns:
+            tuple: (start addresses, end addresses) as np.uint32 arrays
+        """
+        networks = sorted(ipaddress.IPv4Network(cidr) for cidr in cidrs)
+        starts = np.array([int(net.network_address) for net in networks], dtype=np.uint32)
+        ends = np.array([int(net.broadcast_address) for net in networks], dtype=np.uint32)
+        return starts, ends
+    
+    def _ip_to_int(self, ip_address):
+        """Convert an IPv4 address to an int, or None if it is not IPv4"""
+        try:
+            return int(ipaddress.IPv4Address(ip_address))
+        except ValueError:
+            return None
+    
+    def _ip_in_list(self, ip_address, ip_int, ip_list):
+        """
+        Check whether an IP is in a list built by _build_ip_list
+        
+        The Bloom filter rejects almost every clean IP without touching the
+        array; a positive is confirmed with a binary search so bloom
+        false positives never flag an IP.
+        """
+        bloom, ip_ints = ip_list
+        if ip_int is None or ip_address not in bloom:
+            return False
+        
+        index = np.searchsorted(ip_ints, ip_int)
+        return index < len(ip_ints) and ip_ints[index] == ip_int
+    
+    def _ip_in_ranges(self, ip_int, starts, ends):
+        """Check whether an IP int falls inside one of the sorted ranges"""
+        if ip_int is None:
+            return False
+        
+        index = np.searchsorted(starts, ip_int, side='right') - 1
+        return index >= 0 and ip_int <= ends[index]
+    
+    def _queue_reputation_update(self, ip_address, reputation):
+        """
+        Queue a reputation update for the background writer
+        
+        Falls back to a synchronous write if the queue is full.
+        """
+        if not self._writer.submit(self.db, ip_address, reputation):
+            logger.warning("Reputation update queue full, writing synchronously")
+            self.db.update_ip_reputation(ip_address, reputation)
+    
+    def _should_refresh_reputation(self, reputation_data, current_time):
         """
         Check if we should refresh the reputation data
         
         Args:
             reputation_data (dict): Current reputation data
+            current_time (int): Current timestamp
             
         Returns:
             bool: True if refresh is needed
@@ -133,7 +561,6 @@ class IPReputationChecker:
             return True
         
         # Check if data is stale (older than 24 hours)
-        current_time = int(time.time())
         last_update = reputation_data.get('last_updated', 0)
         
         if current_time - last_update > 86400:  # 24 hours
@@ -141,57 +568,55 @@ class IPReputationChecker:
         
         return False
     
-    def _analyze_ip(self, ip_address, current_reputation):
+    def _analyze_ip(self, ip_address, ip_int, current_reputation, failed_logins, is_vpn, current_time):
         """
         Analyze an IP address for reputation data
         
         Args:
             ip_address (str): IP address to analyze
+            ip_int (int): Integer form of the address, or None if not IPv4
             current_reputation (dict): Current reputation data if available
+            failed_logins (int): Failed logins from this IP in the last 24 hours
+            is_vpn (bool): Result of the external VPN lookup
+            current_time (int): Current timestamp
             
         Returns:
             dict: Updated reputation data
         """
         # Start with current data or defaults
-        reputation = current_reputation.copy() if current_reputation else {
-            'score': 50,  # Neutral score
-            'is_proxy': False,
-            'is_vpn': False,
-            'is_tor': False,
-            'is_datacenter': False,
-            'is_known_abuser': False,
-            'failed_logins': 0,
-            'countries_count': 0,
-            'last_updated': 0
-        }
+        reputation = RepState.from_row(current_reputation)
         
         # Mark current time
-        reputation['last_updated'] = int(time.time())
+        reputation.last_updated = current_time
         
         # Check against known bad IPs
-        if ip_address in self.known_malicious_ips:
-            reputation['is_known_abuser'] = True
-            reputation['score'] = max(reputation['score'], 90)
+        if self._ip_in_list(ip_address, ip_int, self.known_malicious_ips):
+            reputation.is_known_abuser = True
+            if reputation.score < 90:
+                reputation.score = 90
         
         # Check against known proxies
-        if ip_address in self.known_proxy_ips:
-            reputation['is_proxy'] = True
-            reputation['score'] = max(reputation['score'], 70)
+        if self._ip_in_list(ip_address, ip_int, self.known_proxy_ips):
+            reputation.is_proxy = True
+            if reputation.score < 70:
+                reputation.score = 70
         
         # Check against known Tor exit nodes
-        if ip_address in self.known_tor_exits:
-            reputation['is_tor'] = True
-            reputation['score'] = max(reputation['score'], 80)
+        if self._ip_in_list(ip_address, ip_int, self.known_tor_exits):
+            reputation.is_tor = True
+            if reputation.score < 80:
+                reputation.score = 80
         
-        # Get failed logins from the last 24 hours
-        recent_failed = self.db.get_recent_failed_logins(ip_address=ip_address, minutes=1440)
-        reputation['failed_logins'] = len(recent_failed)
+        # Failed logins from the last 24 hours
+        reputation.failed_logins = failed_logins
         
         # If many failed logins, increase risk
-        if reputation['failed_logins'] > 10:
-            reputation['score'] = max(reputation['score'], 75)
-        elif reputation['failed_logins'] > 5:
-            reputation['score'] = max(reputation['score'], 60)
+        if failed_logins > 10:
+            if reputation.score < 75:
+                reputation.score = 75
+        elif failed_logins > 5:
+            if reputation.score < 60:
+                reputation.score = 60
         
         # In a real implementation, you would:
         # 1. Check against IP reputation services
@@ -200,31 +625,35 @@ class IPReputationChecker:
         # 4. Analyze historical login countries
         
         # For this example, we'll simulate an external API call for VPN detection
-        if not reputation.get('is_vpn'):
-            vpn_check_result = self._check_vpn_ip(ip_address)
-            if vpn_check_result:
-                reputation['is_vpn'] = vpn_check_result
-                reputation['score'] = max(reputation['score'], 65)
+        if not reputation.is_vpn and is_vpn:
+            reputation.is_vpn = True
+            if reputation.score < 65:
+                reputation.score = 65
         
-        # For datacenter detection, we'd normally check against known datacenter IP ranges
-        # For this example, just use a dummy check
-        if ip_address.startswith('192.0.2.') or ip_address.startswith('198.51.100.'):
-            reputation['is_datacenter'] = True
+        # Check against known datacenter IP ranges
+        if self._ip_in_ranges(ip_int, self.datacenter_starts, self.datacenter_ends):
+            reputation.is_datacenter = True
         
         # Get distinct countries for this IP (in a real system)
         # Here we'll just simulate it
-        if 'countries_count' not in reputation or reputation['countries_count'] == 0:
-            reputation['countries_count'] = 1
+        if not reputation.countries_count:
+            reputation.countries_count = 1
         
-        return reputation
+        result = reputation.to_row()
+        
+        # Store the derived score so fresh reputations skip rescoring
+        result['cached_risk_score'] = self._calculate_risk_score(result)
+        result['cached_status'] = self._get_reputation_status(result['cached_risk_score'])
+        
+        return result
     
-    def _check_vpn_ip(self, ip_address):
+    def _check_vpn_ip(self, ip_int):
         """
         Check if an IP is a VPN
         In a real implementation, this would call an external API
         
         Args:
-            ip_address (str): IP address to check
+            ip_int (int): Integer form of the address, or None if not IPv4
             
         Returns:
             bool: True if the IP is a VPN
@@ -233,16 +662,27 @@ class IPReputationChecker:
         # For this example, we'll just do a simple check based on patterns
         
         # Simulate API call with a 5% chance of being a VPN for random IPs
-        import random
-        if random.random() < 0.05:
+        if self._next_random() < 0.05:
             return True
         
-        # Check if the IP matches certain patterns
-        if ip_address.startswith('10.8.') or ip_address.endswith('.99'):
+        # Check if the IP is in a known VPN range or uses the .99 host address
+        if self._ip_in_ranges(ip_int, self.vpn_starts, self.vpn_ends):
+            return True
+        if ip_int is not None and ip_int & 0xFF == 99:
             return True
         
         return False
     
+    def _next_random(self):
+        """Next uniform [0, 1) draw, refilling the buffer from the generator when empty"""
+        with self._rng_lock:
+            if self._rng_index >= _RNG_BUFFER_SIZE:
+                self._rng_buffer = self._rng.random(_RNG_BUFFER_SIZE)
+                self._rng_index = 0
+            value = self._rng_buffer[self._rng_index]
+            self._rng_index += 1
+        return value
+    
     def _calculate_risk_score(self, reputation_data):
         """
         Calculate the risk score based on reputation data
@@ -253,35 +693,22 @@ class IPReputationChecker:
         Returns:
             int: Risk score (0-100)
         """
-        # Start with the base score
-        score = reputation_data.get('score', 50)
-        
-        # Adjust based on various factors
-        if reputation_data.get('is_known_abuser'):
-            score = max(score, 90)
-        
-        if reputation_data.get('is_tor'):
-            score = max(score, 80)
-        
-        if reputation_data.get('is_proxy') or reputation_data.get('is_vpn'):
-            score = max(score, 60)
-        
-        if reputation_data.get('is_datacenter'):
-            score = max(score, 40)
-        
+        is_known_abuser, is_tor, is_proxy, is_vpn, is_datacenter = (
+            reputation_data.get(key, False) for key in _FLAG_KEYS
+        )
         failed_logins = reputation_data.get('failed_logins', 0)
-        if failed_logins > 20:
-            score = max(score, 90)
-        elif failed_logins > 10:
-            score = max(score, 75)
-        elif failed_logins > 5:
-            score = max(score, 60)
-        
         countries_count = reputation_data.get('countries_count', 0)
-        if countries_count > 5:
-            score = max(score, 80)
-        elif countries_count > 2:
-            score = max(score, 60)
+        
+        # Start with the base score and raise it to the floor of each factor
+        score = max(
+            reputation_data.get('score', 50),
+            90 if is_known_abuser else 0,
+            80 if is_tor else 0,
+            60 if is_proxy or is_vpn else 0,
+            40 if is_datacenter else 0,
+            int(_FAILED_LOGIN_SCORES[np.searchsorted(_FAILED_LOGIN_BOUNDS, failed_logins)]),
+            int(_COUNTRIES_SCORES[np.searchsorted(_COUNTRIES_BOUNDS, countries_count)])
+        )
         
         return min(100, score)
     
@@ -295,13 +722,4 @@ class IPReputationChecker:
         Returns:
             str: Reputation status
         """
-        if risk_score >= 90:
-            return 'critical'
-        elif risk_score >= 70:
-            return 'high_risk'
-        elif risk_score >= 50:
-            return 'medium_risk'
-        elif risk_score >= 30:
-            return 'low_risk'
-        else:
-            return 'trusted'
+        return _STATUS_LABELS[int(np.searchsorted(_STATUS_THRESHOLDS, risk_score, side='right'))]
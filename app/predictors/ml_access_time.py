@@ -1,13 +1,22 @@
 # app/predictors/ml_access_time.py
 import logging
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
+import numpy as np
 from ml.models.access_time_model import AccessTimeAnomalyDetector
+from ml.models.batch_inference import BatchInferenceQueue
 from app.database import Database
+from app.loaders import login_history_loader
 from ml.models.base import convert_to_datetime
 
 logger = logging.getLogger(__name__)
 
+# Anomaly score breakpoints and the risk scores they map to
+_ANOMALY_BREAKPOINTS = [0.0, 0.3, 0.7, 1.0]
+_RISK_BREAKPOINTS = [0, 33, 66, 100]
+
 class MLAccessTimeAnalyzer:
     """
     Wrapper for AccessTimeAnomalyDetector ML model.
@@ -18,6 +27,15 @@ class MLAccessTimeAnalyzer:
         self.db = Database()
         self.model = AccessTimeAnomalyDetector()
         
+        # LRU of per-user login timestamps (ascending int64 epoch seconds), kept in sync
+        # by analyze: {user_id: (expires_at, timestamps)}. Entries expire so logins
+        # stored by other writers or workers are picked up.
+        self._hist_cache = OrderedDict()
+        self._hist_cache_ttl = 300
+        self._hist_cache_maxsize = 10000
+        self._hist_cache_lock = threading.Lock()
+        self._history_limit = 10
+        
         # Try to load trained model, otherwise use untrained model
         try:
             self.model.load_model()
@@ -25,95 +43,202 @@ class MLAccessTimeAnalyzer:
         except FileNotFoundError:
             logger.warning("No trained model found for AccessTimeAnomalyDetector")
         
+        # Concurrent requests are scored together in one model call
+        self._inference_queue = BatchInferenceQueue(self._predict_batch)
+        
         logger.info("MLAccessTimeAnalyzer initialized")
     
-    def analyze(self, user_id, timestamp=None):
+    def analyze_batch(self, events):
         """
-        Analyze a login timestamp for time-based anomalies
+        Analyze many login events, loading all login histories in one query
+        and scoring every event with a single model call
         
         Args:
-            user_id (str): User identifier
-            timestamp (int): Login timestamp (defaults to current time)
+            events (list): List of (user_id, timestamp) tuples
             
         Returns:
-            dict: Analysis results including anomaly score and time features
+            list: Analysis results in the same order as events
         """
+        if not self.model.is_trained:
+            return [self.analyze(user_id, timestamp) for user_id, timestamp in events]
+        
         try:
-            # Default to current time if not provided
-            if timestamp is None:
-                timestamp = int(time.time())
+            loader = login_history_loader(self.db)
+            loader.prime(user_id for user_id, _ in events if self._cached_history(user_id) is None)
             
-            # Convert timestamp to datetime consistently
-            current_time = timestamp
-            if isinstance(timestamp, int):
-                login_time = datetime.fromtimestamp(timestamp)
-            else:
-                # If it's already a datetime object
-                login_time = timestamp
-                current_time = int(login_time.timestamp())
+            # Record each login before building the next event's history, so a user's
+            # earlier events in the batch are history for the later ones, as in analyze
+            event_ts, histories, summaries = [], [], []
+            for user_id, timestamp in events:
+                timestamp, current_time = self._login_time(timestamp)
+                history_ts = self._get_history_timestamps(user_id, loader)
+                event_ts.append(current_time)
+                histories.append(history_ts)
+                summaries.append(self.model.summarize_history(history_ts))
+                self._record_login(user_id, timestamp, current_time)
             
-            # Get user's login history
-            login_history = self.db.get_login_history(user_id)
+            scores = self.model.predict_timestamps_batch(event_ts, histories, summaries)
+            return [
+                self._score_result(user_id, anomaly_score)
+                for (user_id, _), anomaly_score in zip(events, scores)
+            ]
             
-            # Prepare event data and historical data for the model
-            event_data = {
-                'user_id': user_id,
-                'timestamp': timestamp
-            }
+        except Exception as e:
+            logger.error("Error in batch access time analysis: %s", e)
+            return [self._error_result(e) for _ in events]
+    
+    def analyze(self, user_id, timestamp=None, history_loader=None):
+        """
+        Analyze a login timestamp for time-based anomalies
+        
+        Args:
+            user_id (str): User identifier
+            timestamp (int): Login timestamp (defaults to current time)
+            history_loader (BatchLoader): Optional per-request login history loader
             
-            # Format historical data for the model
-            historical_data = [
-                {'user_id': user_id, 'timestamp': record['timestamp']} 
-                for record in login_history
-            ]
+        Returns:
+            dict: Analysis results including anomaly score and time features
+        """
+        try:
+            timestamp, current_time = self._login_time(timestamp)
             
             # If model is trained, predict anomaly score
             if self.model.is_trained:
-                anomaly_score = self.model.predict(event_data, historical_data)
-                
-                # Anomaly scores are typically between 0-1 where higher values indicate anomalies
-                # Scale to 0-100 risk score with proper thresholding
-                if anomaly_score < 0.3:  # Low anomaly
-                    risk_score = int(anomaly_score * 100 / 3)  # 0-33
-                elif anomaly_score < 0.7:  # Medium anomaly
-                    risk_score = int(33 + (anomaly_score - 0.3) * 100 / 0.4)  # 33-66
-                else:  # High anomaly
-                    risk_score = int(66 + (anomaly_score - 0.7) * 100 / 0.3)  # 66-100
+                history_ts = self._get_history_timestamps(user_id, history_loader)
                 
-                # Determine status based on risk score
-                if risk_score > 75:
-                    status = 'high_anomaly'
-                    message = 'Login time highly unusual for this user'
-                elif risk_score > 40:
-                    status = 'medium_anomaly'
-                    message = 'Login time somewhat unusual for this user'
-                else:
-                    status = 'normal'
-                    message = 'Login time consistent with historical patterns'
+                summary = self.model.summarize_history(history_ts)
+                anomaly_score = self._inference_queue.submit(current_time, (history_ts, summary)).result()
+                result = self._score_result(user_id, anomaly_score)
+            else:
+                # No trained model to score against, so skip loading history and extracting features
+                logger.debug("No trained access time model, skipping analysis for user %s", user_id)
+                result = {
+                    'risk_score': 0,
+                    'status': 'insufficient_data',
+                    'message': 'Not enough data for access time analysis'
+                }
             
             # Store current login for future analysis
-            self.db.store_login({
-                'user_id': user_id,
-                'timestamp': timestamp
-            })
-            
-            # Prepare result
-            result = {
-                'risk_score': risk_score,
-                'status': status,
-                'message': message
-            }
-            
-            # Log high-risk time anomalies
-            if risk_score > 70:
-                logger.warning(f"High-risk time anomaly detected for user {user_id}")
+            self._record_login(user_id, timestamp, current_time)
             
             return result
             
         except Exception as e:
-            logger.error(f"Error in access time analysis: {str(e)}")
-            return {
-                'risk_score': 50,  # Medium risk due to error
-                'status': 'error',
-                'message': f"Error in access time analysis: {str(e)}"
-            }
\ No newline at end of file
+            logger.error("Error in access time analysis: %s", e)
+            return self._error_result(e)
+    
+    def _login_time(self, timestamp):
+        """
+        Normalize a login timestamp
+        
+        Args:
+            timestamp (int or datetime): Login timestamp, or None for the current time
+            
+        Returns:
+            tuple: (timestamp to store, epoch seconds)
+        """
+        # Default to current time if not provided
+        if timestamp is None:
+            timestamp = int(time.time())
+        
+        # Work in epoch seconds; accept datetime objects as well
+        if isinstance(timestamp, datetime):
+            return timestamp, int(timestamp.timestamp())
+        return timestamp, int(timestamp)
+    
+    def _record_login(self, user_id, timestamp, current_time):
+        """Store a login and append it to the user's cached history"""
+        self.db.store_login({
+            'user_id': user_id,
+            'timestamp': timestamp
+        })
+        with self._hist_cache_lock:
+            entry = self._hist_cache.get(user_id)
+            if entry is not None:
+                # Keep the original expiry so the entry is still reloaded periodically
+                history_ts = np.sort(np.append(entry[1], current_time))[-self._history_limit:]
+                self._hist_cache[user_id] = (entry[0], history_ts)
+    
+    def _score_result(self, user_id, anomaly_score):
+        """Build the analysis result for a model anomaly score"""
+        # Anomaly scores are typically between 0-1 where higher values indicate anomalies
+        # Scale piecewise to a 0-100 risk score: low 0-33, medium 33-66, high 66-100
+        risk_score = int(np.interp(anomaly_score, _ANOMALY_BREAKPOINTS, _RISK_BREAKPOINTS))
+        
+        # Determine status based on risk score
+        if risk_score > 75:
+            status = 'high_anomaly'
+            message = 'Login time highly unusual for this user'
+        elif risk_score > 40:
+            status = 'medium_anomaly'
+            message = 'Login time somewhat unusual for this user'
+        else:
+            status = 'normal'
+            message = 'Login time consistent with historical patterns'
+        
+        # Log high-risk time anomalies
+        if risk_score > 70:
+            logger.warning("High-risk time anomaly detected for user %s", user_id)
+        
+        return {
+            'risk_score': risk_score,
+            'status': status,
+            'message': message
+        }
+    
+    def _error_result(self, error):
+        """Build the medium-risk result returned when analysis fails"""
+        return {
+            'risk_score': 50,  # Medium risk due to error
+            'status': 'error',
+            'message': f"Error in access time analysis: {str(error)}"
+        }
+    
+    def _get_history_timestamps(self, user_id, history_loader=None):
+        """
+        Get a user's recent login timestamps, loading them on first use
+        
+        Args:
+            user_id (str): User identifier
+            history_loader (BatchLoader): Optional per-request login history loader
+            
+        Returns:
+            np.ndarray: Ascending int64 login timestamps
+        """
+        history_ts = self._cached_history(user_id)
+        if history_ts is not None:
+            return history_ts
+        
+        if history_loader is not None:
+            login_history = history_loader.load(user_id) or []
+        else:
+            login_history = self.db.get_login_history(user_id, self._history_limit) or []
+        
+        history_ts = np.sort(np.fromiter(
+            (int(convert_to_datetime(record['timestamp']).timestamp()) for record in login_history),
+            dtype=np.int64,
+            count=len(login_history)
+        ))
+        with self._hist_cache_lock:
+            self._hist_cache[user_id] = (time.monotonic() + self._hist_cache_ttl, history_ts)
+            self._hist_cache.move_to_end(user_id)
+            if len(self._hist_cache) > self._hist_cache_maxsize:
+                self._hist_cache.popitem(last=False)
+        return history_ts
+    
+    def _cached_history(self, user_id):
+        """Get a user's cached login timestamps, or None if missing or expired"""
+        with self._hist_cache_lock:
+            entry = self._hist_cache.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._hist_cache[user_id]
+                return None
+            self._hist_cache.move_to_end(user_id)
+            return entry[1]
+    
+    def _predict_batch(self, event_ts, histories):
+        """Score a batch from the inference queue; each history is a (timestamps, summary) pair"""
+        history_ts, summaries = zip(*histories)
+        return self.model.predict_timestamps_batch(event_ts, list(history_ts), list(summaries))
@@ -1,7 +1,9 @@
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from ml.models.auth_behavior_model import AuthBehaviorDetector
 from app.database import Database
+from app.utils.background_writer import BackgroundWriter
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,12 @@ class MLAuthBehaviorAnalyzer:
         self.db = Database()
         self.model = AuthBehaviorDetector()
         
+        # Runs the independent context lookups concurrently
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='auth-behavior')
+        
+        # Event storage is not read back within a request, so it runs after the response
+        self._writer = BackgroundWriter('auth-behavior-writer')
+        
         # Try to load trained model, otherwise use untrained model
         try:
             self.model.load_model()
@@ -41,19 +49,22 @@ class MLAuthBehaviorAnalyzer:
             if timestamp is None:
                 timestamp = int(time.time())
             
-            # Get user's authentication history
-            auth_history = self.db.get_auth_history(user_id)
+            # Get user's authentication history and IP location in parallel
+            # with the device lookup, so the three round-trips overlap
+            history_future = self._executor.submit(self.db.get_auth_history, user_id)
+            location_future = None
+            if ip_address:
+                location_future = self._executor.submit(self.db.get_ip_location, ip_address)
             
             # Get relevant context data - add safety checks
-            geo_location = None
             device_data = None
             
-            if ip_address:
-                geo_location = self.db.get_ip_location(ip_address)
-            
             if user_id:
                 device_data = self.db.get_recent_device_data(user_id)
             
+            auth_history = history_future.result()
+            geo_location = location_future.result() if location_future else None
+            
             # Prepare event data - ensure context is always a dictionary
             event_data = {
                 'user_id': user_id,
@@ -89,7 +100,7 @@ class MLAuthBehaviorAnalyzer:
                 message = 'Not enough data for auth behavior analysis'
             
             # Store event for future analysis
-            self.db.store_auth_event(event_data)
+            self._writer.submit(self.db.store_auth_event, event_data)
             
             # Prepare result
             result = {
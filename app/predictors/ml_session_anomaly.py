@@ -1,8 +1,11 @@
 from datetime import datetime
 import logging
 import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from ml.models.session_anomaly_model import SessionAnomalyDetector
 from app.database import Database
+from app.utils.background_writer import BackgroundWriter
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,12 @@ class MLSessionAnomalyDetector:
         self.db = Database()
         self.model = SessionAnomalyDetector()
         
+        # Fetches session history while the current events are being prepared
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='session-anomaly')
+        
+        # Session storage is not read back within a request, so it runs after the response
+        self._writer = BackgroundWriter('session-anomaly-writer')
+        
         # Try to load trained model, otherwise use untrained model
         try:
             self.model.load_model()
@@ -46,6 +55,9 @@ class MLSessionAnomalyDetector:
                     'message': 'Need at least 2 events for session analysis',
                     'anomaly_score': 0
                 }
+            
+            # Start the historical session fetch before normalizing the events
+            history_future = self._executor.submit(self.db.get_historical_sessions, user_id)
                 
             # Sort events by timestamp if not already sorted
             # Ensure all timestamps are in the same format
@@ -57,10 +69,10 @@ class MLSessionAnomalyDetector:
                     event_copy['timestamp'] = int(event_copy['timestamp'].timestamp())
                 normalized_events.append(event_copy)
                 
-            sorted_events = sorted(normalized_events, key=lambda x: x.get('timestamp', 0))
+            sorted_events = self._sort_events(normalized_events)
             
             # Get historical session data
-            historical_sessions = self.db.get_historical_sessions(user_id)
+            historical_sessions = history_future.result()
             
             # Create current session data
             current_session = {
@@ -96,7 +108,7 @@ class MLSessionAnomalyDetector:
                 message = 'Not enough data for session analysis'
             
             # Store session for future analysis
-            self.db.store_session(user_id, sorted_events)
+            self._writer.submit(self.db.store_session, user_id, sorted_events)
             
             # Prepare result
             result = {
@@ -119,4 +131,26 @@ class MLSessionAnomalyDetector:
                 'risk_score': 50,  # Medium risk due to error
                 'status': 'error',
                 'message': f"Error in session anomaly detection: {str(e)}"
-            }
\ No newline at end of file
+            }
+    
+    def _sort_events(self, events):
+        """
+        Sort events by timestamp, keeping the original order of equal timestamps
+        
+        Args:
+            events (list): Session events with numeric timestamps
+            
+        Returns:
+            list: Events in timestamp order
+        """
+        try:
+            ts = np.fromiter((e.get('timestamp', 0) for e in events), dtype=np.float64, count=len(events))
+        except (TypeError, ValueError):
+            # Non-numeric timestamps: fall back to Python comparisons
+            return sorted(events, key=lambda x: x.get('timestamp', 0))
+        
+        # Events usually arrive in order already
+        if np.all(ts[:-1] <= ts[1:]):
+            return events
+        
+        return [events[i] for i in np.argsort(ts, kind='stable')]
\ No newline at end of file
@@ -1,10 +1,42 @@
 import logging
 import time
 import math
+from collections import namedtuple
+from types import MappingProxyType
 from app.database import Database
+from app.utils.request_batcher import RequestBatcher
 
 logger = logging.getLogger(__name__)
 
+# Attack thresholds, with windows in seconds
+_CountThreshold = namedtuple('_CountThreshold', 'attempts window_seconds risk_score')
+_DistinctThreshold = namedtuple('_DistinctThreshold', 'user_count ip_count window_seconds risk_score')
+
+_BRUTEFORCE = _CountThreshold(attempts=5, window_seconds=10 * 60, risk_score=85)
+_CREDENTIAL_STUFFING = _DistinctThreshold(user_count=10, ip_count=3, window_seconds=30 * 60, risk_score=90)
+_PASSWORD_SPRAYING = _DistinctThreshold(user_count=10, ip_count=1, window_seconds=60 * 60, risk_score=80)
+_GENERIC_ATTACK = _CountThreshold(attempts=15, window_seconds=60 * 60, risk_score=75)
+
+# Window lengths for the database-side failure stats
+_WINDOWS = {
+    'generic': _GENERIC_ATTACK.window_seconds,
+    'bruteforce': _BRUTEFORCE.window_seconds,
+    'credential_stuffing': _CREDENTIAL_STUFFING.window_seconds,
+    'password_spraying': _PASSWORD_SPRAYING.window_seconds
+}
+
+# IP-scoped stats (credential stuffing, spraying, IP failures) are reused for
+# checks from the same IP within the same second
+_IP_STATS_CACHE_MAXSIZE = 10000
+
+# Fields shared by every result where no attack was detected
+_NO_ATTACK = MappingProxyType({
+    'risk_score': 0,
+    'attack_detected': False,
+    'attack_type': None,
+    'message': "No password attacks detected"
+})
+
 class PasswordAttackDetector:
     """
     Detects password-based attacks such as brute force, credential stuffing,
@@ -13,33 +45,11 @@ class PasswordAttackDetector:
     
     def __init__(self):
         self.db = Database()
+        # Concurrent checks share one stats query per batch
+        self._stats_batcher = RequestBatcher('password-attack-stats', self._fetch_stats_batch)
+        # {ip: (second, IP stats)}; only touched from the batcher's worker thread
+        self._ip_stats_cache = {}
         logger.info("PasswordAttackDetector initialized")
-        
-        # Attack thresholds
-        self.thresholds = {
-            'bruteforce': {
-                'attempts': 5,
-                'window_minutes': 10,
-                'risk_score': 85
-            },
-            'credential_stuffing': {
-                'user_count': 10,
-                'ip_count': 3,
-                'window_minutes': 30,
-                'risk_score': 90
-            },
-            'password_spraying': {
-                'user_count': 10,
-                'ip_count': 1,
-                'window_minutes': 60,
-                'risk_score': 80
-            },
-            'generic_attack': {
-                'attempts': 15,
-                'window_minutes': 60,
-                'risk_score': 75
-            }
-        }
     
     def detect(self, user_id, ip_address):
         """
@@ -53,46 +63,47 @@ class PasswordAttackDetector:
             dict: Detection results including risk score and attack type
         """
         try:
-            # Get failed login data
-            user_failures = self.db.get_recent_failed_logins(
-                username=user_id,
-                minutes=self.thresholds['generic_attack']['window_minutes']
-            )
+            # Get all failed login counts in one (batched) query; the database does the counting
+            stats = self._stats_batcher.submit((user_id, ip_address))
+            user_failures_count = stats['user_failures_count']
+            ip_failures_count = stats['ip_failures_count']
             
-            ip_failures = self.db.get_recent_failed_logins(
-                ip_address=ip_address,
-                minutes=self.thresholds['generic_attack']['window_minutes']
-            )
+            # Detect different attack types, most specific first; checks whose
+            # risk score could not outrank an attack already found are skipped
+            attacks = []
             
-            all_recent_failures = self.db.get_recent_failed_logins(
-                minutes=self.thresholds['generic_attack']['window_minutes']
-            )
+            brute_force = self._detect_brute_force(user_id, ip_address, stats['bruteforce_attempts'])
+            if brute_force['detected']:
+                attacks.append(brute_force)
             
-            # Detect different attack types
-            brute_force = self._detect_brute_force(user_id, ip_address, user_failures)
-            credential_stuffing = self._detect_credential_stuffing(ip_address, all_recent_failures)
-            password_spraying = self._detect_password_spraying(all_recent_failures)
+            if _CREDENTIAL_STUFFING.risk_score > self._max_risk(attacks):
+                credential_stuffing = self._detect_credential_stuffing(
+                    ip_address, stats['stuffing_user_count'], stats['stuffing_users']
+                )
+                if credential_stuffing['detected']:
+                    attacks.append(credential_stuffing)
             
-            # Determine the most severe attack
-            attacks = [brute_force, credential_stuffing, password_spraying]
-            attacks = [a for a in attacks if a['detected']]
+            if _PASSWORD_SPRAYING.risk_score > self._max_risk(attacks):
+                password_spraying = self._detect_password_spraying(
+                    stats['spraying_user_count'], stats['spraying_ip_count'],
+                    stats['spraying_users'], stats['spraying_ips']
+                )
+                if password_spraying['detected']:
+                    attacks.append(password_spraying)
             
             if not attacks:
                 # No attacks detected
                 return {
-                    'risk_score': 0,
-                    'attack_detected': False,
-                    'attack_type': None,
-                    'message': "No password attacks detected",
-                    'user_failures_count': len(user_failures),
-                    'ip_failures_count': len(ip_failures)
+                    **_NO_ATTACK,
+                    'user_failures_count': user_failures_count,
+                    'ip_failures_count': ip_failures_count
                 }
             
             # Get the most severe attack (highest risk score)
             most_severe = max(attacks, key=lambda x: x['risk_score'])
             
             # Calculate velocity and acceleration
-            velocity, acceleration = self._calculate_attack_metrics(ip_failures)
+            velocity, acceleration = self._calculate_attack_metrics(stats['ip_failure_timestamps'])
             
             # Prepare result
             result = {
@@ -101,8 +112,8 @@ class PasswordAttackDetector:
                 'attack_type': most_severe['type'],
                 'message': most_severe['message'],
                 'attack_details': {
-                    'user_failures_count': len(user_failures),
-                    'ip_failures_count': len(ip_failures),
+                    'user_failures_count': user_failures_count,
+                    'ip_failures_count': ip_failures_count,
                     'velocity': velocity,
                     'acceleration': acceleration,
                     'ip_addresses': most_severe.get('ip_addresses', []),
@@ -112,14 +123,14 @@ class PasswordAttackDetector:
             
             # Log detected attacks
             logger.warning(
-                f"Password attack detected: {most_severe['type']} against user {user_id} "
-                f"from IP {ip_address}"
+                "Password attack detected: %s against user %s from IP %s",
+                most_severe['type'], user_id, ip_address
             )
             
             return result
             
         except Exception as e:
-            logger.error(f"Error in password attack detection: {str(e)}")
+            logger.error("Error in password attack detection: %s", e)
             return {
                 'risk_score': 50,  # Medium risk due to error
                 'attack_detected': False,
@@ -127,151 +138,156 @@ class PasswordAttackDetector:
                 'message': f"Error in password attack detection: {str(e)}"
             }
     
-    def _detect_brute_force(self, user_id, ip_address, user_failures):
+    def _fetch_stats_batch(self, pairs):
+        """
+        Get failed login stats for a batch of checks
+        
+        Brute force counts are always queried; IP stats are reused from checks
+        on the same IP earlier in the same second.
+        
+        Args:
+            pairs (list): (user_id, ip_address) tuples
+            
+        Returns:
+            list: Stats for each pair, in order
+        """
+        # One reference time for every window and every check in the batch
+        now = time.time()
+        second = int(now)
+        
+        cache = self._ip_stats_cache
+        if len(cache) > _IP_STATS_CACHE_MAXSIZE:
+            cache = self._ip_stats_cache = {
+                ip_address: entry for ip_address, entry in cache.items() if entry[0] == second
+            }
+        
+        ip_stats = {}
+        missing = []
+        for _, ip_address in pairs:
+            entry = cache.get(ip_address)
+            if entry and entry[0] == second:
+                ip_stats[ip_address] = entry[1]
+            elif ip_address not in missing:
+                missing.append(ip_address)
+        
+        user_stats, fetched = self.db.get_password_attack_stats_batch(pairs, missing, _WINDOWS, now)
+        for ip_address, stats in fetched.items():
+            cache[ip_address] = (second, stats)
+        ip_stats.update(fetched)
+        
+        return [{**user, **ip_stats[ip_address]} for user, (_, ip_address) in zip(user_stats, pairs)]
+    
+    @staticmethod
+    def _max_risk(attacks):
+        """Highest risk score among detected attacks, 0 if none"""
+        return max((a['risk_score'] for a in attacks), default=0)
+    
+    def _detect_brute_force(self, user_id, ip_address, attempts):
         """
         Detect brute force attacks against a specific user
         
         Args:
             user_id (str): User identifier
             ip_address (str): IP address
-            user_failures (list): Failed login attempts for the user
+            attempts (int): Recent failures from this IP against this user
             
         Returns:
             dict: Detection results
         """
-        # Filter failures by time window and IP
-        threshold = self.thresholds['bruteforce']
-        window_seconds = threshold['window_minutes'] * 60
-        now = time.time()
-        
-        # Check failures from this IP against this user
-        ip_failures_for_user = [
-            f for f in user_failures 
-            if f['ip_address'] == ip_address and now - f['timestamp'] <= window_seconds
-        ]
-        
         # Detect brute force attack
-        detected = len(ip_failures_for_user) >= threshold['attempts']
+        detected = attempts >= _BRUTEFORCE.attempts
         
         return {
             'type': 'bruteforce',
             'detected': detected,
-            'risk_score': threshold['risk_score'] if detected else 0,
-            'message': f"Brute force attack detected: {len(ip_failures_for_user)} failed attempts "
+            'risk_score': _BRUTEFORCE.risk_score if detected else 0,
+            'message': f"Brute force attack detected: {attempts} failed attempts "
                       f"against user {user_id} from IP {ip_address}",
             'ip_addresses': [ip_address]
         }
     
-    def _detect_credential_stuffing(self, ip_address, all_failures):
+    def _detect_credential_stuffing(self, ip_address, user_count, sample_users):
         """
         Detect credential stuffing attacks (multiple users, few IPs)
         
         Args:
             ip_address (str): Current IP address
-            all_failures (list): All recent failed login attempts
+            user_count (int): Distinct users with recent failures from this IP
+            sample_users (list): Up to 10 of those users
             
         Returns:
             dict: Detection results
         """
-        threshold = self.thresholds['credential_stuffing']
-        window_seconds = threshold['window_minutes'] * 60
-        now = time.time()
-        
-        # Get recent failures from this IP
-        recent_ip_failures = [
-            f for f in all_failures 
-            if f['ip_address'] == ip_address and now - f['timestamp'] <= window_seconds
-        ]
-        
-        # Count unique users
-        unique_users = set(f['username'] for f in recent_ip_failures)
-        
         # Detect credential stuffing
-        detected = len(unique_users) >= threshold['user_count']
+        detected = user_count >= _CREDENTIAL_STUFFING.user_count
         
         return {
             'type': 'credential_stuffing',
             'detected': detected,
-            'risk_score': threshold['risk_score'] if detected else 0,
-            'message': f"Credential stuffing attack detected: {len(unique_users)} different users "
+            'risk_score': _CREDENTIAL_STUFFING.risk_score if detected else 0,
+            'message': f"Credential stuffing attack detected: {user_count} different users "
                       f"targeted from IP {ip_address}",
             'ip_addresses': [ip_address],
-            'affected_users': list(unique_users)[:10]  # Limit to first 10
+            'affected_users': sample_users
         }
     
-    def _detect_password_spraying(self, all_failures):
+    def _detect_password_spraying(self, user_count, ip_count, sample_users, sample_ips):
         """
         Detect password spraying attacks (many users, common password)
         
         Args:
-            all_failures (list): All recent failed login attempts
+            user_count (int): Distinct users with recent failures
+            ip_count (int): Distinct IP addresses with recent failures
+            sample_users (list): Up to 10 of those users
+            sample_ips (list): Up to 10 of those IP addresses
             
         Returns:
             dict: Detection results
         """
-        threshold = self.thresholds['password_spraying']
-        window_seconds = threshold['window_minutes'] * 60
-        now = time.time()
-        
-        # Get very recent failures
-        recent_failures = [f for f in all_failures if now - f['timestamp'] <= window_seconds]
-        
-        # Count unique users and IPs
-        unique_users = set(f['username'] for f in recent_failures)
-        unique_ips = set(f['ip_address'] for f in recent_failures)
-        
         # Detect password spraying (many users, few IPs)
         detected = (
-            len(unique_users) >= threshold['user_count'] and 
-            len(unique_ips) <= threshold['ip_count'] * 3  # Allow some flexibility
+            user_count >= _PASSWORD_SPRAYING.user_count and 
+            ip_count <= _PASSWORD_SPRAYING.ip_count * 3  # Allow some flexibility
         )
         
         return {
             'type': 'password_spraying',
             'detected': detected,
-            'risk_score': threshold['risk_score'] if detected else 0,
-            'message': f"Password spraying attack detected: {len(unique_users)} different users "
-                      f"targeted from {len(unique_ips)} IP addresses",
-            'ip_addresses': list(unique_ips),
-            'affected_users': list(unique_users)[:10]  # Limit to first 10
+            'risk_score': _PASSWORD_SPRAYING.risk_score if detected else 0,
+            'message': f"Password spraying attack detected: {user_count} different users "
+                      f"targeted from {ip_count} IP addresses",
+            'ip_addresses': sample_ips,
+            'affected_users': sample_users
         }
     
-    def _calculate_attack_metrics(self, failures):
+    def _calculate_attack_metrics(self, timestamps):
         """
         Calculate attack velocity and acceleration
         
         Args:
-            failures (list): Failed login attempts
+            timestamps (list): Failed login timestamps in ascending order
             
         Returns:
             tuple: (velocity, acceleration)
         """
-        if not failures or len(failures) < 3:
+        if not timestamps or len(timestamps) < 3:
             return 0, 0
         
-        # Sort by timestamp
-        sorted_failures = sorted(failures, key=lambda x: x['timestamp'])
-        
-        # Calculate time differences
-        timestamps = [f['timestamp'] for f in sorted_failures]
-        time_diffs = [timestamps[i+1] - timestamps[i] for i in range(len(timestamps)-1)]
-        
-        if not time_diffs:
-            return 0, 0
+        # Gaps between consecutive failures telescope: the gaps from index i to j
+        # sum to timestamps[j] - timestamps[i], so no per-gap array is needed
+        gap_count = len(timestamps) - 1
+        half = gap_count // 2
         
         # Calculate velocity (failures per minute)
-        total_time = timestamps[-1] - timestamps[0]
-        velocity = (len(failures) - 1) * 60 / total_time if total_time > 0 else 0
+        total_time = float(timestamps[-1] - timestamps[0])
+        velocity = gap_count * 60 / total_time if total_time > 0 else 0
         
         # Calculate acceleration (change in velocity)
-        if len(time_diffs) < 2:
-            return velocity, 0
-        
-        first_half = time_diffs[:len(time_diffs)//2]
-        second_half = time_diffs[len(time_diffs)//2:]
+        first_half_time = float(timestamps[half] - timestamps[0])
+        second_half_time = float(timestamps[-1] - timestamps[half])
         
-        velocity1 = len(first_half) * 60 / sum(first_half) if sum(first_half) > 0 else 0
-        velocity2 = len(second_half) * 60 / sum(second_half) if sum(second_half) > 0 else 0
+        velocity1 = half * 60 / first_half_time if first_half_time > 0 else 0
+        velocity2 = (gap_count - half) * 60 / second_half_time if second_half_time > 0 else 0
         
         acceleration = velocity2 - velocity1
         
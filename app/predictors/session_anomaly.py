@@ -1,11 +1,159 @@
+import base64
 import logging
-import json
+import threading
 import time
+from collections import OrderedDict, namedtuple
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from app.database import Database
+from app.loaders import user_model_loader
 
 logger = logging.getLogger(__name__)
 
+# User models are cached for this long; this process's own updates are written through
+_MODEL_CACHE_TTL = 60
+_MODEL_CACHE_MAXSIZE = 10000
+
+# Outcome of one anomaly check; turned into a dict only for checks that report anomalies
+_AnomalyResult = namedtuple('_AnomalyResult', 'detected score details')
+
+# A session's events in timestamp order, with their fields extracted into parallel columns
+_SessionColumns = namedtuple('_SessionColumns', 'events timestamps event_types activity_ids')
+
+def _transition_matrix(transitions):
+    """
+    Dense form of a transitions dict
+    
+    Args:
+        transitions (dict): {from_state: {to_state: probability}}
+    
+    Returns:
+        tuple: (state_index, matrix) where state_index maps state names to rows/columns
+               and matrix holds each probability, or -1 where the model has no transition.
+               The last row and column are all -1 and stand for any state not in the
+               model, so index -1 can be looked up like a known state
+    """
+    state_index = {}
+    for prev_type, row in transitions.items():
+        state_index.setdefault(prev_type, len(state_index))
+        for current_type in row:
+            state_index.setdefault(current_type, len(state_index))
+    
+    matrix = np.full((len(state_index) + 1, len(state_index) + 1), -1.0)
+    for prev_type, row in transitions.items():
+        i = state_index[prev_type]
+        for current_type, probability in row.items():
+            matrix[i, state_index[current_type]] = probability
+    
+    return state_index, matrix
+
+def _model_transitions(model):
+    """
+    Dense transitions of a stored user model
+    
+    Models store their transitions as a state list and a base64 float32 matrix
+    (see _encoded_transitions); models saved as a nested transitions dict are
+    still read.
+    
+    Args:
+        model (dict): User behavioral model
+    
+    Returns:
+        tuple: (state_index, matrix) as returned by _transition_matrix, or None if
+               the model has no transitions
+    """
+    if 'transition_matrix' in model:
+        states = model['transition_states']
+        n = len(states)
+        matrix = np.full((n + 1, n + 1), -1.0)
+        matrix[:n, :n] = np.frombuffer(base64.b64decode(model['transition_matrix']), dtype=np.float32).reshape(n, n)
+        return {state: i for i, state in enumerate(states)}, matrix
+    
+    if 'transitions' in model:
+        return _transition_matrix(model['transitions'])
+    
+    return None
+
+def _encoded_transitions(state_index, matrix):
+    """
+    Storable form of dense transitions
+    
+    Args:
+        state_index (dict): State name to row/column
+        matrix (ndarray): Transition probabilities with the unknown-state padding
+    
+    Returns:
+        dict: transition_states list and base64 float32 transition_matrix
+    """
+    n = len(state_index)
+    return {
+        'transition_states': list(state_index),
+        'transition_matrix': base64.b64encode(matrix[:n, :n].astype(np.float32).tobytes()).decode('ascii')
+    }
+
+def _updated_transitions(state_index, matrix, event_types):
+    """
+    Fold a session's transitions into dense transitions
+    
+    Each observed transition adds 0.1 to its row, which is then renormalized.
+    Applied one transition at a time, that makes every row after its first
+    update an exponential moving average with decay 1 / 1.1, so the final rows
+    are computed in closed form: the k-th of n transitions from a state weighs
+    (1 - decay) * decay ** (n - k), the first one and the prior row share
+    decay ** (n - 1) / (prior_total + 0.1).
+    
+    Args:
+        state_index (dict): State name to row/column; not modified
+        matrix (ndarray): Transition probabilities as returned by _transition_matrix; not modified
+        event_types (list): Session event types in order
+    
+    Returns:
+        tuple: Updated (state_index, matrix), rounded to the float32 precision they are stored at
+    """
+    state_index = dict(state_index)
+    sequence = np.fromiter((state_index.setdefault(t, len(state_index)) for t in event_types),
+                           dtype=np.intp, count=len(event_types))
+    
+    # Grow the matrix for states first seen in this session, keeping the padding last
+    n = len(state_index)
+    known = matrix.shape[0] - 1
+    updated = np.full((n + 1, n + 1), -1.0)
+    updated[:known, :known] = matrix[:known, :known]
+    if len(event_types) < 2:
+        return state_index, updated
+    
+    decay = 1 / 1.1
+    prev_states = sequence[:-1]
+    current_states = sequence[1:]
+    
+    # Position of each transition among the transitions leaving the same state
+    order = np.argsort(prev_states, kind='stable')
+    sorted_prev = prev_states[order]
+    group_start = np.flatnonzero(np.r_[True, sorted_prev[1:] != sorted_prev[:-1]])
+    group_size = np.diff(np.r_[group_start, sorted_prev.size])
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size) - np.repeat(group_start, group_size)
+    totals = np.bincount(prev_states, minlength=n)
+    remaining = totals[prev_states] - rank - 1
+    
+    # The first transition from each state joins the prior row and is rescaled with
+    # it; later ones decay by how many transitions from that state follow them
+    first = rank == 0
+    first_added = np.zeros((n, n))
+    first_added[prev_states[first], current_states[first]] = 0.1
+    later_added = np.zeros((n, n))
+    np.add.at(later_added, (prev_states[~first], current_states[~first]), (1 - decay) * decay ** remaining[~first])
+    
+    rows = np.unique(prev_states)
+    block = updated[rows, :n]
+    present = block >= 0
+    kept = np.where(present, block, 0.0)
+    scale = decay ** (totals[rows] - 1) / (kept.sum(axis=1) + 0.1)
+    added = first_added[rows] * scale[:, None] + later_added[rows]
+    updated[rows, :n] = np.where(present | (added > 0), kept * scale[:, None] + added, -1.0)
+    
+    return state_index, updated.astype(np.float32).astype(np.float64)
+
 class SessionAnomalyDetector:
     """
     Detects anomalies in user session behavior using various techniques
@@ -41,6 +189,11 @@ class SessionAnomalyDetector:
             'change_security_questions': 20,
             'disable_2fa': 30
         }
+        # Suspicious activities numbered from 1, with lookup tables of their risk
+        # levels and anomaly score contributions (normalized to 0-1); id 0 is any other event
+        self._activity_id = {activity: i + 1 for i, activity in enumerate(self.suspicious_activities)}
+        self._risk_lut = np.array([0] + list(self.suspicious_activities.values()), dtype=np.int16)
+        self._activity_score_lut = np.minimum(self._risk_lut / 30, 1.0)
         
         # Time thresholds (in seconds)
         self.time_thresholds = {
@@ -48,8 +201,41 @@ class SessionAnomalyDetector:
             'max_time_for_sequence': 1800,     # Maximum time for a typical sequence
             'typical_session_length': 900      # Typical session length
         }
+        
+        # Dense form of the defaults, shared by every user without stored transitions
+        self._default_matrix = _transition_matrix(self.default_transitions)
+        
+        # Short-lived LRU of user models keyed by user: {user_id: [expires_at, version, model, matrix]}.
+        # An entry is only served while its version matches the stored model's, so
+        # updates written by other workers are picked up on the next session.
+        self._model_cache = OrderedDict()
+        self._model_cache_lock = threading.Lock()
+    
+    def detect_batch(self, sessions):
+        """
+        Detect anomalies in many sessions, loading all user models in one query
+        
+        Args:
+            sessions (list): List of (user_id, session_events) tuples
+        
+        Returns:
+            list: Detection results in the same order as sessions
+        """
+        loader = user_model_loader(self.db)
+        loader.prime(user_id for user_id, _ in sessions)
+        
+        results = []
+        seen = set()
+        for user_id, session_events in sessions:
+            # A user's later sessions must see the model their earlier ones updated,
+            # so only the first one reads the batch-loaded copy
+            results.append(self.detect(
+                user_id, session_events, model_loader=None if user_id in seen else loader
+            ))
+            seen.add(user_id)
+        return results
     
-    def detect(self, user_id, session_events):
+    def detect(self, user_id, session_events, model_loader=None):
         """
         Detect anomalies in session behavior
         
@@ -57,52 +243,52 @@ class SessionAnomalyDetector:
             user_id (str): User identifier
             session_events (list): List of session events
                 Each event should have 'type', 'timestamp', and optional 'metadata'
-            
+            model_loader (BatchLoader): Optional per-request user model loader
+        
         Returns:
             dict: Detection results including anomaly score and flags
         """
+        # Validate input
+        if not session_events:
+            return {
+                'risk_score': 0,
+                'status': 'insufficient_data',
+                'message': 'No session events provided for analysis',
+                'anomaly_score': 0
+            }
+        
+        if not isinstance(session_events, (list, tuple)):
+            return {
+                'risk_score': 50,  # Medium risk due to error
+                'status': 'error',
+                'message': 'Error in session anomaly detection: session events must be a list'
+            }
+        
+        # Require at least 2 events for meaningful analysis
+        if len(session_events) < 2:
+            return {
+                'risk_score': 0,
+                'status': 'insufficient_data',
+                'message': 'Need at least 2 events for session analysis',
+                'anomaly_score': 0
+            }
+        
+        # Malformed events (missing fields of the wrong type, non-dict events)
+        # surface while they are analyzed and are reported as errors below
         try:
-            # Validate input
-            if not session_events:
-                return {
-                    'risk_score': 0,
-                    'status': 'insufficient_data',
-                    'message': 'No session events provided for analysis',
-                    'anomaly_score': 0
-                }
-            
-            # Require at least 2 events for meaningful analysis
-            if len(session_events) < 2:
-                return {
-                    'risk_score': 0,
-                    'status': 'insufficient_data',
-                    'message': 'Need at least 2 events for session analysis',
-                    'anomaly_score': 0
-                }
-            
-            # Sort events by timestamp if not already sorted
-            sorted_events = sorted(session_events, key=lambda x: x.get('timestamp', 0))
+            # Sort events by timestamp and extract their fields once
+            columns = self._session_columns(session_events)
+            sorted_events = columns.events
             
             # Get user's behavioral model
-            user_model = self._get_user_model(user_id)
-            
-            # Check for timing anomalies
-            timing_anomalies = self._check_timing_anomalies(sorted_events)
+            user_model, transition_matrix = self._get_user_model(user_id, model_loader)
             
-            # Check for sequence anomalies using Markov chain
-            sequence_anomalies = self._check_sequence_anomalies(sorted_events, user_model)
-            
-            # Check for suspicious activities
-            activity_anomalies = self._check_activity_anomalies(sorted_events)
+            # Check for timing, sequence (Markov chain) and suspicious activity anomalies
+            timing_anomalies, sequence_anomalies, activity_anomalies = self._analyze_events(
+                columns, transition_matrix)
             
             # Combine anomaly scores
-            anomaly_scores = [
-                timing_anomalies.get('score', 0),
-                sequence_anomalies.get('score', 0),
-                activity_anomalies.get('score', 0)
-            ]
-            
-            combined_score = max(anomaly_scores)
+            combined_score = max(timing_anomalies.score, sequence_anomalies.score, activity_anomalies.score)
             
             # Calculate risk score based on anomaly score
             risk_score = self._calculate_risk_score(combined_score)
@@ -120,18 +306,16 @@ class SessionAnomalyDetector:
             
             # Update user model with this session (if not too anomalous)
             if combined_score < 0.7:  # Don't learn from very anomalous sessions
-                self._update_user_model(user_id, sorted_events, user_model)
+                self._update_user_model(user_id, columns, user_model, transition_matrix)
             
             # Prepare detailed anomalies
-            anomalies = {}
-            if timing_anomalies.get('detected', False):
-                anomalies['timing'] = timing_anomalies
-            
-            if sequence_anomalies.get('detected', False):
-                anomalies['sequence'] = sequence_anomalies
-            
-            if activity_anomalies.get('detected', False):
-                anomalies['activities'] = activity_anomalies
+            anomalies = {
+                name: check._asdict()
+                for name, check in (('timing', timing_anomalies),
+                                    ('sequence', sequence_anomalies),
+                                    ('activities', activity_anomalies))
+                if check.detected
+            }
             
             # Prepare result
             result = {
@@ -145,42 +329,121 @@ class SessionAnomalyDetector:
             
             # Log high-risk sessions
             if risk_score > 70:
-                logger.warning(f"High-risk session behavior detected for user {user_id}")
+                logger.warning("High-risk session behavior detected for user %s", user_id)
             
             return result
-            
+        
         except Exception as e:
-            logger.error(f"Error in session anomaly detection: {str(e)}")
+            logger.error("Error in session anomaly detection: %s", e)
             return {
                 'risk_score': 50,  # Medium risk due to error
                 'status': 'error',
                 'message': f"Error in session anomaly detection: {str(e)}"
             }
     
-    def _get_user_model(self, user_id):
+    def _get_user_model(self, user_id, model_loader=None):
         """
         Get the user's behavioral model
         
         Args:
             user_id (str): User identifier
-            
+            model_loader (BatchLoader): Optional per-request user model loader
+        
         Returns:
-            dict: User behavioral model
+            tuple: (user behavioral model, (state_index, matrix) dense form of its transitions)
         """
         # Get user model from database
-        user_model = self.db.get_user_model(user_id)
+        if model_loader is not None:
+            # The batch loader has just read every model, so it is already fresh
+            version = None
+            user_model = model_loader.load(user_id)
+        else:
+            # A cheap version read decides whether the cached model is still current
+            version = self.db.get_user_model_version(user_id)
+            now = time.monotonic()
+            with self._model_cache_lock:
+                entry = self._model_cache.get(user_id)
+                if entry and entry[0] > now and entry[1] == version:
+                    self._model_cache.move_to_end(user_id)
+                    return entry[2], entry[3]
+            
+            user_model = self.db.get_user_model(user_id)
         
         # If no model exists, create a new one with defaults
         if not user_model:
             user_model = {
-                'transitions': self.default_transitions.copy(),
                 'avg_session_length': self.time_thresholds['typical_session_length'],
                 'avg_time_between_actions': 30,  # 30 seconds as default
                 'common_actions': [],
                 'session_count': 0
             }
         
-        return user_model
+        transition_matrix = _model_transitions(user_model) or self._default_matrix
+        self._cache_user_model(user_id, version, user_model, transition_matrix)
+        return user_model, transition_matrix
+    
+    def _cache_user_model(self, user_id, version, user_model, transition_matrix):
+        """Store a user model, its stored version and its dense transitions in the LRU cache"""
+        with self._model_cache_lock:
+            self._model_cache[user_id] = [
+                time.monotonic() + _MODEL_CACHE_TTL, version, user_model, transition_matrix
+            ]
+            self._model_cache.move_to_end(user_id)
+            if len(self._model_cache) > _MODEL_CACHE_MAXSIZE:
+                self._model_cache.popitem(last=False)
+    
+    def _session_columns(self, session_events):
+        """
+        Split session events into columns in a single pass, sorted by timestamp
+        
+        Args:
+            session_events (list): Session events in any order
+        
+        Returns:
+            _SessionColumns: Events and their timestamps, types and suspicious activity ids
+        """
+        timestamps = []
+        event_types = []
+        # Suspicious activities are rare, so only their ids are written
+        activity_ids = np.zeros(len(session_events), dtype=np.intp)
+        activity_id = self._activity_id
+        
+        for i, event in enumerate(session_events):
+            event_type = event.get('type')
+            timestamps.append(event.get('timestamp', 0))
+            event_types.append(event_type)
+            if event_type in activity_id:
+                activity_ids[i] = activity_id[event_type]
+        
+        events = session_events
+        
+        # Ingestion usually delivers events in order, so check that in linear time
+        # before sorting; the index sort is stable like sorting the events themselves
+        if not all(previous <= current for previous, current in zip(timestamps, timestamps[1:])):
+            order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+            events = [session_events[i] for i in order]
+            timestamps = [timestamps[i] for i in order]
+            event_types = [event_types[i] for i in order]
+            activity_ids = activity_ids[order]
+        
+        return _SessionColumns(events, timestamps, event_types, activity_ids)
+    
+    def _analyze_events(self, columns, transition_matrix):
+        """
+        Run the timing, sequence and activity checks on a session's columns
+        
+        Args:
+            columns (_SessionColumns): Session events sorted by timestamp, split into columns
+            transition_matrix (tuple): Dense (state_index, matrix) form of the user's transitions
+        
+        Returns:
+            tuple: (timing, sequence, activity) _AnomalyResult
+        """
+        return (
+            self._timing_anomalies(columns.timestamps),
+            self._sequence_anomalies(columns.event_types, transition_matrix),
+            self._activity_anomalies(columns.events, columns.event_types, columns.activity_ids)
+        )
     
     def _check_timing_anomalies(self, events):
         """
@@ -188,42 +451,61 @@ class SessionAnomalyDetector:
         
         Args:
             events (list): Session events sorted by timestamp
-            
+        
         Returns:
             dict: Timing anomaly details
         """
+        return self._timing_anomalies([event.get('timestamp', 0) for event in events])._asdict()
+    
+    def _timing_anomalies(self, timestamps):
+        """
+        Check for timing anomalies in the session
+        
+        Args:
+            timestamps (list): Event timestamps in order
+        
+        Returns:
+            _AnomalyResult: Timing anomaly details
+        """
         anomalies = []
         anomaly_score = 0
+        min_time = self.time_thresholds['min_time_between_actions']
+        max_time = self.time_thresholds['max_time_for_sequence']
+        
+        # Check time between events; only flagged gaps are visited in Python,
+        # and their differences are recomputed there to keep the original types
+        diffs = np.diff(np.asarray(timestamps))
+        too_fast = diffs < min_time
+        long_gap = diffs > max_time
         
-        # Check time between events
-        for i in range(1, len(events)):
-            current_time = events[i].get('timestamp', 0)
-            previous_time = events[i-1].get('timestamp', 0)
-            time_diff = current_time - previous_time
+        for i in np.flatnonzero(too_fast | long_gap).tolist():
+            index = i + 1
+            time_diff = timestamps[index] - timestamps[i]
             
             # Too fast (bot-like behavior)
-            if time_diff < self.time_thresholds['min_time_between_actions']:
+            if too_fast[i]:
                 anomalies.append({
                     'type': 'too_fast',
-                    'event_index': i,
+                    'event_index': index,
                     'time_diff': time_diff,
-                    'threshold': self.time_thresholds['min_time_between_actions']
+                    'threshold': min_time
                 })
-                anomaly_score = max(anomaly_score, 0.8)
             
             # Unusually long gap
-            elif time_diff > self.time_thresholds['max_time_for_sequence']:
+            else:
                 anomalies.append({
                     'type': 'long_gap',
-                    'event_index': i,
+                    'event_index': index,
                     'time_diff': time_diff,
-                    'threshold': self.time_thresholds['max_time_for_sequence']
+                    'threshold': max_time
                 })
-                anomaly_score = max(anomaly_score, 0.6)
+        
+        if anomalies:
+            anomaly_score = 0.8 if too_fast.any() else 0.6
         
         # Check overall session length
-        if len(events) >= 2:
-            session_length = events[-1].get('timestamp', 0) - events[0].get('timestamp', 0)
+        if len(timestamps) >= 2:
+            session_length = timestamps[-1] - timestamps[0]
             
             # Unusually long session
             if session_length > 5 * self.time_thresholds['typical_session_length']:
@@ -234,57 +516,73 @@ class SessionAnomalyDetector:
                 })
                 anomaly_score = max(anomaly_score, 0.5)
         
-        return {
-            'detected': len(anomalies) > 0,
-            'score': anomaly_score,
-            'details': anomalies
-        }
+        return _AnomalyResult(len(anomalies) > 0, anomaly_score, anomalies)
     
-    def _check_sequence_anomalies(self, events, user_model):
+    def _check_sequence_anomalies(self, events, user_model, transition_matrix=None):
         """
         Check for sequence anomalies using Markov chain
         
         Args:
             events (list): Session events sorted by timestamp
             user_model (dict): User behavioral model
-            
+            transition_matrix (tuple): Dense (state_index, matrix) form of the model's
+                transitions, built from user_model if not given
+        
         Returns:
             dict: Sequence anomaly details
         """
+        if transition_matrix is None:
+            transition_matrix = _model_transitions(user_model) or self._default_matrix
+        return self._sequence_anomalies([event.get('type') for event in events], transition_matrix)._asdict()
+    
+    def _sequence_anomalies(self, event_types, transition_matrix):
+        """
+        Check for sequence anomalies using Markov chain
+        
+        Args:
+            event_types (list): Session event types in order
+            transition_matrix (tuple): Dense (state_index, matrix) form of the user's transitions
+        
+        Returns:
+            _AnomalyResult: Sequence anomaly details
+        """
         anomalies = []
         anomaly_score = 0
-        transitions = user_model.get('transitions', self.default_transitions)
+        state_index, probabilities = transition_matrix
         
-        # Extract event types from the events
-        event_types = [event.get('type') for event in events]
+        # Look up every transition's probability in one gather; unknown states map
+        # to the matrix's -1 row and column, so -1 marks transitions missing from the model
+        states = np.fromiter((state_index.get(t, -1) for t in event_types), dtype=np.intp, count=len(event_types))
+        transition_probs = probabilities[states[:-1], states[1:]]
+        
+        unknown = transition_probs < 0
+        unlikely = ~unknown & (transition_probs < 0.05)
         
-        # Check transitions
-        for i in range(1, len(event_types)):
-            prev_type = event_types[i-1]
-            current_type = event_types[i]
+        if unknown.any():
+            anomaly_score = 0.7
+        if unlikely.any():
+            # Lower probability means a more anomalous transition
+            anomaly_score = max(anomaly_score, float((1 - transition_probs[unlikely] / 0.05).max()))
+        
+        # Only the flagged transitions need detail records, in sequence order
+        for i in np.flatnonzero(unknown | unlikely):
+            prev_type = event_types[i]
+            current_type = event_types[i + 1]
             
-            # Check if transition exists in model
-            if prev_type in transitions and current_type in transitions.get(prev_type, {}):
-                # Get transition probability
-                probability = transitions[prev_type].get(current_type, 0)
-                
-                # If probability is very low, mark as anomalous
-                if probability < 0.05:
-                    anomalies.append({
-                        'type': 'unlikely_transition',
-                        'from': prev_type,
-                        'to': current_type,
-                        'probability': probability
-                    })
-                    anomaly_score = max(anomaly_score, 1 - (probability / 0.05))
-            else:
+            if unknown[i]:
                 # Transition doesn't exist in model
                 anomalies.append({
                     'type': 'unknown_transition',
                     'from': prev_type,
                     'to': current_type
                 })
-                anomaly_score = max(anomaly_score, 0.7)
+            else:
+                anomalies.append({
+                    'type': 'unlikely_transition',
+                    'from': prev_type,
+                    'to': current_type,
+                    'probability': float(transition_probs[i])
+                })
         
         # Check for unusual patterns
         unusual_patterns = self._check_unusual_patterns(event_types)
@@ -292,11 +590,7 @@ class SessionAnomalyDetector:
             anomalies.extend(unusual_patterns)
             anomaly_score = max(anomaly_score, 0.8)
         
-        return {
-            'detected': len(anomalies) > 0,
-            'score': anomaly_score,
-            'details': anomalies
-        }
+        return _AnomalyResult(len(anomalies) > 0, anomaly_score, anomalies)
     
     def _check_unusual_patterns(self, event_types):
         """
@@ -304,16 +598,23 @@ class SessionAnomalyDetector:
         
         Args:
             event_types (list): Sequence of event types
-            
+        
         Returns:
             list: Unusual patterns detected
         """
         patterns = []
         
+        # Number each distinct type in this sequence so windows compare as integers;
+        # unknown types get their own codes rather than sharing one
+        codes = {}
+        sequence = np.fromiter((codes.setdefault(event_type, len(codes)) for event_type in event_types),
+                               dtype=np.intp, count=len(event_types))
+        
         # Check for repeated actions (more than 3 times in a row)
-        for i in range(len(event_types) - 3):
-            if (event_types[i] == event_types[i+1] == 
-                event_types[i+2] == event_types[i+3]):
+        if len(sequence) >= 4:
+            w = sliding_window_view(sequence, 4)
+            repeated = (w[:, 0] == w[:, 1]) & (w[:, 0] == w[:, 2]) & (w[:, 0] == w[:, 3])
+            for i in np.flatnonzero(repeated).tolist():
                 patterns.append({
                     'type': 'repeated_action',
                     'action': event_types[i],
@@ -322,10 +623,12 @@ class SessionAnomalyDetector:
                 })
         
         # Check for cyclic patterns (A-B-A-B-A-B)
-        for i in range(len(event_types) - 5):
-            if (event_types[i] == event_types[i+2] == event_types[i+4] and
-                event_types[i+1] == event_types[i+3] == event_types[i+5] and
-                event_types[i] != event_types[i+1]):
+        if len(sequence) >= 6:
+            w = sliding_window_view(sequence, 6)
+            cyclic = ((w[:, 0] == w[:, 2]) & (w[:, 2] == w[:, 4]) &
+                      (w[:, 1] == w[:, 3]) & (w[:, 3] == w[:, 5]) &
+                      (w[:, 0] != w[:, 1]))
+            for i in np.flatnonzero(cyclic).tolist():
                 patterns.append({
                     'type': 'cyclic_pattern',
                     'actions': [event_types[i], event_types[i+1]],
@@ -349,38 +652,49 @@ class SessionAnomalyDetector:
         
         Args:
             events (list): Session events
-            
+        
         Returns:
             dict: Activity anomaly details
         """
+        event_types = [event.get('type') for event in events]
+        activity_ids = np.fromiter((self._activity_id.get(event_type, 0) for event_type in event_types),
+                                   dtype=np.intp, count=len(event_types))
+        return self._activity_anomalies(events, event_types, activity_ids)._asdict()
+    
+    def _activity_anomalies(self, events, event_types, activity_ids):
+        """
+        Check for suspicious activities in the session
+        
+        Args:
+            events (list): Session events
+            event_types (list): Their event types
+            activity_ids (ndarray): Their suspicious activity ids, 0 for other events
+        
+        Returns:
+            _AnomalyResult: Activity anomaly details
+        """
         anomalies = []
         anomaly_score = 0
         
         # Count suspicious activities
-        suspicious_count = 0
-        total_risk = 0
+        suspicious = np.flatnonzero(activity_ids).tolist()
+        suspicious_count = len(suspicious)
+        total_risk = int(self._risk_lut[activity_ids].sum())
         
-        for i, event in enumerate(events):
-            event_type = event.get('type', '')
-            metadata = event.get('metadata', {})
-            
-            # Check if this is a suspicious activity
-            if event_type in self.suspicious_activities:
-                risk_level = self.suspicious_activities[event_type]
-                suspicious_count += 1
-                total_risk += risk_level
-                
-                anomalies.append({
-                    'type': 'suspicious_activity',
-                    'activity': event_type,
-                    'risk_level': risk_level,
-                    'index': i,
-                    'metadata': metadata
-                })
-                
-                # Calculate contribution to overall anomaly score
-                activity_score = min(risk_level / 30, 1.0)  # Normalize to 0-1
-                anomaly_score = max(anomaly_score, activity_score)
+        # Contribution to overall anomaly score
+        if suspicious:
+            anomaly_score = float(self._activity_score_lut[activity_ids].max())
+        
+        # Only the suspicious events need detail records
+        for i in suspicious:
+            event_type = event_types[i]
+            anomalies.append({
+                'type': 'suspicious_activity',
+                'activity': event_type,
+                'risk_level': self.suspicious_activities[event_type],
+                'index': i,
+                'metadata': events[i].get('metadata', {})
+            })
         
         # Check for multiple suspicious activities in one session
         if suspicious_count >= 3:
@@ -393,11 +707,7 @@ class SessionAnomalyDetector:
         elif suspicious_count >= 2:
             anomaly_score = max(anomaly_score, 0.7)  # Quite suspicious
         
-        return {
-            'detected': len(anomalies) > 0,
-            'score': anomaly_score,
-            'details': anomalies
-        }
+        return _AnomalyResult(len(anomalies) > 0, anomaly_score, anomalies)
     
     def _calculate_risk_score(self, anomaly_score):
         """
@@ -405,7 +715,7 @@ class SessionAnomalyDetector:
         
         Args:
             anomaly_score (float): Normalized anomaly score (0-1)
-            
+        
         Returns:
             int: Risk score (0-100)
         """
@@ -418,57 +728,36 @@ class SessionAnomalyDetector:
         scaled_score = (anomaly_score - 0.2) / 0.8 * 100
         return min(100, max(0, int(scaled_score)))
     
-    def _update_user_model(self, user_id, events, current_model):
+    def _update_user_model(self, user_id, columns, current_model, transition_matrix):
         """
         Update the user's behavioral model based on this session
         
         Args:
             user_id (str): User identifier
-            events (list): Session events
+            columns (_SessionColumns): Session events sorted by timestamp, split into columns
             current_model (dict): Current user model
+            transition_matrix (tuple): Dense (state_index, matrix) form of its transitions
         """
         try:
+            timestamps = columns.timestamps
+            event_types = columns.event_types
+            
             # Don't update if too few events
-            if len(events) < 2:
+            if len(event_types) < 2:
                 return
             
-            # Extract event types
-            event_types = [event.get('type') for event in events]
-            
             # Update transition matrix
-            transitions = current_model.get('transitions', {}).copy()
-            
-            for i in range(1, len(event_types)):
-                prev_type = event_types[i-1]
-                current_type = event_types[i]
-                
-                # Ensure prev_type exists in transitions
-                if prev_type not in transitions:
-                    transitions[prev_type] = {}
-                
-                # Update transition probability
-                transition_count = transitions[prev_type].get(current_type, 0)
-                transitions[prev_type][current_type] = transition_count + 0.1
-                
-                # Normalize probabilities
-                total = sum(transitions[prev_type].values())
-                for key in transitions[prev_type]:
-                    transitions[prev_type][key] /= total
+            transitions = _updated_transitions(*transition_matrix, event_types)
             
             # Update timing statistics
-            session_length = events[-1].get('timestamp', 0) - events[0].get('timestamp', 0)
+            session_length = timestamps[-1] - timestamps[0]
             current_avg_length = current_model.get('avg_session_length', 
                                                 self.time_thresholds['typical_session_length'])
             
-            time_diffs = []
-            for i in range(1, len(events)):
-                current_time = events[i].get('timestamp', 0)
-                previous_time = events[i-1].get('timestamp', 0)
-                time_diff = current_time - previous_time
-                if time_diff > 0 and time_diff < self.time_thresholds['max_time_for_sequence']:
-                    time_diffs.append(time_diff)
+            time_diffs = np.diff(np.asarray(timestamps))
+            time_diffs = time_diffs[(time_diffs > 0) & (time_diffs < self.time_thresholds['max_time_for_sequence'])]
             
-            avg_time_diff = sum(time_diffs) / len(time_diffs) if time_diffs else 30
+            avg_time_diff = float(time_diffs.mean()) if time_diffs.size else 30
             current_avg_time_diff = current_model.get('avg_time_between_actions', 30)
             
             # Update session count
@@ -478,19 +767,21 @@ class SessionAnomalyDetector:
             alpha = 0.8  # Weight for existing model (more weight = slower adaptation)
             
             updated_model = {
-                'transitions': transitions,
+                **_encoded_transitions(*transitions),
                 'avg_session_length': (alpha * current_avg_length + (1 - alpha) * session_length),
                 'avg_time_between_actions': (alpha * current_avg_time_diff + (1 - alpha) * avg_time_diff),
                 'common_actions': self._update_common_actions(current_model.get('common_actions', []), event_types),
                 'session_count': session_count,
-                'last_updated': int(time.time())
+                'last_updated': time.time_ns() // 1_000_000_000
             }
             
-            # Store updated model
-            self.db.update_user_model(user_id, updated_model)
-            
+            # Store updated model; the cached copy is replaced so the next session sees it,
+            # tagged with the written version so a later write by another worker replaces it
+            version = self.db.update_user_model(user_id, updated_model)
+            self._cache_user_model(user_id, version, updated_model, transitions)
+        
         except Exception as e:
-            logger.error(f"Error updating user model: {str(e)}")
+            logger.error("Error updating user model: %s", e)
     
     def _update_common_actions(self, current_common, new_actions):
         """
@@ -499,7 +790,7 @@ class SessionAnomalyDetector:
         Args:
             current_common (list): Current common actions
             new_actions (list): New action types from this session
-            
+        
         Returns:
             list: Updated common actions
         """
@@ -1,10 +1,41 @@
+import copy
 import logging
+from functools import lru_cache
 from user_agents import parse
 import re
 from app.database import Database
 
 logger = logging.getLogger(__name__)
 
+# Distinct User-Agent strings whose analysis is kept; real traffic repeats a small set
+_ANALYSIS_CACHE_MAXSIZE = 16384
+
+# Minimum safe versions for common browsers
+_MIN_BROWSER_VERSIONS = {
+    'Chrome': (90, 0),
+    'Firefox': (85, 0),
+    'Safari': (14, 0),
+    'Edge': (90, 0),
+    'Internet Explorer': (11, 0)  # All versions are considered outdated
+}
+
+# Browser/OS combinations rarely seen from real users
+_UNCOMMON_COMBINATIONS = frozenset({
+    ('Safari', 'Windows'),
+    ('Edge', 'iOS'),
+    ('Internet Explorer', 'Android'),
+    ('Internet Explorer', 'iOS'),
+    ('Internet Explorer', 'Mac OS X')
+})
+
+# Tokens the inconsistency checks look for, found in one scan of the string
+_INCONSISTENCY_TOKENS = re.compile(r'Firefox|Chromium|Chrome|Mac OS|iPhone|iPad|Windows')
+
+@lru_cache(maxsize=4096)
+def _version_tuple(version):
+    """Numeric parts of a dotted version string, e.g. '90.0.4430' -> (90, 0, 4430)"""
+    return tuple(int(p) for p in version.split('.') if p.isdigit())
+
 class UserAgentAnalyzer:
     """
     Analyzes User-Agent strings to detect anomalies and spoofing attempts.
@@ -16,8 +47,27 @@ class UserAgentAnalyzer:
             'googlebot', 'bingbot', 'yandexbot', 'baiduspider', 'twitterbot',
             'facebookexternalhit', 'slackbot', 'discordbot'
         ]
+        # One case-insensitive scan for any known bot name
+        self._bot_pattern = re.compile('|'.join(re.escape(bot) for bot in self.known_bots), re.IGNORECASE)
+        # Analysis depends only on the string, so results are cached per analyzer
+        self._analyze_cached = lru_cache(maxsize=_ANALYSIS_CACHE_MAXSIZE)(self._analyze)
         logger.info("UserAgentAnalyzer initialized")
     
+    def analyze_batch(self, user_agent_strings):
+        """
+        Analyze many User-Agent strings
+        
+        Repeated strings, which dominate real traffic, are parsed once per batch
+        (and once per analyzer while they stay in the cache).
+        
+        Args:
+            user_agent_strings (list): User-Agent strings from HTTP headers
+            
+        Returns:
+            list: Analysis results in the same order as user_agent_strings
+        """
+        return [self.analyze(user_agent_string) for user_agent_string in user_agent_strings]
+    
     def analyze(self, user_agent_string):
         """
         Analyze a User-Agent string for suspicious patterns
@@ -36,6 +86,25 @@ class UserAgentAnalyzer:
                 'user_agent_type': 'unknown'
             }
         
+        result = self._analyze_cached(user_agent_string)
+        
+        # Log suspicious User-Agents
+        if result['is_suspicious'] and 'error' not in result:
+            logger.warning(f"Suspicious User-Agent detected: {user_agent_string}")
+        
+        # Callers get their own copy so the cached result can't be modified
+        return copy.deepcopy(result)
+    
+    def _analyze(self, user_agent_string):
+        """
+        Analyze a non-empty User-Agent string, uncached
+        
+        Args:
+            user_agent_string (str): The User-Agent string from HTTP headers
+            
+        Returns:
+            dict: Analysis results including risk score and detected issues
+        """
         # Parse the user agent
         try:
             user_agent = parse(user_agent_string)
@@ -55,7 +124,7 @@ class UserAgentAnalyzer:
             issues = []
             
             # Check for known bot patterns
-            if any(bot in user_agent_string.lower() for bot in self.known_bots):
+            if self._bot_pattern.search(user_agent_string):
                 if not is_bot:
                     issues.append('bot_impersonation')
             
@@ -77,10 +146,6 @@ class UserAgentAnalyzer:
             # Determine user agent type
             ua_type = 'bot' if is_bot else ('mobile' if is_mobile else ('tablet' if is_tablet else 'desktop'))
             
-            # Log suspicious User-Agents
-            if risk_score > 50:
-                logger.warning(f"Suspicious User-Agent detected: {user_agent_string}")
-            
             # Prepare response
             return {
                 'risk_score': risk_score,
@@ -114,65 +179,35 @@ class UserAgentAnalyzer:
     
     def _is_uncommon_combination(self, browser_family, os_family):
         """Check if the browser and OS combination is uncommon"""
-        uncommon_combinations = [
-            ('Safari', 'Windows'),
-            ('Edge', 'iOS'),
-            ('Internet Explorer', 'Android'),
-            ('Internet Explorer', 'iOS'),
-            ('Internet Explorer', 'Mac OS X')
-        ]
-        
-        return (browser_family, os_family) in uncommon_combinations
+        return (browser_family, os_family) in _UNCOMMON_COMBINATIONS
     
     def _has_inconsistencies(self, ua_string, browser_family, os_family):
         """Check for inconsistencies in the User-Agent string"""
+        tokens = set(_INCONSISTENCY_TOKENS.findall(ua_string))
+        
         # Example: Check if Chrome UA has Safari token or vice versa
-        if browser_family == 'Chrome' and 'Firefox' in ua_string:
+        if browser_family == 'Chrome' and 'Firefox' in tokens:
             return True
-        if browser_family == 'Firefox' and 'Chrome' in ua_string and 'Chromium' not in ua_string:
+        if browser_family == 'Firefox' and 'Chrome' in tokens and 'Chromium' not in tokens:
             return True
         
         # Example: Check if Windows UA claims to be from Mac or vice versa
-        if os_family == 'Windows' and ('Mac OS' in ua_string or 'iPhone' in ua_string or 'iPad' in ua_string):
+        if os_family == 'Windows' and ('Mac OS' in tokens or 'iPhone' in tokens or 'iPad' in tokens):
             return True
-        if os_family == 'Mac OS X' and 'Windows' in ua_string:
+        if os_family == 'Mac OS X' and 'Windows' in tokens:
             return True
         
         return False
     
     def _is_outdated_browser(self, browser_family, version):
         """Check if the browser version is outdated"""
-        try:
-            # Define minimum safe versions for common browsers
-            min_versions = {
-                'Chrome': '90.0',
-                'Firefox': '85.0',
-                'Safari': '14.0',
-                'Edge': '90.0',
-                'Internet Explorer': '11.0'  # All versions are considered outdated
-            }
-            
-            if browser_family not in min_versions:
-                return False
-            
-            min_version = min_versions[browser_family]
-            
-            # Simple version comparison (for more complex cases, use packaging.version)
-            current_parts = [int(p) for p in version.split('.') if p.isdigit()]
-            min_parts = [int(p) for p in min_version.split('.') if p.isdigit()]
-            
-            # Compare major version first, then minor
-            for i in range(min(len(current_parts), len(min_parts))):
-                if current_parts[i] < min_parts[i]:
-                    return True
-                elif current_parts[i] > min_parts[i]:
-                    return False
-            
-            return len(current_parts) < len(min_parts)
-            
-        except Exception as e:
-            logger.error(f"Error checking browser version: {str(e)}")
+        min_version = _MIN_BROWSER_VERSIONS.get(browser_family)
+        if min_version is None:
             return False
+        
+        # Tuples compare major version first, then minor; a shorter matching
+        # prefix counts as older
+        return _version_tuple(version) < min_version
     
     def _calculate_risk_score(self, issues):
         """Calculate risk score based on detected issues"""
@@ -855,7 +855,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 <h4>Previous Login</h4>
                 <ul class="details-list">
                     <li><strong>IP Address:</strong> ${prevLogin.ip || 'Unknown'}</li>
-                    <li><strong>Timestamp:</strong> ${prevLogin.timestamp || 'Unknown'}</li>
+                    <li><strong>Timestamp:</strong> ${prevLogin.timestamp ? new Date(prevLogin.timestamp * 1000).toLocaleString() : 'Unknown'}</li>
                     <li><strong>Location:</strong> ${prevLogin.location ? `${prevLogin.location.city || 'Unknown'}, ${prevLogin.location.country || 'Unknown'}` : 'Unknown'}</li>
                     <li><strong>Coordinates:</strong> ${prevLogin.location ? `${prevLogin.location.latitude || 0}, ${prevLogin.location.longitude || 0}` : 'Unknown'}</li>
                 </ul>
@@ -865,7 +865,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 <h4>Current Login</h4>
                 <ul class="details-list">
                     <li><strong>IP Address:</strong> ${currLogin.ip || 'Unknown'}</li>
-                    <li><strong>Timestamp:</strong> ${currLogin.timestamp || 'Unknown'}</li>
+                    <li><strong>Timestamp:</strong> ${currLogin.timestamp ? new Date(currLogin.timestamp * 1000).toLocaleString() : 'Unknown'}</li>
                     <li><strong>Location:</strong> ${currLogin.location ? `${currLogin.location.city || 'Unknown'}, ${currLogin.location.country || 'Unknown'}` : 'Unknown'}</li>
                     <li><strong>Coordinates:</strong> ${currLogin.location ? `${currLogin.location.latitude || 0}, ${currLogin.location.longitude || 0}` : 'Unknown'}</li>
                 </ul>
@@ -0,0 +1,55 @@
+import atexit
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """
+    Runs database writes on a background thread so they stay off the request path.
+    When the queue is full the write runs on the caller's thread instead of being lost.
+    """
+    
+    def __init__(self, name, maxsize=10000):
+        """
+        Args:
+            name (str): Name of the worker thread
+            maxsize (int): Maximum number of writes waiting to run
+        """
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        
+        # Finish queued writes before the interpreter exits
+        atexit.register(self.flush)
+    
+    def submit(self, fn, *args):
+        """
+        Queue a write to run in the background
+        
+        Args:
+            fn (callable): Write function
+            *args: Arguments passed to fn
+        """
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            logger.warning("Background write queue full, writing synchronously")
+            fn(*args)
+    
+    def flush(self):
+        """Block until every queued write has run"""
+        self._queue.join()
+    
+    def _run(self):
+        """Worker loop: run queued writes one at a time"""
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Error in background write: {str(e)}")
+            finally:
+                self._queue.task_done()
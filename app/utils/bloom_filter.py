@@ -0,0 +1,91 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+# File header: magic, number of bits, number of hashes, item count
+_HEADER = struct.Struct('<8sQII')
+_MAGIC = b'BLOOMv1\x00'
+
+
+class BloomFilter:
+    """
+    Space-efficient probabilistic set membership.
+    Never returns false negatives; false positives occur at roughly error_rate.
+    """
+    
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        Args:
+            capacity (int): Expected number of items
+            error_rate (float): Target false positive rate
+        """
+        capacity = max(capacity, 1)
+        
+        # Optimal bit count and number of hash functions for the target error rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+    
+    def _positions(self, item):
+        """Bit positions for an item using double hashing over one 128-bit digest"""
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+    
+    def add(self, item):
+        """Add an item to the filter"""
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+    
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+    
+    def __len__(self):
+        return self.count
+    
+    def save(self, path):
+        """
+        Write the filter to a file, replacing any existing file atomically
+        
+        Args:
+            path (str): Destination file path
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Open a saved filter as a read-only memory map
+        
+        Every process that loads the same file shares one page-cache copy of the bits.
+        
+        Args:
+            path (str): File written by save()
+            
+        Returns:
+            BloomFilter: Read-only filter backed by the file
+        """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        
+        magic, num_bits, num_hashes, count = _HEADER.unpack_from(mapped)
+        if magic != _MAGIC:
+            mapped.close()
+            raise ValueError(f"Not a Bloom filter file: {path}")
+        
+        bloom = cls.__new__(cls)
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom.count = count
+        bloom.bits = memoryview(mapped)[_HEADER.size:]
+        return bloom
@@ -1,52 +1,132 @@
+import ipaddress
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 import pymongo
 import logging
+from app.database import (
+    password_attack_stats_pipeline, password_attack_stats_from_facets,
+    password_attack_stats_batch_pipeline, password_attack_stats_from_batch_facets
+)
 
 logger = logging.getLogger(__name__)
 
+# Fields of ip_data documents the predictors read
+_IP_DATA_PROJECTION = {'_id': 0, 'ip_address': 1, 'location': 1, 'reputation': 1}
+
+# ip_data documents are reused for a short time, bounded to the most recent IPs
+_IP_CACHE_TTL = 60
+_IP_CACHE_MAXSIZE = 1000
+
+# Fields of login history records the predictors read
+_LOGIN_HISTORY_PROJECTION = {'_id': 0, 'user_id': 1, 'timestamp': 1, 'ip_address': 1, 'device_id': 1}
+
+# Compound indexes matching the per-user/per-IP newest-first queries, so Mongo
+# walks the index in order and stops at the limit instead of sorting in memory
+_INDEXES = {
+    'logins': [[('user_id', pymongo.ASCENDING), ('timestamp', pymongo.DESCENDING)]],
+    'failed_logins': [
+        [('username', pymongo.ASCENDING), ('timestamp', pymongo.DESCENDING)],
+        [('ip_address', pymongo.ASCENDING), ('timestamp', pymongo.DESCENDING)]
+    ]
+}
+
 # MongoDB connection
+@lru_cache(maxsize=1)
 def get_mongodb_client():
-    """Get MongoDB client instance"""
+    """Get the shared MongoDB client instance; pymongo clients are thread-safe and pool connections"""
     MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
     DB_NAME = os.environ.get('MONGO_DB', 'fraud_detection_test')
     
-    client = pymongo.MongoClient(MONGO_URI)
+    client = pymongo.MongoClient(MONGO_URI, maxPoolSize=50, minPoolSize=5, waitQueueTimeoutMS=2000)
     db = client[DB_NAME]
+    _ensure_indexes(db)
     
     return client, db
 
+def _ensure_indexes(db):
+    """Create the query indexes if they don't exist yet"""
+    try:
+        for collection, indexes in _INDEXES.items():
+            for keys in indexes:
+                db[collection].create_index(keys)
+    except Exception as e:
+        logger.error(f"Error creating MongoDB indexes: {str(e)}")
+
+def _in_network(ip_address, network):
+    """Whether an address string belongs to an ip_network; False if it does not parse"""
+    try:
+        return ipaddress.ip_address(ip_address) in network
+    except ValueError:
+        return False
+
 # Mock database class for integrating with predictors
 class MockDatabase:
     def __init__(self, db_instance):
         self.db = db_instance
+        # LRU of ip_data documents fetched through this instance, {} when missing:
+        # {ip_address: (expires_at, document)}
+        self._ip_cache = OrderedDict()
+        self._ip_cache_lock = threading.Lock()
     
     def get_login_history(self, user_id, limit=10):
-        return list(self.db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(limit))
+        return list(self.db.logins.find({'user_id': user_id}, _LOGIN_HISTORY_PROJECTION).sort('timestamp', -1).limit(limit))
+    
+    def get_login_histories(self, user_ids, limit=10):
+        # Limited per-user queries walk the (user_id, timestamp) index and stop at
+        # the limit instead of reading every login of every user
+        return {user_id: self.get_login_history(user_id, limit) for user_id in user_ids}
     
     def get_last_login(self, user_id):
-        logins = list(self.db.logins.find({'user_id': user_id}).sort('timestamp', -1).limit(1))
-        return logins[0] if logins else None
+        # Full document: geo-velocity compares against the login's location
+        return self.db.logins.find_one({'user_id': user_id}, sort=[('timestamp', -1)])
     
     def store_login(self, login_data):
         # In test mode, we don't need to store anything
         pass
     
+    def _get_ip_data(self, ip_address):
+        # One fetch serves location, reputation and bundle lookups for the same IP
+        now = time.monotonic()
+        with self._ip_cache_lock:
+            entry = self._ip_cache.get(ip_address)
+            if entry and entry[0] > now:
+                self._ip_cache.move_to_end(ip_address)
+                return entry[1]
+        
+        ip_data = self.db.ip_data.find_one({'ip_address': ip_address}, _IP_DATA_PROJECTION) or {}
+        with self._ip_cache_lock:
+            self._ip_cache[ip_address] = (now + _IP_CACHE_TTL, ip_data)
+            self._ip_cache.move_to_end(ip_address)
+            if len(self._ip_cache) > _IP_CACHE_MAXSIZE:
+                self._ip_cache.popitem(last=False)
+        return ip_data
+    
     def get_ip_location(self, ip_address):
-        ip_data = self.db.ip_data.find_one({'ip_address': ip_address})
-        if ip_data and 'location' in ip_data:
-            return ip_data['location']
-        return None
+        return self._get_ip_data(ip_address).get('location')
     
     def get_ip_reputation(self, ip_address):
-        ip_data = self.db.ip_data.find_one({'ip_address': ip_address})
-        if ip_data and 'reputation' in ip_data:
-            return ip_data['reputation']
-        return None
+        return self._get_ip_data(ip_address).get('reputation')
     
     def update_ip_reputation(self, ip_address, reputation_data):
         # In test mode, we don't need to update anything
         pass
     
+    def get_ip_bundle(self, ip_address, failed_window_minutes=1440):
+        ip_data = self._get_ip_data(ip_address)
+        return {
+            'reputation': ip_data.get('reputation'),
+            'location': ip_data.get('location'),
+            'failed_logins_24h': None
+        }
+    
+    def update_ip_reputations(self, updates):
+        # In test mode, we don't need to update anything
+        return True
+    
     def get_device_data(self, device_id=None, user_id=None):
         if device_id:
             return self.db.devices.find_one({'device_id': device_id})
@@ -58,6 +138,10 @@ class MockDatabase:
         # In test mode, we don't need to store anything
         pass
     
+    def record_visit(self, device_id, timestamp, fingerprint_data, issues):
+        # In test mode, we don't need to store anything
+        pass
+    
     def get_recent_failed_logins(self, username=None, ip_address=None, minutes=30):
         cutoff_time = int(time.time()) - (minutes * 60)
         query = {'timestamp': {'$gt': cutoff_time}}
@@ -69,12 +153,31 @@ class MockDatabase:
             
         return list(self.db.failed_logins.find(query))
     
+    def get_password_attack_stats(self, user_id, ip_address, windows, now=None):
+        pipeline = password_attack_stats_pipeline(user_id, ip_address, windows, now or time.time())
+        return password_attack_stats_from_facets(next(self.db.failed_logins.aggregate(pipeline)))
+    
+    def get_password_attack_stats_batch(self, pairs, ip_addresses, windows, now=None):
+        pipeline = password_attack_stats_batch_pipeline(pairs, ip_addresses, windows, now or time.time())
+        facets = next(self.db.failed_logins.aggregate(pipeline))
+        return password_attack_stats_from_batch_facets(facets, pairs, ip_addresses)
+    
     def get_user_model(self, user_id):
         return self.db.user_models.find_one({'user_id': user_id})
     
+    def get_user_models(self, user_ids):
+        models = {user_id: None for user_id in user_ids}
+        for model in self.db.user_models.find({'user_id': {'$in': list(models)}}):
+            models[model['user_id']] = model
+        return models
+    
+    def get_user_model_version(self, user_id):
+        model = self.db.user_models.find_one({'user_id': user_id}, {'model_version': 1, '_id': 0})
+        return None if model is None else model.get('model_version', 0)
+    
     def update_user_model(self, user_id, model_data):
         # In test mode, we don't need to update anything
-        pass
+        return None
     
     def get_registrations(self, entity_type=None, entity_value=None):
         """
@@ -85,15 +188,37 @@ class MockDatabase:
         if entity_type == 'ip':
             query['ip_address'] = entity_value
         elif entity_type == 'subnet':
-            # For subnet, we need to match IPs that start with the subnet prefix
-            subnet_prefix = entity_value.split('/')[0]  # Get the network part without mask
-            subnet_prefix = subnet_prefix.rsplit('.', 1)[0]  # Remove the last octet
-            query['ip_address'] = {'$regex': f'^{subnet_prefix}'}
+            # Range scan over the indexed numeric IP; a string prefix would also
+            # match neighbouring subnets (192.168.1 matches 192.168.10.x)
+            try:
+                network = ipaddress.ip_network(entity_value, strict=False)
+            except ValueError:
+                return []
+            # Registrations stored before ip_int existed lack the field; they fall
+            # back to a prefix match on the whole octets, narrowed exactly below
+            prefix = ''.join(
+                re.escape(octet + '.')
+                for octet in str(network.network_address).split('.')[:network.prefixlen // 8]
+            )
+            query['$or'] = [
+                {'ip_int': {
+                    '$gte': int(network.network_address),
+                    '$lte': int(network.broadcast_address)
+                }},
+                {'ip_int': {'$exists': False}, 'ip_address': {'$regex': f'^{prefix}'}}
+            ]
         elif entity_type == 'email_domain':
             query['email_domain'] = entity_value
             
         # Get registrations matching query
-        registrations = list(self.db.registrations.find(query))
+        registrations = list(self.db.registrations.find(
+            query, {'timestamp': 1, 'ip_int': 1, 'ip_address': 1, '_id': 0}
+        ))
+        if entity_type == 'subnet':
+            registrations = [
+                r for r in registrations
+                if 'ip_int' in r or _in_network(r.get('ip_address'), network)
+            ]
         
         # Extract timestamps
         return [r['timestamp'] for r in registrations]
\ No newline at end of file
@@ -0,0 +1,115 @@
+import hashlib
+import math
+import numpy as np
+
+# Number of distinct items reported as examples
+EXAMPLE_COUNT = 10
+
+# 2 ** -rank for every possible register value
+_INVERSE_POWERS = 2.0 ** -np.arange(65, dtype=np.float64)
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter in a fixed few hundred bytes.
+    Items are held exactly until there are more than sparse_limit of them, so
+    counts at typical detection thresholds are exact; beyond that the standard
+    error is about 1.04 / sqrt(2 ** precision).
+    """
+    
+    def __init__(self, precision=8, sparse_limit=64):
+        """
+        Args:
+            precision (int): Bits of the hash used to pick a register (2 ** precision registers)
+            sparse_limit (int): Distinct items kept exactly before switching to registers
+        """
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.sparse_limit = sparse_limit
+        self.items = set()
+        self.registers = None
+        # First distinct items seen, kept for reporting
+        self.examples = []
+    
+    def _update_register(self, item):
+        """Record an item's hash in its register"""
+        h = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'little')
+        index = h >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rank = remaining_bits - (h & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def _densify(self):
+        """Switch from exact items to registers"""
+        self.registers = bytearray(self.num_registers)
+        for item in self.items:
+            self._update_register(item)
+        self.items = None
+    
+    def add(self, item):
+        """Add an item to the counter"""
+        if self.registers is None:
+            if item in self.items:
+                return
+            self.items.add(item)
+            if len(self.examples) < EXAMPLE_COUNT:
+                self.examples.append(item)
+            if len(self.items) > self.sparse_limit:
+                self._densify()
+        else:
+            self._update_register(item)
+    
+    def update(self, other):
+        """
+        Merge another counter of the same precision into this one
+        
+        Args:
+            other (HyperLogLog): Counter to merge
+        """
+        for item in other.examples:
+            if len(self.examples) >= EXAMPLE_COUNT:
+                break
+            if item not in self.examples:
+                self.examples.append(item)
+        
+        if other.registers is None:
+            if self.registers is None:
+                self.items |= other.items
+                if len(self.items) > self.sparse_limit:
+                    self._densify()
+            else:
+                for item in other.items:
+                    self._update_register(item)
+            return
+        
+        if self.registers is None:
+            self._densify()
+        # Element-wise max in place, through numpy views of the register bytes
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        np.maximum(registers, np.frombuffer(other.registers, dtype=np.uint8), out=registers)
+    
+    def count(self):
+        """
+        Estimate the number of distinct items added
+        
+        Returns:
+            int: Exact count in sparse mode, otherwise the HyperLogLog estimate
+        """
+        if self.registers is None:
+            return len(self.items)
+        
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        estimate = alpha * m * m / float(_INVERSE_POWERS[registers].sum())
+        
+        # Linear counting is more accurate while many registers are still empty
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        
+        return int(round(estimate))
+    
+    def __len__(self):
+        return self.count()
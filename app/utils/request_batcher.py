@@ -0,0 +1,97 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class RequestBatcher:
+    """
+    Coalesces concurrent lookups into batched calls on a background thread.
+    Requests that arrive while a batch is running are collected into the next
+    one, so an idle service adds no delay and a busy one makes one call per
+    batch instead of one per request. Identical keys in a batch are looked up once.
+    """
+    
+    def __init__(self, name, fn, max_wait=0.0, max_batch=100, timeout=5.0):
+        """
+        Args:
+            name (str): Name of the worker thread
+            fn (callable): Batch lookup taking a list of keys and returning results in the same order
+            max_wait (float): Seconds to keep collecting requests after the first one arrives
+            max_batch (int): Maximum number of distinct keys per call
+            timeout (float): Seconds submit waits for its result before giving up
+        """
+        self._fn = fn
+        self._max_wait = max_wait
+        self._max_batch = max_batch
+        self._timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def submit(self, key):
+        """
+        Look up a key as part of the next batch and wait for its result
+        
+        Args:
+            key: Hashable lookup key passed to fn
+        
+        Returns:
+            The result fn produced for the key; re-raises any error fn raised
+            
+        Raises:
+            concurrent.futures.TimeoutError: If no result arrives within the timeout
+        """
+        future = Future()
+        self._queue.put((key, future))
+        return future.result(timeout=self._timeout)
+    
+    def _collect(self):
+        """Wait for a request, then gather whatever else is pending into one batch"""
+        pending = {}
+        key, future = self._queue.get()
+        pending[key] = [future]
+        deadline = time.monotonic() + self._max_wait
+        
+        while len(pending) < self._max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    key, future = self._queue.get(timeout=timeout)
+                else:
+                    key, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.setdefault(key, []).append(future)
+        
+        return pending
+    
+    def _run(self):
+        """Worker loop: run one batched call per collected batch and fan out the results"""
+        while True:
+            pending = self._collect()
+            keys = list(pending)
+            
+            try:
+                results = self._fn(keys)
+            except Exception as e:
+                logger.error("Error in batched lookup: %s", e)
+                for futures in pending.values():
+                    for future in futures:
+                        future.set_exception(e)
+                continue
+            
+            for key, result in zip(keys, results):
+                for future in pending[key]:
+                    future.set_result(result)
+            
+            # Never leave a caller waiting on a key the batch function dropped
+            if len(results) < len(keys):
+                error = ValueError(f"Batched lookup returned {len(results)} results for {len(keys)} keys")
+                logger.error("%s", error)
+                for key in keys[len(results):]:
+                    for future in pending[key]:
+                        future.set_exception(error)
@@ -0,0 +1,207 @@
+import itertools
+import sys
+import threading
+from collections import Counter, deque
+from app.utils.hyperloglog import HyperLogLog
+
+# Most recent failure timestamps per IP returned for velocity and acceleration
+ATTACK_TIMESTAMP_LIMIT = 5000
+
+# Windows answered with distinct counts rather than failure counts
+_DISTINCT_WINDOWS = ('credential_stuffing', 'password_spraying')
+
+
+class _Window:
+    """
+    Failed logins inside one trailing time window, kept oldest first.
+    Running totals per user and per (user, IP) are kept alongside, and each
+    failure is subtracted once when it leaves the window, so expiry work
+    scales with the failures that expired rather than with the window.
+    """
+    
+    def __init__(self, seconds):
+        self.seconds = seconds
+        # (timestamp, username, ip_address), oldest first
+        self.events = deque()
+        self.by_user = Counter()
+        self.by_pair = Counter()
+        self.ip_timestamps = {}
+    
+    def add(self, timestamp, username, ip_address):
+        self.events.append((timestamp, username, ip_address))
+        self.by_user[username] += 1
+        self.by_pair[(username, ip_address)] += 1
+        self.ip_timestamps.setdefault(ip_address, deque()).append(timestamp)
+    
+    def expire(self, now):
+        """Drop failures before the window start, keeping timestamp >= now - seconds like the database query"""
+        start = now - self.seconds
+        events = self.events
+        
+        while events and events[0][0] < start:
+            _, username, ip_address = events.popleft()
+            _decrement(self.by_user, username, 1)
+            _decrement(self.by_pair, (username, ip_address), 1)
+            timestamps = self.ip_timestamps[ip_address]
+            timestamps.popleft()
+            if not timestamps:
+                del self.ip_timestamps[ip_address]
+
+
+class _DistinctWindow:
+    """
+    Distinct users and IPs inside one trailing time window, as per-minute
+    HyperLogLog buckets. A query merges the buckets still inside the window,
+    so the window edge moves in whole minutes: sketches cannot forget single
+    users, so distinct counts may include failures up to a minute older than
+    the database query would.
+    """
+    
+    def __init__(self, seconds):
+        self.seconds = seconds
+        # [minute, {ip: users sketch}, users sketch, IPs sketch], oldest first
+        self.buckets = deque()
+    
+    def add(self, timestamp, username, ip_address):
+        minute = int(timestamp) // 60
+        if not self.buckets or self.buckets[-1][0] != minute:
+            self.buckets.append([minute, {}, HyperLogLog(), HyperLogLog()])
+        
+        _, ip_users, users, ips = self.buckets[-1]
+        if ip_address not in ip_users:
+            ip_users[ip_address] = HyperLogLog()
+        ip_users[ip_address].add(username)
+        users.add(username)
+        ips.add(ip_address)
+    
+    def expire(self, now):
+        """Drop buckets for minutes entirely before the window"""
+        first_minute = int(now - self.seconds) // 60
+        buckets = self.buckets
+        
+        while buckets and buckets[0][0] < first_minute:
+            buckets.popleft()
+    
+    def ip_users(self, ip_address):
+        """Distinct users with failures from an IP, as a merged sketch"""
+        merged = HyperLogLog()
+        for _, ip_users, _, _ in self.buckets:
+            if ip_address in ip_users:
+                merged.update(ip_users[ip_address])
+        return merged
+    
+    def users_and_ips(self):
+        """Distinct users and IPs with failures, as merged sketches"""
+        users = HyperLogLog()
+        ips = HyperLogLog()
+        for _, _, bucket_users, bucket_ips in self.buckets:
+            users.update(bucket_users)
+            ips.update(bucket_ips)
+        return users, ips
+
+
+def _decrement(counter, key, amount):
+    """Decrement a count, removing the key at zero"""
+    counter[key] -= amount
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class SlidingWindowStore:
+    """
+    Incrementally maintained failed login counts for the password attack windows.
+    Each failed login is added once to every window; queries only pay for
+    the failures that expired since the previous query. Distinct user and IP counts come from HyperLogLog
+    sketches, which stay exact up to their sparse limit.
+    """
+    
+    def __init__(self, windows):
+        """
+        Args:
+            windows (dict): Window lengths in seconds for 'generic', 'bruteforce',
+                'credential_stuffing' and 'password_spraying'
+        """
+        self._windows = {
+            name: (_DistinctWindow if name in _DISTINCT_WINDOWS else _Window)(seconds)
+            for name, seconds in windows.items()
+        }
+        self._lock = threading.Lock()
+    
+    def add(self, timestamp, username, ip_address):
+        """
+        Record a failed login
+        
+        Args:
+            timestamp (float): Time of the failed login
+            username (str): Username
+            ip_address (str): IP address
+        """
+        # Interned so the many counters and sketches keyed by these strings share
+        # one copy each and dict lookups can match on identity
+        username = sys.intern(username)
+        ip_address = sys.intern(ip_address)
+        
+        with self._lock:
+            for window in self._windows.values():
+                window.add(timestamp, username, ip_address)
+    
+    def stats(self, user_id, ip_address, now):
+        """
+        Get password attack stats for a user and IP
+        
+        Args:
+            user_id (str): User identifier
+            ip_address (str): IP address
+            now (float): Reference time for all windows
+        
+        Returns:
+            dict: Password attack stats, see Database.get_password_attack_stats
+        """
+        return {**self.user_stats(user_id, ip_address, now), **self.ip_stats(ip_address, now)}
+    
+    def user_stats(self, user_id, ip_address, now):
+        """
+        Get the password attack stats that depend on the user
+        
+        Returns:
+            dict: user_failures_count and bruteforce_attempts
+        """
+        with self._lock:
+            self._expire(now)
+            return {
+                'user_failures_count': self._windows['generic'].by_user[user_id],
+                'bruteforce_attempts': self._windows['bruteforce'].by_pair[(user_id, ip_address)]
+            }
+    
+    def ip_stats(self, ip_address, now):
+        """
+        Get the password attack stats that depend only on the IP
+        
+        Returns:
+            dict: IP failure count and most recent timestamps, credential stuffing
+                and password spraying counts
+        """
+        with self._lock:
+            self._expire(now)
+            stuffing_users = self._windows['credential_stuffing'].ip_users(ip_address)
+            spraying_users, spraying_ips = self._windows['password_spraying'].users_and_ips()
+            
+            timestamps = self._windows['generic'].ip_timestamps.get(ip_address, ())
+            recent = list(itertools.islice(reversed(timestamps), ATTACK_TIMESTAMP_LIMIT))
+            recent.reverse()
+            
+            return {
+                'ip_failures_count': len(timestamps),
+                'ip_failure_timestamps': recent,
+                'stuffing_user_count': stuffing_users.count(),
+                'stuffing_users': stuffing_users.examples,
+                'spraying_user_count': spraying_users.count(),
+                'spraying_ip_count': spraying_ips.count(),
+                'spraying_users': spraying_users.examples,
+                'spraying_ips': spraying_ips.examples
+            }
+    
+    def _expire(self, now):
+        """Bring every window up to now"""
+        for window in self._windows.values():
+            window.expire(now)
@@ -509,12 +509,15 @@ def generate_database(db):
         registrations.append({
             'timestamp': timestamp,
             'ip_address': ip_address,
+            'ip_int': int(ipaddress.IPv4Address(ip_address)),
             'email_domain': email_domain,
             'success': random.random() < 0.9  # 90% success rate
         })
     
     if registrations:
         db.registrations.insert_many(registrations)
+        # Subnet lookups are range scans over the numeric IP
+        db.registrations.create_index('ip_int')
     
     logger.info("Generating session events...")
     # Generate session events
@@ -5,13 +5,38 @@ import pandas as pd
 from datetime import datetime, timedelta
 from typing import Dict, Any, List
 import logging
+import threading
+import time
 
 from ml.models.base import BaseAnomalyDetector
 from core.config import settings
 from .base import BaseAnomalyDetector, convert_to_datetime
+from .compiled_forest import CompiledIsolationForest
 
 logger = logging.getLogger(__name__)
 
+# Training sets at least this large are fitted on all CPU cores
+PARALLEL_FIT_MIN_ROWS = 10000
+
+# Cyclical encodings for every hour of the day and day of the week, indexed by value
+_HOUR_SIN = tuple(np.sin(2 * np.pi * np.arange(24) / 24).tolist())
+_HOUR_COS = tuple(np.cos(2 * np.pi * np.arange(24) / 24).tolist())
+_DAY_SIN = tuple(np.sin(2 * np.pi * np.arange(7) / 7).tolist())
+_DAY_COS = tuple(np.cos(2 * np.pi * np.arange(7) / 7).tolist())
+
+# Per-thread (1, n_features) row reused by single-event predictions
+_scratch = threading.local()
+
+
+def _utc_offsets(ts: np.ndarray):
+    """Local UTC offsets in seconds for an array of timestamps, or one int without DST"""
+    if not time.daylight:
+        return -time.timezone
+    
+    return np.fromiter(
+        (time.localtime(t).tm_gmtoff for t in ts.tolist()), dtype=np.int64, count=len(ts)
+    )
+
 
 class AccessTimeAnomalyDetector(BaseAnomalyDetector):
     """Detects anomalies in access patterns based on time of day and day of week"""
@@ -21,7 +46,8 @@ class AccessTimeAnomalyDetector(BaseAnomalyDetector):
         self.model = IsolationForest(
             contamination=0.05,  # Expected proportion of outliers
             random_state=42,
-            n_estimators=100
+            n_estimators=50,   # Detection quality plateaus well before the default 100 trees
+            max_samples=256
         )
         self.feature_names = [
             'hour', 'day_of_week', 'minute', 'is_weekend',
@@ -33,11 +59,15 @@ class AccessTimeAnomalyDetector(BaseAnomalyDetector):
     
     def extract_features(self, event_data: Dict[str, Any], historical_data: List[Dict[str, Any]] = None) -> np.ndarray:
         """Extract time-based features from event data"""
-        # Then in your extract_features methods:
-        timestamp = convert_to_datetime(event_data.get('timestamp'))
-        
         timestamp = event_data.get('timestamp')
-        if isinstance(timestamp, int):
+        
+        # Epoch-second timestamps take the integer arithmetic path, no datetimes needed
+        if isinstance(timestamp, (int, np.integer)):
+            history_ts = self._history_epoch_seconds(historical_data)
+            if history_ts is not None:
+                return self.extract_timestamp_features(int(timestamp), history_ts)
+        
+        if isinstance(timestamp, (int, np.integer)):
             # Unix timestamp (seconds since epoch)
             timestamp = datetime.fromtimestamp(timestamp)
         elif isinstance(timestamp, str):
@@ -61,10 +91,10 @@ class AccessTimeAnomalyDetector(BaseAnomalyDetector):
         features['is_weekend'] = 1 if timestamp.weekday() >= 5 else 0
         
         # Cyclical encoding for hour and day
-        features['hour_sin'] = np.sin(2 * np.pi * timestamp.hour / 24)
-        features['hour_cos'] = np.cos(2 * np.pi * timestamp.hour / 24)
-        features['day_sin'] = np.sin(2 * np.pi * timestamp.weekday() / 7)
-        features['day_cos'] = np.cos(2 * np.pi * timestamp.weekday() / 7)
+        features['hour_sin'] = _HOUR_SIN[timestamp.hour]
+        features['hour_cos'] = _HOUR_COS[timestamp.hour]
+        features['day_sin'] = _DAY_SIN[timestamp.weekday()]
+        features['day_cos'] = _DAY_COS[timestamp.weekday()]
         
         # Historical pattern features
         if historical_data:
@@ -81,6 +111,13 @@ class AccessTimeAnomalyDetector(BaseAnomalyDetector):
         # Convert to numpy array in the correct order
         return np.array([features[name] for name in self.feature_names])
     
+    def _history_epoch_seconds(self, historical_data: List[Dict[str, Any]]) -> np.ndarray:
+        """History timestamps as an int64 array, or None if any is not in epoch seconds"""
+        timestamps = [event.get('timestamp') for event in historical_data or []]
+        if not all(isinstance(ts, (int, np.integer)) for ts in timestamps):
+            return None
+        return np.array(timestamps, dtype=np.int64)
+    
     def _extract_historical_features(self, features: Dict, current_time: datetime, historical_data: List[Dict[str, Any]]):
         """Extract features based on historical access patterns"""
         # Convert historical data to timestamps
@@ -136,27 +173,200 @@ class AccessTimeAnomalyDetector(BaseAnomalyDetector):
         else:
             features['time_since_last_access'] = 24  # Default value
     
+    def predict_timestamps(self, event_ts: int, history_ts: np.ndarray, summary: tuple = None) -> float:
+        """Predict anomaly score from a login timestamp and an array of past login timestamps"""
+        if not self.is_trained:
+            raise ValueError(f"Model {self.model_name} is not trained")
+        
+        row = getattr(_scratch, 'row', None)
+        if row is None or row.shape[1] != len(self.feature_names):
+            row = _scratch.row = np.empty((1, len(self.feature_names)))
+        
+        self._fill_timestamp_features(row[0], event_ts, history_ts, summary)
+        return self._score_features(row)
+    
+    def predict_timestamps_batch(self, event_ts: List[int], histories: List[np.ndarray],
+                                 summaries: List[tuple] = None) -> np.ndarray:
+        """Predict anomaly scores for many events with a single model call"""
+        if not self.is_trained:
+            raise ValueError(f"Model {self.model_name} is not trained")
+        
+        if summaries is None:
+            summaries = [None] * len(histories)
+        
+        features = np.vstack([
+            self.extract_timestamp_features(ts, history_ts, summary)
+            for ts, history_ts, summary in zip(event_ts, histories, summaries)
+        ])
+        return self._score_feature_matrix(features)
+    
+    def summarize_history(self, history_ts: np.ndarray) -> tuple:
+        """
+        Compute the event-independent part of the historical features
+        
+        Each past login is converted with its own UTC offset, as datetime.fromtimestamp
+        does, so the result can be reused for any event against the same history.
+        Returns None for an empty history.
+        """
+        if not len(history_ts):
+            return None
+        
+        local_history = history_ts + _utc_offsets(history_ts)
+        access_hours = (local_history // 3600) % 24
+        return (
+            local_history,
+            int(local_history.max()),
+            access_hours.mean(),
+            access_hours.std() if len(access_hours) > 1 else 6,
+            int(access_hours.min()),
+            int(access_hours.max())
+        )
+    
+    def extract_timestamp_features(self, event_ts: int, history_ts: np.ndarray, summary: tuple = None) -> np.ndarray:
+        """
+        Extract the same features as extract_features, computed with integer
+        arithmetic over an int64 array of epoch seconds instead of datetimes
+        """
+        features = np.empty(len(self.feature_names))
+        self._fill_timestamp_features(features, event_ts, history_ts, summary)
+        return features
+    
+    def _fill_timestamp_features(self, out: np.ndarray, event_ts: int, history_ts: np.ndarray, summary: tuple = None):
+        """Write the timestamp features into out, a 1D array in feature_names order"""
+        # Work in local time like datetime.fromtimestamp does
+        utc_offset = time.localtime(event_ts).tm_gmtoff
+        local_ts = event_ts + utc_offset
+        
+        hour = (local_ts // 3600) % 24
+        day_of_week = (local_ts // 86400 + 3) % 7  # 1970-01-01 was a Thursday
+        
+        out[0] = hour
+        out[1] = day_of_week
+        out[2] = (local_ts // 60) % 60
+        out[3] = 1 if day_of_week >= 5 else 0
+        out[4] = _HOUR_SIN[hour]
+        out[5] = _HOUR_COS[hour]
+        out[6] = _DAY_SIN[day_of_week]
+        out[7] = _DAY_COS[day_of_week]
+        
+        if len(history_ts):
+            if summary is None:
+                summary = self.summarize_history(history_ts)
+            local_history, last_access, avg_hour, std_hour, min_hour, max_hour = summary
+            
+            # Compare in local wall-clock seconds, as the naive datetime path does
+            out[8] = (local_ts - last_access) / 3600
+            out[9] = np.count_nonzero(local_history >= local_ts - 3600)
+            out[10] = np.count_nonzero(local_history >= local_ts - 86400)
+            out[11] = avg_hour
+            out[12] = std_hour
+            out[13] = 1 if min_hour <= hour <= max_hour else 0
+        else:
+            # Default values when no historical data
+            out[8:] = (0, 0, 0, 12, 6, 0)
+    
     def train(self, training_data: pd.DataFrame):
         """Train the Isolation Forest model"""
         logger.info(f"Training {self.model_name} with {len(training_data)} samples")
         
-        # Extract features for all training data
-        features_list = []
-        
-        for idx, row in training_data.iterrows():
-            # Get historical data for this user
-            user_history = training_data[
-                (training_data['user_id'] == row['user_id']) & 
-                (training_data['timestamp'] < row['timestamp'])
-            ].to_dict('records')
+        # Extract features for all training data; datetime columns are handled in
+        # one vectorized pass, other timestamp formats event by event
+        if pd.api.types.is_datetime64_dtype(training_data['timestamp']):
+            X = self._extract_training_features(training_data)
+        else:
+            features_list = []
             
-            features = self.extract_features(row.to_dict(), user_history)
-            features_list.append(features)
-        
-        X = np.array(features_list)
+            for idx, row in training_data.iterrows():
+                # Get historical data for this user
+                user_history = training_data[
+                    (training_data['user_id'] == row['user_id']) & 
+                    (training_data['timestamp'] < row['timestamp'])
+                ].to_dict('records')
+                
+                features = self.extract_features(row.to_dict(), user_history)
+                features_list.append(features)
+            
+            X = np.array(features_list)
         
-        # Train the model
-        self.model.fit(X)
+        # Train the model, building trees in parallel for large training sets only;
+        # inference keeps the single-threaded setting
+        n_jobs = self.model.n_jobs
+        if len(X) >= PARALLEL_FIT_MIN_ROWS:
+            self.model.set_params(n_jobs=-1)
+        try:
+            self.model.fit(X)
+        finally:
+            self.model.set_params(n_jobs=n_jobs)
         self.is_trained = True
+        self._compile_model()
         
         logger.info(f"Training completed for {self.model_name}")
+    
+    def _extract_training_features(self, training_data: pd.DataFrame) -> np.ndarray:
+        """
+        Extract features for every row of a datetime64 training set at once
+        
+        Each row's history is the same user's rows with an earlier timestamp, as in
+        train's row-by-row path: within a user's time-sorted accesses the history is
+        a prefix, so its window counts come from binary searches and its hour
+        statistics from cumulative sums, minima and maxima.
+        """
+        timestamps = training_data['timestamp']
+        ns = timestamps.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        hour = timestamps.dt.hour.to_numpy(dtype=np.int64)
+        day_of_week = timestamps.dt.weekday.to_numpy(dtype=np.int64)
+        
+        X = np.empty((len(training_data), len(self.feature_names)))
+        X[:, 0] = hour
+        X[:, 1] = day_of_week
+        X[:, 2] = timestamps.dt.minute.to_numpy()
+        X[:, 3] = day_of_week >= 5
+        X[:, 4] = np.take(_HOUR_SIN, hour)
+        X[:, 5] = np.take(_HOUR_COS, hour)
+        X[:, 6] = np.take(_DAY_SIN, day_of_week)
+        X[:, 7] = np.take(_DAY_COS, day_of_week)
+        # Default values when no historical data
+        X[:, 8:] = (0, 0, 0, 12, 6, 0)
+        
+        hour_ns = 3600 * 10**9
+        for positions in training_data.groupby('user_id', sort=False).indices.values():
+            order = positions[np.argsort(ns[positions], kind='stable')]
+            user_ns = ns[order]
+            user_hours = hour[order]
+            
+            # Size of each access's history: accesses strictly before it
+            history_size = np.searchsorted(user_ns, user_ns, side='left')
+            has_history = history_size > 0
+            rows = order[has_history]
+            current_ns = user_ns[has_history]
+            current_hour = user_hours[has_history]
+            size = history_size[has_history]
+            last = size - 1
+            
+            X[rows, 8] = (current_ns - user_ns[last]) / hour_ns
+            X[rows, 9] = size - np.searchsorted(user_ns, current_ns - hour_ns, side='left')
+            X[rows, 10] = size - np.searchsorted(user_ns, current_ns - 24 * hour_ns, side='left')
+            
+            mean_hour = np.cumsum(user_hours)[last] / size
+            variance = np.cumsum(user_hours * user_hours)[last] / size - mean_hour ** 2
+            X[rows, 11] = mean_hour
+            X[rows, 12] = np.where(size > 1, np.sqrt(np.maximum(variance, 0)), 6)
+            
+            min_hour = np.minimum.accumulate(user_hours)[last]
+            max_hour = np.maximum.accumulate(user_hours)[last]
+            X[rows, 13] = (min_hour <= current_hour) & (current_hour <= max_hour)
+        
+        return X
+    
+    def load_model(self):
+        """Load trained model from disk and compile it for inference"""
+        super().load_model()
+        self._compile_model()
+    
+    def _compile_model(self):
+        """Flatten the fitted forest so scoring skips sklearn's per-tree Python loop"""
+        try:
+            self.compiled_model = CompiledIsolationForest(self.model)
+        except Exception as e:
+            logger.warning(f"Could not compile {self.model_name}, scoring with sklearn: {str(e)}")
+            self.compiled_model = None
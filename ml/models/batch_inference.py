@@ -0,0 +1,79 @@
+# ml/models/batch_inference.py
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BatchInferenceQueue:
+    """
+    Collects single-event predictions from concurrent callers and runs them
+    through a batch predict function together. Events that arrive while a batch
+    is being scored are collected into the next one, so an idle service adds no
+    delay and a busy one makes one model call per batch.
+    """
+    
+    def __init__(self, predict_batch_fn: Callable, max_batch_size: int = 64, max_wait: float = 0.0):
+        """
+        Args:
+            predict_batch_fn: Takes (events, histories) lists, returns a sequence of scores
+            max_batch_size: Largest batch handed to predict_batch_fn
+            max_wait: Seconds to keep collecting events after the first one arrives
+        """
+        self.predict_batch_fn = predict_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='batch-inference', daemon=True)
+        self._worker.start()
+    
+    def submit(self, event, history) -> Future:
+        """Queue one event for scoring; the returned future resolves to its score"""
+        future = Future()
+        self._queue.put((event, history, future))
+        return future
+    
+    def _collect_batch(self) -> List:
+        """Block for the first event, then gather whatever else is pending until the batch is full"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        return batch
+    
+    def _run(self):
+        """Worker loop scoring batches and resolving their futures"""
+        while True:
+            batch = self._collect_batch()
+            events, histories, futures = zip(*batch)
+            
+            try:
+                scores = self.predict_batch_fn(list(events), list(histories))
+            except Exception as e:
+                logger.error("Batch inference failed for %s events: %s", len(batch), e)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            
+            for future, score in zip(futures, scores):
+                future.set_result(score)
+            
+            # Never leave a caller waiting on an event the batch function dropped
+            if len(scores) < len(futures):
+                error = ValueError(f"Batch inference returned {len(scores)} scores for {len(futures)} events")
+                logger.error(str(error))
+                for future in futures[len(scores):]:
+                    future.set_exception(error)
@@ -0,0 +1,129 @@
+# ml/models/compiled_forest.py
+import numpy as np
+from sklearn.ensemble import IsolationForest
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Average path length of an unsuccessful BST search over n samples"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    
+    lengths[n_samples == 2] = 1.0
+    large = n_samples > 2
+    n = n_samples[large]
+    lengths[large] = 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+    return lengths
+
+
+class CompiledIsolationForest:
+    """
+    Fitted IsolationForest flattened into padded node arrays.
+    
+    All trees are walked together, one numpy step per tree level, instead of
+    sklearn's Python loop that calls apply() on every tree in turn. Scores
+    match IsolationForest.score_samples.
+    """
+    
+    def __init__(self, forest: IsolationForest):
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        n_trees = len(trees)
+        n_nodes = max(tree.node_count for tree in trees)
+        
+        # Leaves point back to themselves so extra traversal steps are no-ops
+        self.feature = np.zeros((n_trees, n_nodes), dtype=np.intp)
+        self.threshold = np.full((n_trees, n_nodes), np.inf)
+        self.left = np.tile(np.arange(n_nodes, dtype=np.intp), (n_trees, 1))
+        self.right = self.left.copy()
+        self.leaf_depth = np.zeros((n_trees, n_nodes))
+        # Share of a node's training samples discarded by taking each branch, as log(n_parent / n_child)
+        self.left_gain = np.zeros((n_trees, n_nodes))
+        self.right_gain = np.zeros((n_trees, n_nodes))
+        self.max_depth = 0
+        
+        for t, (tree, features) in enumerate(zip(trees, forest.estimators_features_)):
+            count = tree.node_count
+            split = tree.children_left[:count] != -1
+            nodes = np.flatnonzero(split)
+            
+            self.feature[t, nodes] = np.asarray(features)[tree.feature[nodes]]
+            self.threshold[t, nodes] = tree.threshold[nodes]
+            self.left[t, nodes] = tree.children_left[nodes]
+            self.right[t, nodes] = tree.children_right[nodes]
+            
+            n_node_samples = tree.n_node_samples.astype(np.float64)
+            self.left_gain[t, nodes] = np.log(n_node_samples[nodes] / n_node_samples[tree.children_left[nodes]])
+            self.right_gain[t, nodes] = np.log(n_node_samples[nodes] / n_node_samples[tree.children_right[nodes]])
+            
+            # Depth of every node, one level at a time
+            depth = np.zeros(count)
+            frontier = np.array([0])
+            level = 0
+            while frontier.size:
+                depth[frontier] = level
+                frontier = frontier[split[frontier]]
+                frontier = np.concatenate((tree.children_left[frontier], tree.children_right[frontier]))
+                level += 1
+            self.max_depth = max(self.max_depth, level - 1)
+            
+            # Path length of a sample ending in each leaf, as IsolationForest counts it
+            self.leaf_depth[t, :count] = depth + _average_path_length(tree.n_node_samples[:count])
+        
+        self.n_trees = n_trees
+        self.n_features = forest.n_features_in_
+        self.offset_ = forest.offset_
+        self._denominator = n_trees * _average_path_length([forest.max_samples_])[0]
+        self._tree_index = np.arange(n_trees)
+    
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        """Opposite of the anomaly score, as IsolationForest.score_samples"""
+        # sklearn trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, None]
+        trees = self._tree_index
+        node = np.zeros((X.shape[0], self.n_trees), dtype=np.intp)
+        
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[trees, node]] <= self.threshold[trees, node]
+            node = np.where(go_left, self.left[trees, node], self.right[trees, node])
+        
+        depths = self.leaf_depth[trees, node].sum(axis=1)
+        return -(2.0 ** (-depths / self._denominator))
+    
+    def score_samples_with_importance(self, X: np.ndarray) -> tuple:
+        """
+        Score samples and attribute each score to the features on their isolation paths
+        
+        Each split on a sample's path credits its feature with how sharply it cut the
+        sample's partition down, log(n_parent / n_child) in training samples, so the
+        splits that actually isolate the sample carry the weight. Importances are
+        normalized to sum to 1 per sample.
+        
+        Returns:
+            tuple: (score_samples output, importance array of shape (n_samples, n_features))
+        """
+        X = np.asarray(X, dtype=np.float32)
+        n_samples = X.shape[0]
+        rows = np.arange(n_samples)[:, None]
+        trees = self._tree_index
+        node = np.zeros((n_samples, self.n_trees), dtype=np.intp)
+        importance = np.zeros((n_samples, self.n_features))
+        sample_index = np.broadcast_to(rows, node.shape)
+        
+        for _ in range(self.max_depth):
+            feature = self.feature[trees, node]
+            go_left = X[rows, feature] <= self.threshold[trees, node]
+            gain = np.where(go_left, self.left_gain[trees, node], self.right_gain[trees, node])
+            np.add.at(importance, (sample_index, feature), gain)
+            node = np.where(go_left, self.left[trees, node], self.right[trees, node])
+        
+        importance /= np.maximum(importance.sum(axis=1, keepdims=True), np.finfo(np.float64).tiny)
+        
+        depths = self.leaf_depth[trees, node].sum(axis=1)
+        return -(2.0 ** (-depths / self._denominator)), importance
+    
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """Average anomaly score shifted by the fitted offset, as IsolationForest.decision_function"""
+        return self.score_samples(X) - self.offset_
@@ -11,7 +11,7 @@ import json
 
 from ml.models.base import BaseAnomalyDetector
 from core.config import settings
-from .base import BaseAnomalyDetector, convert_to_datetime
+from .base import BaseAnomalyDetector, convert_to_datetime, MODEL_COMPRESSION
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +27,9 @@ class SessionAnomalyDetector(BaseAnomalyDetector):
             gamma='scale'
         )
         self.scaler = StandardScaler()
+        # Frozen copies of the fitted scaler parameters, applied inline in predict
+        self._mean = None
+        self._inv_scale = None
         self.feature_names = [
             'session_duration', 'request_count', 'unique_endpoints',
             'data_volume', 'error_rate', 'avg_response_time',
@@ -319,6 +322,7 @@ class SessionAnomalyDetector(BaseAnomalyDetector):
         
         # Fit the scaler and transform data
         X_scaled = self.scaler.fit_transform(X_normal)
+        self._cache_scaling()
         
         # Train the model on normal data only
         self.model.fit(X_scaled)
@@ -337,8 +341,8 @@ class SessionAnomalyDetector(BaseAnomalyDetector):
         if features.ndim == 1:
             features = features.reshape(1, -1)
         
-        # Scale features
-        features_scaled = self.scaler.transform(features)
+        # Scale features with the cached scaler parameters
+        features_scaled = (features - self._mean) * self._inv_scale
         
         # Get anomaly score
         anomaly_score = self.model.decision_function(features_scaled)[0]
@@ -349,6 +353,11 @@ class SessionAnomalyDetector(BaseAnomalyDetector):
         
         return np.clip(score, 0, 1)
     
+    def _cache_scaling(self):
+        """Cache the fitted scaler's mean and inverse scale, bypassing sklearn's per-call validation"""
+        self._mean = self.scaler.mean_.astype(np.float64)
+        self._inv_scale = 1.0 / self.scaler.scale_.astype(np.float64)
+    
     def save_model(self):
         """Override to save scaler as well"""
         if not self.is_trained:
@@ -366,7 +375,7 @@ class SessionAnomalyDetector(BaseAnomalyDetector):
         }
         
         import joblib
-        joblib.dump(model_data, model_file)
+        joblib.dump(model_data, model_file, compress=MODEL_COMPRESSION)
         logger.info(f"Model {self.model_name} saved to {model_file}")
     
     def load_model(self):
@@ -382,6 +391,7 @@ class SessionAnomalyDetector(BaseAnomalyDetector):
         model_data = joblib.load(model_file)
         self.model = model_data['model']
         self.scaler = model_data['scaler']
+        self._cache_scaling()
         self.feature_names = model_data['feature_names']
         self.is_trained = model_data['is_trained']
         